@@ -0,0 +1,300 @@
+"""
+Non-interactive batch compression.
+
+Collects PDF files from directories, glob patterns and manifest files,
+compresses them across a process pool - or queues them for the workers of
+a shared work queue - and records every outcome in a JSONL journal, so an
+interrupted run can be resumed without redoing finished files.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional
+
+from pdf_compressor import PDFCompressor
+from result_cache import DEFAULT_MAX_BYTES, open_cache
+
+if TYPE_CHECKING:
+    from work_queue import WorkQueue
+
+
+def discover_inputs(inputs: Iterable[str], manifest: Optional[str] = None) -> List[str]:
+    """
+    Expand inputs into a sorted list of PDF files.
+
+    Args:
+        inputs: Files, directories (searched recursively) or glob patterns
+        manifest: Optional text file with one input per line; blank lines
+            and lines starting with # are ignored
+
+    Returns:
+        Absolute paths of the PDF files found, without duplicates
+    """
+    patterns = list(inputs)
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(line if os.path.isabs(line) else os.path.join(base, line))
+
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(glob.escape(pattern), '**', '*'), recursive=True)
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            matches = [pattern]
+        for path in matches:
+            if os.path.isfile(path) and path.lower().endswith('.pdf'):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+def output_path_for(input_path: str, output_dir: Optional[str] = None,
+                    suffix: str = '_compressed', root: Optional[str] = None) -> str:
+    """
+    Work out where the compressed copy of an input goes.
+
+    Without output_dir the output sits next to the input. With it, the
+    input's path relative to root (when given) is mirrored below output_dir.
+    """
+    name, ext = os.path.splitext(os.path.basename(input_path))
+    filename = f"{name}{suffix}{ext}"
+    if not output_dir:
+        return os.path.join(os.path.dirname(input_path), filename)
+    relative_dir = ''
+    if root:
+        relative_dir = os.path.relpath(os.path.dirname(input_path), root)
+        if relative_dir.startswith('..'):
+            relative_dir = ''
+    return os.path.normpath(os.path.join(output_dir, relative_dir, filename))
+
+
+def is_output_current(input_path: str, output_path: str) -> bool:
+    """Whether an output exists and is newer than its input."""
+    return (os.path.exists(output_path) and
+            os.path.getmtime(output_path) >= os.path.getmtime(input_path))
+
+
+class BatchJournal:
+    """
+    Append-only JSONL record of finished batch files.
+
+    Each line describes one file: its input and output paths, the input's
+    size and modification time, the settings used and the outcome.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._done = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A run killed mid-write leaves a truncated last line
+                        continue
+                    if record.get('status') == 'ok':
+                        self._done[record['input']] = record
+                    else:
+                        self._done.pop(record.get('input'), None)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def is_done(self, input_path: str, output_path: str, settings: dict) -> bool:
+        """Whether a file was already compressed the same way and is unchanged since."""
+        record = self._done.get(input_path)
+        if record is None or record.get('settings') != settings or record.get('output') != output_path:
+            return False
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return False
+        return (record.get('input_size') == stat.st_size and
+                record.get('input_mtime') == stat.st_mtime and
+                os.path.exists(output_path))
+
+    def record(self, result: dict) -> None:
+        """Append a result and flush it to disk immediately."""
+        self._file.write(json.dumps(result) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if result.get('status') == 'ok':
+            self._done[result['input']] = result
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# Result caches opened by this worker process, by directory
+_caches = {}
+
+
+def _worker_cache(cache_dir: Optional[str], cache_bytes: Optional[int]):
+    """Open a result cache once per worker process rather than once per file."""
+    if not cache_dir:
+        return None
+    if cache_dir not in _caches:
+        _caches[cache_dir] = open_cache(cache_dir, cache_bytes or DEFAULT_MAX_BYTES)
+    return _caches[cache_dir]
+
+
+def compress_file(task: dict) -> dict:
+    """
+    Compress one file of a batch. Runs inside a worker process.
+
+    Args:
+        task: Dictionary with input, output, settings, and optionally
+            cache_dir and cache_bytes
+
+    Returns:
+        Journal record for the file
+    """
+    settings = task['settings']
+    record = {
+        'input': task['input'],
+        'output': task['output'],
+        'input_size': None,
+        'input_mtime': None,
+        'settings': settings,
+    }
+    started = time.monotonic()
+    try:
+        # The input may have gone or become unreadable since it was listed
+        stat = os.stat(task['input'])
+        record['input_size'], record['input_mtime'] = stat.st_size, stat.st_mtime
+        output_dir = os.path.dirname(task['output'])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        compressor = PDFCompressor(cache=_worker_cache(task.get('cache_dir'), task.get('cache_bytes')))
+        success, message = compressor.compress_pdf(
+            task['input'], task['output'], settings['level'], settings['quality'],
+            settings['remove_metadata'], deduplicate=settings['dedupe'],
+            object_streams=settings.get('object_streams', False),
+            prune_resources=settings.get('prune', False),
+            linearize=settings.get('linearize', False),
+            streaming=settings.get('streaming', False),
+            memory_limit=(settings['memory_limit'] * 1024 * 1024
+                          if settings.get('memory_limit') else None),
+            optimize_streams=settings.get('optimize_streams', False),
+            optimize_scans=settings.get('optimize_scans', False)
+        )
+    except Exception as e:
+        success, message = False, str(e)
+    record.update({
+        'status': 'ok' if success else 'failed',
+        'message': message,
+        'seconds': round(time.monotonic() - started, 3),
+        'finished_at': time.time(),
+    })
+    if success:
+        record['output_size'] = os.path.getsize(task['output'])
+    return record
+
+
+def run_batch(tasks: List[dict], jobs: int = 1,
+              on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Compress tasks across a process pool.
+
+    Args:
+        tasks: Task dictionaries as accepted by compress_file
+        jobs: Number of worker processes (0 uses one per CPU core)
+        on_result: Called in the parent process as each file finishes
+
+    Returns:
+        Journal records, in completion order
+    """
+    results = []
+    if jobs == 1:
+        for task in tasks:
+            result = compress_file(task)
+            results.append(result)
+            if on_result:
+                on_result(result)
+        return results
+
+    with ProcessPoolExecutor(max_workers=jobs or None) as pool:
+        futures = [pool.submit(compress_file, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def queued_task_id(task: dict) -> str:
+    """
+    Id of a task in the work queue.
+
+    It depends on the file, its size and modification time, and the
+    settings, so a batch run again after an interruption picks up the tasks
+    it already queued instead of queueing them twice.
+    """
+    try:
+        stat = os.stat(task['input'])
+        size, mtime = stat.st_size, stat.st_mtime
+    except OSError:
+        # Queued all the same; its worker records the failure
+        size = mtime = None
+    description = json.dumps([task['input'], task['output'], task['settings'],
+                              size, mtime], sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+
+def run_queued(queue: 'WorkQueue', tasks: List[dict],
+               on_result: Optional[Callable[[dict], None]] = None,
+               poll_interval: float = 1.0) -> List[dict]:
+    """
+    Compress tasks on the workers of a work queue and wait for them.
+
+    Args:
+        queue: The shared work queue ``cli.py worker`` processes take from
+        tasks: Task dictionaries as accepted by compress_file, with
+            absolute paths every worker can reach
+        on_result: Called as each file finishes
+        poll_interval: Seconds between looks at the queue
+
+    Returns:
+        Journal records, in completion order
+    """
+    waiting = dict(zip(queue.enqueue([{'kind': 'batch', 'task': task} for task in tasks],
+                                     [queued_task_id(task) for task in tasks]), tasks))
+    results = []
+
+    def finish(task_id: str, result: dict) -> None:
+        del waiting[task_id]
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    def failure(task: dict, message: str) -> dict:
+        return {'input': task['input'], 'output': task['output'], 'settings': task['settings'],
+                'status': 'failed', 'message': message, 'finished_at': time.time()}
+
+    while waiting:
+        tasks = queue.get_many(list(waiting))
+        # Removed by another batch queueing the same file, or purged
+        for task_id in set(waiting) - {task['id'] for task in tasks}:
+            finish(task_id, failure(waiting[task_id], 'Task was removed from the work queue '
+                                                      'before its result was collected'))
+        finished = [task for task in tasks if task['status'] in ('done', 'failed')]
+        for task in finished:
+            if task['status'] == 'done':
+                finish(task['id'], task['result'])
+            else:
+                # Failed for good, or every attempt raised or lost its worker
+                finish(task['id'], failure(waiting[task['id']], task['error']))
+        if finished:
+            queue.remove([task['id'] for task in finished])
+        if waiting:
+            time.sleep(poll_interval)
+    return results
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the compression engines.
+
+Generates a deterministic corpus of synthetic PDFs (text-heavy,
+image-heavy, scanned, many-page, duplicate-resource and extracted-page
+documents), runs
+every engine and level over it and reports wall time, peak RSS, output
+size and compression ratio as JSON. Every output is parsed again and must
+have as many pages as its input. A previous report can be given as a
+baseline, in which case regressions are flagged and the exit code is 1.
+
+Each case runs in a fresh process so that peak RSS is measured per case.
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import click
+import PyPDF2
+from colorama import init, Fore
+from PIL import Image, ImageChops, ImageDraw
+from PyPDF2 import PageObject
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from gs_pool import GS_QUALITY_MAP, build_gs_command
+from pdf_compressor import PDFCompressor
+from result_cache import file_sha256
+
+init(autoreset=True)
+
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), 'pdfcompressor-benchmark')
+
+# Settings run for each engine
+ENGINE_SETTINGS = {
+    # objstm is medium written with object streams and a cross-reference stream;
+    # target searches image settings for an output a quarter of the input's size;
+    # stream is high written page by page under STREAM_MEMORY_LIMIT;
+    # lossless is medium with every stream recompressed losslessly;
+    # scans is medium with gray and black-and-white scans re-encoded
+    'pypdf': ['low', 'medium', 'high', 'images', 'objstm', 'target', 'stream', 'lossless',
+              'scans'],
+    'ghostscript': list(GS_QUALITY_MAP),
+    'auto': ['ebook'],
+}
+
+# The target setting aims for 1/TARGET_FRACTION of the input size
+TARGET_FRACTION = 4
+
+# Memory ceiling of the stream setting. Its peak RSS should not depend on the
+# document, so a case that needs more than this fails.
+STREAM_MEMORY_LIMIT = 96 * 1024 * 1024
+
+# Default regression thresholds, as fractions of the baseline value
+TIME_TOLERANCE = 0.10
+SIZE_TOLERANCE = 0.01
+RSS_TOLERANCE = 0.10
+# Time differences below this many seconds are treated as noise
+TIME_NOISE_FLOOR = 0.05
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+
+# -- Corpus ---------------------------------------------------------------
+
+def _font(writer: PyPDF2.PdfWriter):
+    font = DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    })
+    return writer._add_object(font)
+
+
+def _image_xobject(writer: PyPDF2.PdfWriter, image: Image.Image, jpeg_quality: Optional[int] = None):
+    """Add an image XObject, JPEG-encoded when jpeg_quality is given, Flate otherwise."""
+    stream = DecodedStreamObject()
+    if jpeg_quality is not None:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=jpeg_quality)
+        stream.set_data(buffer.getvalue())
+        stream[NameObject('/Filter')] = NameObject('/DCTDecode')
+    else:
+        stream.set_data(zlib.compress(image.tobytes(), 6))
+        stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+    stream.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Image'),
+        NameObject('/Width'): NumberObject(image.width),
+        NameObject('/Height'): NumberObject(image.height),
+        NameObject('/ColorSpace'): NameObject('/DeviceRGB' if image.mode == 'RGB' else '/DeviceGray'),
+        NameObject('/BitsPerComponent'): NumberObject(8),
+    })
+    return writer._add_object(stream)
+
+
+def _add_page(writer: PyPDF2.PdfWriter, operations: List[str],
+              fonts: Optional[dict] = None, images: Optional[dict] = None) -> None:
+    page = PageObject.create_blank_page(None, PAGE_WIDTH, PAGE_HEIGHT)
+    resources = DictionaryObject()
+    if fonts:
+        resources[NameObject('/Font')] = DictionaryObject(
+            {NameObject(name): ref for name, ref in fonts.items()})
+    if images:
+        resources[NameObject('/XObject')] = DictionaryObject(
+            {NameObject(name): ref for name, ref in images.items()})
+    page[NameObject('/Resources')] = resources
+    content = DecodedStreamObject()
+    content.set_data('\n'.join(operations).encode())
+    page[NameObject('/Contents')] = writer._add_object(content)
+    writer.add_page(page)
+
+
+def _text_lines(rnd: random.Random, page: int, lines: int) -> List[str]:
+    words = ['compress', 'document', 'stream', 'object', 'page', 'image', 'font', 'the', 'of', 'and']
+    return [
+        f"BT /F1 10 Tf 40 {760 - i * 12} Td "
+        f"(Page {page} line {i}: {' '.join(rnd.choice(words) for _ in range(rnd.randint(4, 12)))}) Tj ET"
+        for i in range(lines)
+    ]
+
+
+def _photo(rnd: random.Random, width: int, height: int) -> Image.Image:
+    """A smooth, photo-like RGB image: random colours upscaled bicubically."""
+    small = Image.frombytes('RGB', (16, 12), rnd.randbytes(16 * 12 * 3))
+    return small.resize((width, height), Image.BICUBIC)
+
+
+def _scan(rnd: random.Random, width: int, height: int) -> Image.Image:
+    """A greyscale page scan: dark text-like bars on an off-white, noisy background."""
+    image = Image.new('L', (width, height), 245)
+    draw = ImageDraw.Draw(image)
+    margin = width // 10
+    line_height = height // 60
+    for y in range(margin, height - margin, line_height * 2):
+        x = margin
+        while x < width - margin:
+            word = rnd.randint(line_height, line_height * 5)
+            draw.rectangle([x, y, min(x + word, width - margin), y + line_height], fill=rnd.randint(10, 60))
+            x += word + line_height
+    # Sensor noise, which is what makes real scans expensive to store
+    noise = Image.frombytes('L', (width, height), rnd.randbytes(width * height)).point(lambda v: v // 24)
+    return ImageChops.subtract(image, noise)
+
+
+def make_text_pdf(path: str, pages: int, rnd: random.Random) -> None:
+    writer = PyPDF2.PdfWriter()
+    fonts = {'/F1': _font(writer)}
+    for page in range(pages):
+        _add_page(writer, _text_lines(rnd, page, 60), fonts)
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+
+def make_image_pdf(path: str, pages: int, rnd: random.Random) -> None:
+    writer = PyPDF2.PdfWriter()
+    fonts = {'/F1': _font(writer)}
+    for page in range(pages):
+        image = _image_xobject(writer, _photo(rnd, 1200, 900), jpeg_quality=95)
+        operations = _text_lines(rnd, page, 5) + ['q 400 0 0 300 100 300 cm /Im0 Do Q']
+        _add_page(writer, operations, fonts, {'/Im0': image})
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+
+def make_scanned_pdf(path: str, pages: int, rnd: random.Random) -> None:
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        # A letter page scanned at 150dpi
+        image = _image_xobject(writer, _scan(rnd, 1275, 1650))
+        _add_page(writer, [f'q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Im0 Do Q'], images={'/Im0': image})
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+
+def make_duplicate_pdf(path: str, pages: int, rnd: random.Random) -> None:
+    writer = PyPDF2.PdfWriter()
+    logo = _photo(rnd, 600, 200)
+    for page in range(pages):
+        # Every page carries its own copy of the same font and logo
+        fonts = {'/F1': _font(writer)}
+        image = _image_xobject(writer, logo, jpeg_quality=90)
+        operations = _text_lines(rnd, page, 30) + ['q 300 0 0 100 150 20 cm /Im0 Do Q']
+        _add_page(writer, operations, fonts, {'/Im0': image})
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+
+def make_extracted_pdf(path: str, pages: int, rnd: random.Random) -> None:
+    writer = PyPDF2.PdfWriter()
+    # Pages split out of a larger report keep all of its resources but
+    # only draw a couple of them
+    fonts = {f'/F{i}': _font(writer) for i in range(1, 6)}
+    images = {f'/Im{i}': _image_xobject(writer, _photo(rnd, 800, 600), jpeg_quality=90)
+              for i in range(12)}
+    for page in range(pages):
+        operations = _text_lines(rnd, page, 20) + [f'q 400 0 0 300 100 300 cm /Im{page % 2} Do Q']
+        _add_page(writer, operations, fonts, images)
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+
+# name -> (generator, pages at scale 1.0)
+CORPUS: Dict[str, tuple] = {
+    'text': (make_text_pdf, 200),
+    'images': (make_image_pdf, 40),
+    'scanned': (make_scanned_pdf, 10),
+    'many_pages': (make_text_pdf, 2000),
+    'duplicates': (make_duplicate_pdf, 60),
+    'extracted': (make_extracted_pdf, 20),
+}
+
+
+def build_corpus(directory: str, scale: float = 1.0, names: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Generate the corpus in directory, skipping documents already there.
+
+    Every document is generated from a fixed seed, so the same scale always
+    produces byte-identical files.
+
+    Returns:
+        Mapping of document name to path
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name in names or CORPUS:
+        generator, pages = CORPUS[name]
+        pages = max(1, round(pages * scale))
+        path = os.path.join(directory, f"{name}_{pages}p.pdf")
+        if not os.path.exists(path):
+            temp_path = f"{path}.tmp"
+            generator(temp_path, pages, random.Random(name))
+            os.replace(temp_path, path)
+        paths[name] = path
+    return paths
+
+
+# -- Running ----------------------------------------------------------------
+
+def _peak_rss() -> Optional[int]:
+    """Peak resident set size of this process and its children, in bytes."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _compress(engine: str, setting: str, input_path: str, output_path: str) -> None:
+    if engine == 'pypdf':
+        compressor = PDFCompressor()
+        if setting == 'images':
+            success, message = compressor.compress_images_in_pdf(input_path, output_path)
+        elif setting == 'objstm':
+            success, message = compressor.compress_pdf(input_path, output_path, 'medium',
+                                                       object_streams=True)
+        elif setting == 'stream':
+            success, message = compressor.compress_pdf(input_path, output_path, 'high',
+                                                       streaming=True,
+                                                       memory_limit=STREAM_MEMORY_LIMIT)
+        elif setting == 'lossless':
+            success, message = compressor.compress_pdf(input_path, output_path, 'medium',
+                                                       optimize_streams=True)
+        elif setting == 'scans':
+            success, message = compressor.compress_pdf(input_path, output_path, 'medium',
+                                                       optimize_scans=True)
+        elif setting == 'target':
+            success, message = compressor.compress_to_target(
+                input_path, output_path, os.path.getsize(input_path) // TARGET_FRACTION
+            )
+        else:
+            success, message = compressor.compress_pdf(input_path, output_path, setting)
+        if not success:
+            raise RuntimeError(message)
+    elif engine == 'ghostscript':
+        subprocess.run(build_gs_command(input_path, output_path, setting),
+                       check=True, capture_output=True)
+    elif engine == 'auto':
+        success, message = PDFCompressor().compress_auto(input_path, output_path, setting)
+        if not success:
+            raise RuntimeError(message)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+
+
+def _check_output(input_path: str, output_path: str) -> None:
+    """Raise unless the output parses strictly and has the input's page count."""
+    with open(input_path, 'rb') as file:
+        expected = len(PyPDF2.PdfReader(file).pages)
+    with open(output_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file, strict=True)
+        pages = len(reader.pages)
+        for page in reader.pages:
+            page.get_contents()
+    if pages != expected:
+        raise ValueError(f"{pages} pages, expected {expected}")
+
+
+def run_case(case: dict) -> dict:
+    """
+    Run one engine/setting over one document. Runs in its own process.
+
+    Returns:
+        The case with status, wall_time, peak_rss, output_size and ratio added
+    """
+    result = dict(case)
+    started = time.perf_counter()
+    try:
+        _compress(case['engine'], case['setting'], case['input'], case['output'])
+    except Exception as e:
+        result.update({'status': 'failed', 'error': str(e)})
+        return result
+    wall_time = time.perf_counter() - started
+    # Before the check below parses the whole output
+    peak_rss = _peak_rss()
+    try:
+        _check_output(case['input'], case['output'])
+    except Exception as e:
+        result.update({'status': 'failed', 'error': f"invalid output: {str(e)}"})
+        return result
+    output_size = os.path.getsize(case['output'])
+    result.update({
+        'status': 'ok',
+        'wall_time': round(wall_time, 4),
+        'peak_rss': peak_rss,
+        'output_size': output_size,
+        'ratio': round(output_size / case['input_size'], 4),
+    })
+    return result
+
+
+def run_benchmark(corpus: Dict[str, str], engines: List[str], output_dir: str,
+                  repeat: int = 1, on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Run every engine setting over every document.
+
+    With repeat > 1 each case runs several times; the fastest wall time and
+    the highest peak RSS are reported.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name, path in corpus.items():
+        for engine in engines:
+            for setting in ENGINE_SETTINGS[engine]:
+                case = {
+                    'document': name,
+                    'engine': engine,
+                    'setting': setting,
+                    'input': path,
+                    'output': os.path.join(output_dir, f"{name}.{engine}.{setting}.pdf"),
+                    'input_size': os.path.getsize(path),
+                }
+                runs = []
+                for _ in range(repeat):
+                    # A fresh process per run keeps peak RSS per case
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        runs.append(pool.submit(run_case, case).result())
+                result = runs[0]
+                if all(run['status'] == 'ok' for run in runs):
+                    result['wall_time'] = min(run['wall_time'] for run in runs)
+                    if result['peak_rss'] is not None:
+                        result['peak_rss'] = max(run['peak_rss'] for run in runs)
+                else:
+                    result = next(run for run in runs if run['status'] != 'ok')
+                del result['input'], result['output']
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    return results
+
+
+def compare(results: List[dict], baseline: List[dict],
+            time_tolerance: float = TIME_TOLERANCE,
+            size_tolerance: float = SIZE_TOLERANCE,
+            rss_tolerance: float = RSS_TOLERANCE) -> List[dict]:
+    """
+    Compare results with a baseline run.
+
+    Returns:
+        One entry per regression, naming the case, the metric, the baseline
+        and current values
+    """
+    previous = {(r['document'], r['engine'], r['setting']): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result['document'], result['engine'], result['setting'])
+        base = previous.get(key)
+        if base is None or base.get('status') != 'ok':
+            continue
+        case = {'document': key[0], 'engine': key[1], 'setting': key[2]}
+        if result['status'] != 'ok':
+            regressions.append(dict(case, metric='status', baseline='ok', current=result['status']))
+            continue
+        if (result['wall_time'] > base['wall_time'] * (1 + time_tolerance) and
+                result['wall_time'] - base['wall_time'] > TIME_NOISE_FLOOR):
+            regressions.append(dict(case, metric='wall_time', baseline=base['wall_time'],
+                                    current=result['wall_time']))
+        if result['output_size'] > base['output_size'] * (1 + size_tolerance):
+            regressions.append(dict(case, metric='output_size', baseline=base['output_size'],
+                                    current=result['output_size']))
+        if (result.get('peak_rss') and base.get('peak_rss') and
+                result['peak_rss'] > base['peak_rss'] * (1 + rss_tolerance)):
+            regressions.append(dict(case, metric='peak_rss', baseline=base['peak_rss'],
+                                    current=result['peak_rss']))
+    return regressions
+
+
+# -- Command line -------------------------------------------------------------
+
+@click.command()
+@click.option('--corpus-dir',
+              type=click.Path(file_okay=False),
+              default=DEFAULT_CORPUS_DIR,
+              show_default=True,
+              help='Where the synthetic corpus is generated and outputs are written')
+@click.option('--scale',
+              type=click.FloatRange(0, min_open=True),
+              default=1.0,
+              help='Multiplier for the page count of every document (e.g. 0.1 for a quick run)')
+@click.option('--document', '-d', 'documents',
+              type=click.Choice(list(CORPUS)),
+              multiple=True,
+              help='Only benchmark these documents (repeatable)')
+@click.option('--engine', '-e', 'engines',
+              type=click.Choice(list(ENGINE_SETTINGS)),
+              multiple=True,
+              help='Only benchmark these engines (repeatable)')
+@click.option('--repeat', '-r',
+              type=click.IntRange(1),
+              default=1,
+              help='Runs per case; the fastest is reported')
+@click.option('--output', '-o',
+              type=click.Path(dir_okay=False),
+              help='Write the JSON report to this file')
+@click.option('--baseline', '-b',
+              type=click.Path(exists=True, dir_okay=False),
+              help='Earlier JSON report to compare against')
+@click.option('--time-tolerance', type=float, default=TIME_TOLERANCE,
+              help='Allowed wall time increase over the baseline (fraction)')
+@click.option('--size-tolerance', type=float, default=SIZE_TOLERANCE,
+              help='Allowed output size increase over the baseline (fraction)')
+@click.option('--rss-tolerance', type=float, default=RSS_TOLERANCE,
+              help='Allowed peak RSS increase over the baseline (fraction)')
+def main(corpus_dir, scale, documents, engines, repeat, output, baseline,
+         time_tolerance, size_tolerance, rss_tolerance):
+    """Benchmark the compression engines on a synthetic PDF corpus."""
+    engines = list(engines or ENGINE_SETTINGS)
+    if 'ghostscript' in engines and shutil.which('gs') is None:
+        print(f"{Fore.YELLOW}⚠️  Ghostscript not found, skipping the ghostscript engine")
+        engines.remove('ghostscript')
+
+    print(f"{Fore.CYAN}📚 Generating corpus in {corpus_dir}...")
+    corpus = build_corpus(os.path.join(corpus_dir, 'corpus'), scale, list(documents) or None)
+    corpus_hashes = {name: file_sha256(path) for name, path in corpus.items()}
+
+    def on_result(result):
+        if result['status'] == 'ok':
+            rss = f"{result['peak_rss'] / 1048576:.0f}MB" if result['peak_rss'] else 'n/a'
+            print(f"   {result['document']:<12} {result['engine']:<12} {result['setting']:<9} "
+                  f"{result['wall_time']:>8.3f}s  {rss:>7}  ratio {result['ratio']:.3f}")
+        else:
+            print(f"{Fore.RED}   {result['document']:<12} {result['engine']:<12} "
+                  f"{result['setting']:<9} failed: {result['error']}")
+
+    print(f"\n{Fore.LIGHTBLUE_EX}⏱️  Running {', '.join(engines)}...")
+    results = run_benchmark(corpus, engines, os.path.join(corpus_dir, 'output'), repeat, on_result)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': scale,
+        'repeat': repeat,
+        'corpus': corpus_hashes,
+        'results': results,
+    }
+
+    regressions = []
+    if baseline:
+        with open(baseline, 'r', encoding='utf-8') as file:
+            baseline_report = json.load(file)
+        if baseline_report.get('scale') != scale:
+            print(f"{Fore.YELLOW}⚠️  Baseline was run at scale {baseline_report.get('scale')}")
+        changed = [name for name, digest in corpus_hashes.items()
+                   if baseline_report.get('corpus', {}).get(name, digest) != digest]
+        if changed:
+            print(f"{Fore.YELLOW}⚠️  Corpus differs from the baseline for: {', '.join(changed)}")
+        regressions = compare(results, baseline_report['results'],
+                              time_tolerance, size_tolerance, rss_tolerance)
+        report['baseline'] = baseline
+        report['regressions'] = regressions
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"\n{Fore.GREEN}✅ Report written to {output}")
+
+    if baseline:
+        if regressions:
+            print(f"\n{Fore.RED}❌ {len(regressions)} regression(s) against {baseline}:")
+            for r in regressions:
+                print(f"{Fore.RED}   {r['document']} {r['engine']} {r['setting']}: "
+                      f"{r['metric']} {r['baseline']} -> {r['current']}")
+            sys.exit(1)
+        print(f"\n{Fore.GREEN}✅ No regressions against {baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,25 @@ PDF Compressor CLI - A powerful command-line tool for compressing PDF files.
 
 import os
 import sys
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, List
 import click
 from colorama import init, Fore, Back, Style
-from tqdm import tqdm
-import time
-from pdf_compressor import PDFCompressor
+
+# PyPDF2, Pillow and tqdm are imported by the commands that need them, so
+# the CLI starts quickly and forwards commands to the daemon without them.
+# For the same reason the Ghostscript presets (the keys of
+# gs_pool.GS_QUALITY_MAP) and the default result cache size
+# (result_cache.DEFAULT_MAX_BYTES) are repeated here.
+GS_QUALITIES = ('screen', 'ebook', 'printer', 'prepress', 'default')
+DEFAULT_CACHE_MB = 1024
+
+if TYPE_CHECKING:
+    from pdf_compressor import PDFCompressor
+
+# Commands a daemon runs when the CLI is pointed at one (see cli_daemon)
+DAEMON_COMMANDS = ('compress', 'compress-images', 'info', 'estimate')
 
 # Initialize colorama for cross-platform colored output
 init(autoreset=True)
@@ -44,20 +58,89 @@ def print_splash_screen():
     print(f"\n{Fore.LIGHTBLUE_EX}Welcome to atlverse PDF Compressor!")
     print(f"{Fore.CYAN}Efficient PDF compression made simple.\n")
 
-def print_progress_bar(description: str, total: int):
-    """Display a progress bar with the given description."""
-    with tqdm(total=total, desc=description, 
-              bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]') as pbar:
-        for i in range(total):
-            time.sleep(0.1)  # Simulate work
-            pbar.update(1)
+@contextmanager
+def progress_bar(compressor: 'PDFCompressor', description: str):
+    """Display a progress bar that follows the compressor's progress events."""
+    from tqdm import tqdm
+    with tqdm(desc=description, unit='page', 
+              bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}]{postfix}') as pbar:
+        stage = None
+        
+        def update(event: dict):
+            nonlocal stage
+            if event['pages_total'] and pbar.total != event['pages_total']:
+                pbar.total = event['pages_total']
+            if event['bytes_written']:
+                pbar.set_postfix_str(f"{compressor._format_size(event['bytes_written'])} written",
+                                     refresh=False)
+            if event['stage'] and event['stage'] != stage:
+                stage = event['stage']
+                pbar.set_description(f"{description} ({stage.replace('_', ' ')})", refresh=False)
+                pbar.n = event['pages_done']
+                # Streaming switches stage with every page; redraw at tqdm's own rate
+                if time.time() - pbar.last_print_t >= pbar.mininterval:
+                    pbar.refresh()
+            else:
+                pbar.update(event['pages_done'] - pbar.n)
+        
+        compressor.progress = update
+        try:
+            yield pbar
+        finally:
+            compressor.progress = None
+
+def print_stage_timings(compressor: 'PDFCompressor'):
+    """Print how long each stage of the compressor's work took."""
+    stages = compressor.timer.stages
+    total = compressor.timer.total()
+    print(f"\n{Fore.CYAN}⏱️  Stage Timings:")
+    for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        share = seconds / total * 100 if total else 0
+        print(f"   {stage.replace('_', ' ').title():<18} {seconds:8.3f}s  {share:5.1f}%")
+    print(f"   {'Total':<18} {total:8.3f}s")
+
+def make_compressor() -> 'PDFCompressor':
+    """Create a PDFCompressor using the result cache selected on the command line."""
+    from pdf_compressor import PDFCompressor
+    ctx = click.get_current_context()
+    return PDFCompressor(cache=(ctx.obj or {}).get('cache'))
 
 @click.group(invoke_without_command=True)
 @click.version_option(version='1.0.0', prog_name='atlverse PDF Compressor')
+@click.option('--cache-dir', 
+              envvar='PDF_COMPRESSOR_CACHE_DIR',
+              type=click.Path(file_okay=False),
+              help='Reuse results stored in this directory for identical inputs and settings')
+@click.option('--cache-size', 
+              envvar='PDF_COMPRESSOR_CACHE_MB',
+              type=click.IntRange(1), 
+              default=DEFAULT_CACHE_MB,
+              help='Result cache size limit in MB')
+@click.option('--splash/--no-splash', 
+              envvar='PDF_COMPRESSOR_SPLASH',
+              default=None,
+              help='Show the splash screen (default: only when output is a terminal)')
+@click.option('--socket', 'socket_path', 
+              envvar='PDF_COMPRESSOR_SOCKET',
+              type=click.Path(dir_okay=False),
+              help='Run commands in the daemon listening on this Unix socket (see the daemon command)')
 @click.pass_context
-def cli(ctx):
+def cli(ctx, cache_dir, cache_size, splash, socket_path):
     """atlverse PDF Compressor - Efficient PDF compression tool."""
-    print_splash_screen()
+    if socket_path and ctx.invoked_subcommand in DAEMON_COMMANDS:
+        import cli_daemon
+        if not cli_daemon.SERVING:
+            code = cli_daemon.forward(socket_path, sys.argv[1:])
+            if code is not None:
+                ctx.exit(code)
+            print(f"{Fore.YELLOW}⚠️  No daemon listening on {socket_path}; running here", file=sys.stderr)
+    if splash if splash is not None else sys.stdout.isatty():
+        print_splash_screen()
+    cache = None
+    if cache_dir:
+        from result_cache import open_cache
+        cache = open_cache(cache_dir, cache_size * 1024 * 1024)
+    ctx.obj = {'cache': cache, 'socket': socket_path}
     if ctx.invoked_subcommand is None:
         click.echo(ctx.get_help())
 
@@ -76,16 +159,64 @@ def cli(ctx):
               is_flag=True, 
               default=True,
               help='Remove PDF metadata')
+@click.option('--workers', '-w', 
+              type=click.IntRange(0), 
+              default=1,
+              help='Worker processes for page compression (0 = one per CPU core)')
+@click.option('--dedupe/--no-dedupe', 
+              default=True,
+              help='Merge identical images, fonts and form XObjects')
+@click.option('--engine', '-e', 
+              type=click.Choice(['pypdf', 'ghostscript', 'auto'], case_sensitive=False),
+              default='pypdf',
+              help='Compression engine; auto picks one from the file\'s content')
+@click.option('--gs-quality', 
+              type=click.Choice(GS_QUALITIES, case_sensitive=False),
+              default='ebook',
+              help='Ghostscript quality preset (ghostscript/auto engines)')
+@click.option('--object-streams/--no-object-streams', 
+              default=False,
+              help='Write PDF 1.5 with compressed object streams and a cross-reference stream')
+@click.option('--prune/--no-prune', 
+              default=False,
+              help='Drop unused page resources and subset embedded fonts')
+@click.option('--optimize-streams', 
+              is_flag=True, 
+              help='Recompress every stream losslessly at the highest zlib level, '
+                   'trying PNG predictors on images (PyPDF2 engine)')
+@click.option('--optimize-scans', 
+              is_flag=True, 
+              help='Re-encode scanned images that are effectively gray or black and white '
+                   'as 8-bit gray or CCITT Group 4 (PyPDF2 engine, needs NumPy)')
+@click.option('--linearize', 
+              is_flag=True, 
+              help='Linearize the output for fast web view (needs qpdf, pikepdf or Ghostscript)')
+@click.option('--target-size', 
+              type=click.FloatRange(0, min_open=True),
+              help='Largest acceptable output in MB; image quality (up to --quality) and '
+                   'resolution are searched for the best fit (PyPDF2 engine)')
+@click.option('--streaming', 
+              is_flag=True, 
+              help='Write the output page by page so memory use stays flat on very large files')
+@click.option('--memory-limit', 
+              type=click.IntRange(1),
+              help='With --streaming, fail instead of using more than this many MB')
+@click.option('--timings', '-t', 
+              is_flag=True, 
+              help='Show how long each stage took')
 @click.option('--verbose', '-v', 
               is_flag=True, 
               help='Verbose output')
-def compress(input_file, output_file, level, quality, remove_metadata, verbose):
+def compress(input_file, output_file, level, quality, remove_metadata, workers, dedupe,
+             engine, gs_quality, object_streams, prune, optimize_streams, optimize_scans,
+             linearize, target_size, streaming, memory_limit, timings, verbose):
     """Compress a PDF file."""
-    compressor = PDFCompressor()
+    compressor = make_compressor()
+    document = compressor.open(input_file)
     
     # Validate input file
     print(f"{Fore.YELLOW}Validating PDF file...")
-    is_valid, message = compressor.validate_pdf(input_file)
+    is_valid, message = compressor.validate_pdf(document)
     if not is_valid:
         print(f"{Fore.RED}❌ {message}")
         sys.exit(1)
@@ -95,28 +226,121 @@ def compress(input_file, output_file, level, quality, remove_metadata, verbose):
     # Get file info
     if verbose:
         print(f"\n{Fore.CYAN}📄 File Information:")
-        info = compressor.get_pdf_info(input_file)
+        info = compressor.get_pdf_info(document)
         for key, value in info.items():
             if key != 'size':  # Skip raw size, show formatted
                 print(f"   {key.replace('_', ' ').title()}: {value}")
     
+    if target_size and engine.lower() != 'pypdf':
+        print(f"{Fore.YELLOW}⚠️  --target-size uses the PyPDF2 engine; ignoring --engine {engine.lower()}")
+        engine = 'pypdf'
+    
     # Show compression settings
     print(f"\n{Fore.LIGHTBLUE_EX}⚙️  Compression Settings:")
+    print(f"   Engine: {engine.lower()}")
+    if engine.lower() != 'pypdf':
+        print(f"   Ghostscript Quality: {gs_quality}")
     print(f"   Level: {level.upper()}")
     print(f"   Image Quality: {quality}%")
     print(f"   Remove Metadata: {'Yes' if remove_metadata else 'No'}")
+    print(f"   Workers: {workers or 'auto'}")
+    print(f"   Deduplicate: {'Yes' if dedupe else 'No'}")
+    print(f"   Object Streams: {'Yes' if object_streams else 'No'}")
+    print(f"   Prune Resources: {'Yes' if prune else 'No'}")
+    print(f"   Optimize Streams: {'Yes' if optimize_streams else 'No'}")
+    print(f"   Optimize Scans: {'Yes' if optimize_scans else 'No'}")
+    print(f"   Linearize: {'Yes' if linearize else 'No'}")
+    if target_size:
+        print(f"   Target Size: {target_size:g}MB")
+    if streaming:
+        print(f"   Streaming: Yes (memory limit: {f'{memory_limit}MB' if memory_limit else 'none'})")
     
     # Compress the file
     print(f"\n{Fore.YELLOW}🔄 Compressing PDF...")
     
-    # Show progress bar
-    print_progress_bar("Processing", 10)
-    
-    success, message = compressor.compress_pdf(
-        input_file, output_file, level, quality, remove_metadata
-    )
+    with document, progress_bar(compressor, "Processing"):
+        if target_size:
+            success, message = compressor.compress_to_target(
+                document, output_file, int(target_size * 1024 * 1024), level, quality,
+                remove_metadata, workers, deduplicate=dedupe, object_streams=object_streams,
+                prune_resources=prune, linearize=linearize, optimize_streams=optimize_streams,
+                optimize_scans=optimize_scans
+            )
+        elif engine.lower() == 'auto':
+            success, message = compressor.compress_auto(
+                document, output_file, gs_quality.lower(), quality, remove_metadata, workers,
+                object_streams=object_streams, linearize=linearize
+            )
+        elif engine.lower() == 'ghostscript':
+            success, message = compressor.compress_ghostscript(
+                input_file, output_file, gs_quality.lower(), object_streams=object_streams,
+                linearize=linearize
+            )
+        else:
+            success, message = compressor.compress_pdf(
+                document, output_file, level, quality, remove_metadata, workers,
+                deduplicate=dedupe, object_streams=object_streams, prune_resources=prune,
+                linearize=linearize, streaming=streaming,
+                memory_limit=memory_limit * 1024 * 1024 if memory_limit else None,
+                optimize_streams=optimize_streams, optimize_scans=optimize_scans
+            )
     
     if success:
+        if verbose and compressor.engine_choice:
+            profile = compressor.engine_choice['profile']
+            print(f"\n{Fore.CYAN}🔍 Document Profile:")
+            print(f"   Pages: {profile['pages']}")
+            print(f"   Images: {profile['image_count']} ({profile['image_share']:.0%} of the file)")
+            print(f"   Fonts: {profile['font_count']} ({profile['font_share']:.0%} of the file embedded)")
+            print(f"   Uncompressed streams: {profile['uncompressed_share']:.0%} of stream data")
+            print(f"   Engine: {compressor.engine_choice['engine']} ({compressor.engine_choice['reason']})")
+        if verbose and compressor.target_report:
+            report = compressor.target_report
+            print(f"\n{Fore.CYAN}🎯 Target Size:")
+            print(f"   Target: {compressor._format_size(report['target'])}")
+            print(f"   Reached: {'Yes' if report['reached'] else 'No'}")
+            print(f"   Image Quality: {report['quality'] or 'unchanged'}")
+            print(f"   Image Resolution: {str(report['dpi']) + ' DPI' if report['dpi'] else 'unchanged'}")
+            print(f"   Settings Tried: {report['settings_tried']}")
+            print(f"   Outputs Written: {report['writes']}")
+        if verbose and prune and compressor.prune_stats:
+            stats = compressor.prune_stats
+            print(f"\n{Fore.CYAN}✂️  Resource Pruning:")
+            print(f"   Unused resources removed: {stats['removed']}")
+            print(f"   Fonts subset: {stats['fonts_subset']}")
+            for category, saved in stats['bytes_saved'].items():
+                print(f"   {category.replace('_', ' ').title()}: {compressor._format_size(saved)}")
+        if verbose and dedupe and compressor.dedup_stats:
+            stats = compressor.dedup_stats
+            print(f"\n{Fore.CYAN}♻️  Deduplication:")
+            print(f"   Streams scanned: {stats.get('streams', 0)}")
+            print(f"   Duplicates removed: {stats.get('duplicates', 0)}")
+            print(f"   Bytes saved: {compressor._format_size(stats.get('bytes_saved', 0))}")
+        if verbose and optimize_streams and compressor.optimize_stats:
+            stats = compressor.optimize_stats
+            print(f"\n{Fore.CYAN}🗜️  Stream Optimization:")
+            print(f"   Streams scanned: {stats['streams']}")
+            print(f"   Recompressed: {stats['optimized']} ({stats['predictor']} with PNG predictors)")
+            print(f"   Bytes saved: {compressor._format_size(stats['bytes_saved'])}")
+        if verbose and optimize_scans and compressor.scan_report:
+            print(f"\n{Fore.CYAN}🖨️  Scanned Images:")
+            for result in compressor.scan_report:
+                pages = ', '.join(str(p) for p in result['pages'])
+                line = (f"   Object {result['object']} (pages {pages}): "
+                        f"{compressor._format_size(result['original_size'])} → "
+                        f"{compressor._format_size(result['compressed_size'])}")
+                if result['status'] == 'replaced':
+                    line += f" [{'black and white' if result['kind'] == 'bitonal' else 'gray'}]"
+                else:
+                    line += f" [{result['status']}: {result['reason']}]"
+                print(line)
+        if verbose and compressor.cache is not None:
+            stats = compressor.cache.stats()
+            print(f"\n{Fore.CYAN}🗄️  Result Cache:")
+            print(f"   Hits/Misses: {stats['hits']}/{stats['misses']}")
+            print(f"   Entries: {stats['entries']} ({compressor._format_size(stats['bytes'])})")
+        if timings:
+            print_stage_timings(compressor)
         print(f"\n{Fore.GREEN}✅ {message}")
         print(f"\n{Fore.LIGHTGREEN_EX}🎉 Compression completed successfully!")
         print(f"   Output file: {output_file}")
@@ -128,18 +352,19 @@ def compress(input_file, output_file, level, quality, remove_metadata, verbose):
 @click.argument('file_path', type=click.Path(exists=True, file_okay=True, dir_okay=False))
 def info(file_path):
     """Display detailed information about a PDF file."""
-    compressor = PDFCompressor()
+    compressor = make_compressor()
     
     print(f"{Fore.CYAN}📄 PDF Information for: {file_path}\n")
     
-    # Validate file
-    is_valid, message = compressor.validate_pdf(file_path)
-    if not is_valid:
-        print(f"{Fore.RED}❌ {message}")
-        sys.exit(1)
-    
-    # Get and display info
-    info = compressor.get_pdf_info(file_path)
+    with compressor.open(file_path) as document:
+        # Validate file
+        is_valid, message = compressor.validate_pdf(document)
+        if not is_valid:
+            print(f"{Fore.RED}❌ {message}")
+            sys.exit(1)
+        
+        # Get and display info
+        info = compressor.get_pdf_info(document)
     
     print(f"{Fore.LIGHTBLUE_EX}File Details:")
     print(f"   📏 Size: {info.get('size_formatted', 'Unknown')}")
@@ -154,6 +379,66 @@ def info(file_path):
     print(f"   📅 Created: {info.get('creation_date', 'Unknown')}")
     print(f"   🔄 Modified: {info.get('modification_date', 'Unknown')}")
 
+@cli.command()
+@click.argument('file_path', type=click.Path(exists=True, file_okay=True, dir_okay=False))
+@click.option('--pages', '-p', 
+              type=click.IntRange(1), 
+              default=8,
+              help='Pages sampled and compressed with every setting')
+@click.option('--quality', '-q', 
+              type=click.IntRange(1, 100), 
+              default=85,
+              help='Image quality (1-100) for the PyPDF2 levels')
+@click.option('--engine', '-e', 
+              type=click.Choice(['pypdf', 'ghostscript', 'all'], case_sensitive=False),
+              default='all',
+              help='Estimate the PyPDF2 levels, the Ghostscript presets, or both')
+def estimate(file_path, pages, quality, engine):
+    """Estimate the output size and runtime of every compression setting.
+
+    A few representative pages are compressed with each --level and
+    --gs-quality setting and the results scaled up to the whole file, with
+    a 95% range.
+    """
+    from size_estimator import LEVELS, estimate_sizes
+    compressor = make_compressor()
+    engine = engine.lower()
+
+    print(f"{Fore.CYAN}📐 Size estimates for: {file_path}\n")
+
+    with compressor.open(file_path) as document:
+        is_valid, message = compressor.validate_pdf(document)
+        if not is_valid:
+            print(f"{Fore.RED}❌ {message}")
+            sys.exit(1)
+
+        if engine == 'pypdf':
+            result = estimate_sizes(document, LEVELS, [], pages, quality)
+        elif engine == 'ghostscript':
+            result = estimate_sizes(document, [], list(GS_QUALITIES), pages, quality)
+        else:
+            result = estimate_sizes(document, LEVELS, None, pages, quality)
+
+    size = compressor._format_size
+    sampled = ', '.join(str(p) for p in result['sampled_pages'])
+    print(f"{Fore.LIGHTBLUE_EX}File Details:")
+    print(f"   📏 Size: {size(result['size'])}")
+    print(f"   📄 Pages: {result['pages']} (sampled: {sampled})")
+
+    print(f"\n{Fore.LIGHTBLUE_EX}Estimates (95% range):")
+    for item in result['estimates']:
+        name = f"{item['engine']} {item['setting']}"
+        if 'error' in item:
+            print(f"{Fore.RED}   ❌ {name:<22} {item['error']}")
+            continue
+        print(f"   {name:<22} {size(item['size']):>9} ({size(item['size_low'])} - "
+              f"{size(item['size_high'])}), {1 - item['ratio']:6.1%} saved, "
+              f"~{item['seconds']:.1f}s ({item['seconds_low']:.1f} - {item['seconds_high']:.1f}s)")
+    if engine == 'all' and not any(item['engine'] == 'ghostscript' for item in result['estimates']):
+        print(f"{Fore.YELLOW}   ⚠️  Ghostscript is not installed; its presets were not estimated")
+
+    print(f"\n{Fore.GREEN}✅ Estimated in {result['seconds']:.1f}s")
+
 @cli.command()
 @click.argument('input_file', type=click.Path(exists=True, file_okay=True, dir_okay=False))
 @click.argument('output_file', type=click.Path())
@@ -161,18 +446,44 @@ def info(file_path):
               type=click.IntRange(1, 100), 
               default=85,
               help='Image quality (1-100)')
-def compress_images(input_file, output_file, quality):
+@click.option('--dpi', '-d', 
+              type=click.IntRange(1), 
+              default=150,
+              help='Target image resolution for downsampling')
+@click.option('--workers', '-w', 
+              type=click.IntRange(0), 
+              default=1,
+              help='Worker processes for image recompression (0 = one per CPU core)')
+@click.option('--timings', '-t', 
+              is_flag=True, 
+              help='Show how long each stage took')
+@click.option('--verbose', '-v', 
+              is_flag=True, 
+              help='Show per-image savings')
+def compress_images(input_file, output_file, quality, dpi, workers, timings, verbose):
     """Compress images within a PDF file."""
-    compressor = PDFCompressor()
+    compressor = make_compressor()
     
     print(f"{Fore.YELLOW}🖼️  Compressing images in PDF...")
     
-    # Show progress bar
-    print_progress_bar("Processing images", 8)
-    
-    success, message = compressor.compress_images_in_pdf(input_file, output_file, quality)
+    with progress_bar(compressor, "Processing images"):
+        success, message = compressor.compress_images_in_pdf(
+            input_file, output_file, quality, dpi, workers
+        )
     
     if success:
+        if verbose:
+            print(f"\n{Fore.CYAN}🖼️  Images:")
+            for result in compressor.image_report:
+                pages = ', '.join(str(p) for p in result['pages'])
+                line = (f"   Object {result['object']} (pages {pages}): "
+                        f"{compressor._format_size(result['original_size'])} → "
+                        f"{compressor._format_size(result['compressed_size'])}")
+                if result['status'] != 'replaced':
+                    line += f" [{result['status']}: {result['reason']}]"
+                print(line)
+        if timings:
+            print_stage_timings(compressor)
         print(f"\n{Fore.GREEN}✅ {message}")
         print(f"\n{Fore.LIGHTGREEN_EX}🎉 Image compression completed!")
         print(f"   Output file: {output_file}")
@@ -181,7 +492,159 @@ def compress_images(input_file, output_file, quality):
         sys.exit(1)
 
 @cli.command()
-def batch():
+@click.argument('inputs', nargs=-1)
+@click.option('--manifest', '-m', 
+              type=click.Path(exists=True, dir_okay=False),
+              help='Text file listing inputs, one per line')
+@click.option('--output-dir', '-o', 
+              type=click.Path(file_okay=False),
+              help='Write outputs here instead of next to each input')
+@click.option('--suffix', 
+              default='_compressed',
+              help='Suffix added to output file names')
+@click.option('--level', '-l', 
+              type=click.Choice(['low', 'medium', 'high'], case_sensitive=False),
+              default='medium', 
+              help='Compression level (low/medium/high)')
+@click.option('--quality', '-q', 
+              type=click.IntRange(1, 100), 
+              default=85,
+              help='Image quality (1-100)')
+@click.option('--dedupe/--no-dedupe', 
+              default=True,
+              help='Merge identical images, fonts and form XObjects')
+@click.option('--object-streams/--no-object-streams', 
+              default=False,
+              help='Write PDF 1.5 with compressed object streams and a cross-reference stream')
+@click.option('--prune/--no-prune', 
+              default=False,
+              help='Drop unused page resources and subset embedded fonts')
+@click.option('--optimize-streams', 
+              is_flag=True, 
+              help='Recompress every stream losslessly at the highest zlib level')
+@click.option('--optimize-scans', 
+              is_flag=True, 
+              help='Re-encode effectively gray or black-and-white scans as gray or CCITT Group 4')
+@click.option('--linearize', 
+              is_flag=True, 
+              help='Linearize outputs for fast web view')
+@click.option('--streaming', 
+              is_flag=True, 
+              help='Write outputs page by page so memory use stays flat on very large files')
+@click.option('--memory-limit', 
+              type=click.IntRange(1),
+              help='With --streaming, fail a file instead of using more than this many MB per worker')
+@click.option('--jobs', '-j', 
+              type=click.IntRange(0), 
+              default=1,
+              help='Files compressed in parallel (0 = one per CPU core)')
+@click.option('--journal', 
+              type=click.Path(dir_okay=False),
+              help='JSONL journal of results, used to resume interrupted runs '
+                   '(default: batch_journal.jsonl in the output directory)')
+@click.option('--force', '-f', 
+              is_flag=True, 
+              help='Recompress files even if their output is up to date')
+@click.option('--queue', 'queue_path', 
+              envvar='PDF_COMPRESSOR_QUEUE',
+              type=click.Path(dir_okay=False),
+              help='Queue files in this work queue for worker processes instead of '
+                   'compressing them here (see the worker command)')
+def batch(inputs, manifest, output_dir, suffix, level, quality, dedupe, object_streams, prune,
+          optimize_streams, optimize_scans, linearize, streaming, memory_limit, jobs, journal,
+          force, queue_path):
+    """Compress many PDF files.
+
+    INPUTS are PDF files, directories (searched recursively) or glob
+    patterns. Without inputs or a manifest, files are asked for
+    interactively.
+    """
+    if not inputs and not manifest:
+        interactive_batch()
+        return
+    
+    from batch import BatchJournal, discover_inputs, is_output_current, output_path_for, run_batch
+    
+    files = discover_inputs(inputs, manifest)
+    if not files:
+        print(f"{Fore.YELLOW}No PDF files found.")
+        return
+    
+    if output_dir:
+        output_dir = os.path.abspath(output_dir)
+    # Mirror the input tree below the output directory
+    root = os.path.commonpath([os.path.dirname(f) for f in files]) if output_dir else None
+    settings = {'level': level.lower(), 'quality': quality, 'remove_metadata': True, 'dedupe': dedupe,
+                'object_streams': object_streams, 'prune': prune, 'linearize': linearize,
+                'streaming': streaming, 'memory_limit': memory_limit,
+                'optimize_streams': optimize_streams, 'optimize_scans': optimize_scans}
+    journal_path = journal or os.path.join(output_dir or os.getcwd(), 'batch_journal.jsonl')
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    batch_journal = BatchJournal(journal_path)
+    
+    cache = (click.get_current_context().obj or {}).get('cache')
+    tasks = []
+    skipped = 0
+    for file_path in files:
+        output_path = output_path_for(file_path, output_dir, suffix, root)
+        if file_path == output_path or file_path.endswith(f"{suffix}.pdf"):
+            continue
+        if not force and (batch_journal.is_done(file_path, output_path, settings) or
+                          is_output_current(file_path, output_path)):
+            skipped += 1
+            continue
+        tasks.append({
+            'input': file_path,
+            'output': output_path,
+            'settings': settings,
+            'cache_dir': os.path.abspath(cache.directory) if cache else None,
+            'cache_bytes': cache.max_bytes if cache else None,
+        })
+    
+    print(f"{Fore.CYAN}🔄 Batch Compression")
+    print(f"{Fore.LIGHTBLUE_EX}   Found: {len(files)} files, up to date: {skipped}, to process: {len(tasks)}")
+    if queue_path:
+        print(f"{Fore.LIGHTBLUE_EX}   Queue: {queue_path}, journal: {journal_path}\n")
+    else:
+        print(f"{Fore.LIGHTBLUE_EX}   Jobs: {jobs or 'auto'}, journal: {journal_path}\n")
+    
+    from pdf_compressor import PDFCompressor
+    from tqdm import tqdm
+    
+    failed = []
+    saved = 0
+    with tqdm(total=len(tasks), desc="Compressing", unit='file') as pbar:
+        def on_result(result):
+            nonlocal saved
+            batch_journal.record(result)
+            if result['status'] == 'ok':
+                saved += result['input_size'] - result['output_size']
+            else:
+                failed.append(result)
+            pbar.update(1)
+        
+        try:
+            if queue_path:
+                from batch import run_queued
+                from work_queue import WorkQueue
+                # Files left running when this is interrupted are picked up again next time
+                run_queued(WorkQueue(queue_path), tasks, on_result)
+            else:
+                run_batch(tasks, jobs, on_result)
+        finally:
+            batch_journal.close()
+    
+    for result in failed:
+        print(f"{Fore.RED}   ❌ {result['input']}: {result['message']}")
+    
+    print(f"\n{Fore.LIGHTGREEN_EX}🎉 Batch processing completed!")
+    print(f"   Compressed: {len(tasks) - len(failed)}, failed: {len(failed)}, skipped: {skipped}")
+    print(f"   Space saved: {PDFCompressor()._format_size(max(saved, 0))}")
+    if failed:
+        sys.exit(1)
+
+def interactive_batch():
     """Interactive batch compression mode."""
     print(f"{Fore.CYAN}🔄 Batch Compression Mode")
     print(f"{Fore.LIGHTBLUE_EX}Enter PDF files to compress (one per line, empty line to finish):\n")
@@ -210,7 +673,7 @@ def batch():
     except ValueError:
         quality = 85
     
-    compressor = PDFCompressor()
+    compressor = make_compressor()
     
     print(f"\n{Fore.LIGHTBLUE_EX}🔄 Processing {len(files)} files...\n")
     
@@ -230,5 +693,156 @@ def batch():
     
     print(f"\n{Fore.LIGHTGREEN_EX}🎉 Batch processing completed!")
 
+@cli.command()
+@click.option('--jobs', '-j', 
+              type=click.IntRange(1), 
+              default=os.cpu_count() or 1,
+              help='Commands run at the same time; more wait for a free slot')
+@click.pass_context
+def daemon(ctx, jobs):
+    """Run a warm daemon for compress, compress-images, info and estimate.
+
+    The daemon imports the compression libraries once and listens on a
+    Unix socket (--socket, PDF_COMPRESSOR_SOCKET, or a per-user default).
+    Commands given the same socket run in it and skip interpreter and
+    library startup. Stop it with Ctrl+C or SIGTERM.
+    """
+    import cli_daemon
+    
+    if not hasattr(os, 'fork'):
+        print(f"{Fore.RED}❌ The daemon needs a system with fork() and Unix sockets")
+        sys.exit(1)
+    
+    socket_path = os.path.abspath(ctx.obj['socket'] or cli_daemon.default_socket_path())
+    
+    def ready():
+        print(f"{Fore.GREEN}✅ Daemon listening on {socket_path} ({jobs} jobs)")
+        print(f"{Fore.LIGHTBLUE_EX}   Use it with: export PDF_COMPRESSOR_SOCKET={socket_path}")
+    
+    print(f"{Fore.CYAN}🔥 Warming up...")
+    try:
+        cli_daemon.serve(socket_path, run_forwarded, warm_up, jobs, on_ready=ready)
+    except RuntimeError as e:
+        print(f"{Fore.RED}❌ {e}")
+        sys.exit(1)
+    print(f"\n{Fore.LIGHTBLUE_EX}Daemon stopped.")
+
+@cli.command()
+@click.option('--queue', 'queue_path', 
+              envvar='PDF_COMPRESSOR_QUEUE',
+              required=True,
+              type=click.Path(dir_okay=False),
+              help='Work queue database shared with the web app and batch --queue')
+@click.option('--processes', '-j', 
+              type=click.IntRange(0), 
+              default=1,
+              help='Worker processes to run on this host (0 = one per CPU core)')
+@click.option('--lease', 
+              type=click.FloatRange(1),
+              help='Seconds a task stays claimed without a heartbeat before another worker '
+                   'takes it (default: 60)')
+@click.option('--poll-interval', 
+              type=click.FloatRange(0.1), 
+              default=1.0,
+              help='Seconds to wait before looking again when the queue is empty')
+@click.option('--exit-when-empty', 
+              is_flag=True, 
+              help='Stop once no task is queued or running')
+@click.option('--max-tasks', 
+              type=click.IntRange(1),
+              help='Stop each process after running this many tasks')
+def worker(queue_path, processes, lease, poll_interval, exit_when_empty, max_tasks):
+    """Run compression tasks from a shared work queue.
+
+    Tasks are queued by the web app (WORK_QUEUE) and by batch --queue.
+    Start workers on as many hosts as you like, all pointed at the same
+    queue file on shared storage; each task is claimed by one of them and
+    given to another if its worker dies. Ctrl+C or SIGTERM stops the
+    workers after the tasks they are running.
+    """
+    import multiprocessing
+    import signal
+    from work_queue import DEFAULT_LEASE
+    
+    lease = lease or DEFAULT_LEASE
+    count = processes or os.cpu_count() or 1
+    print(f"{Fore.CYAN}👷 Queue Worker")
+    print(f"{Fore.LIGHTBLUE_EX}   Queue: {os.path.abspath(queue_path)}")
+    print(f"{Fore.LIGHTBLUE_EX}   Processes: {count}, lease: {lease:g}s\n")
+    
+    args = (queue_path, lease, poll_interval, exit_when_empty, max_tasks)
+    if count == 1:
+        done = run_queue_worker(*args)
+    else:
+        children = [multiprocessing.Process(target=run_queue_worker, args=args,
+                                            name=f'queue-worker-{i}') for i in range(count)]
+        for child in children:
+            child.start()
+        
+        def forward(signum, frame):
+            # Children stop after their current task, as a single worker does
+            for child in children:
+                if child.is_alive():
+                    os.kill(child.pid, signal.SIGTERM)
+        
+        signal.signal(signal.SIGINT, forward)
+        signal.signal(signal.SIGTERM, forward)
+        for child in children:
+            child.join()
+        done = None
+    
+    print(f"\n{Fore.LIGHTBLUE_EX}Worker stopped" + (f" after {done} tasks." if done is not None else "."))
+
+def run_queue_worker(queue_path: str, lease: float, poll_interval: float,
+                     exit_when_empty: bool, max_tasks=None) -> int:
+    """Take tasks off the queue in this process until stopped; return how many were run."""
+    import signal
+    import threading
+    from queue_pool import compress_task
+    from work_queue import WorkQueue, default_worker_id, run_worker
+    
+    stop = threading.Event()
+    worker_id = default_worker_id()
+    
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            print(f"{Fore.YELLOW}⏹️  {worker_id}: stopping after the current task")
+        stop.set()
+    
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    
+    def report(task, result, error):
+        payload = task['payload']
+        name = os.path.basename(payload['task']['input'] if payload['kind'] == 'batch'
+                                else payload['input'])
+        if error is None and (payload['kind'] != 'batch' or result['status'] == 'ok'):
+            print(f"{Fore.GREEN}   ✅ {worker_id}: {name}")
+        else:
+            print(f"{Fore.RED}   ❌ {worker_id}: {name} (attempt {task['attempts']}): "
+                  f"{error or result['message']}")
+    
+    queue = WorkQueue(queue_path, lease=lease)
+    try:
+        return run_worker(queue, compress_task, worker_id, poll_interval, stop,
+                          exit_when_empty, max_tasks, on_task=report)
+    finally:
+        queue.close()
+
+def warm_up():
+    """Import everything the daemon's commands use, once, before it forks."""
+    import pdf_compressor
+    import tqdm
+    from PIL import Image
+    Image.init()
+
+def run_forwarded(argv: List[str]):
+    """Run a command line forwarded to the daemon, in the child serving it."""
+    from colorama import AnsiToWin32
+    # Colors are reset after every print, as init(autoreset=True) does locally
+    sys.stdout = AnsiToWin32(sys.stdout, autoreset=True).stream
+    sys.stderr = AnsiToWin32(sys.stderr, autoreset=True).stream
+    cli.main(args=argv, prog_name='cli.py')
+
 if __name__ == '__main__':
     cli() 
\ No newline at end of file
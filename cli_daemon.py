@@ -0,0 +1,192 @@
+"""
+Warm CLI daemon reached over a Unix socket.
+
+Starting the interpreter and importing PyPDF2, Pillow and the compression
+modules takes longer than compressing a small PDF, so scripts that run the
+CLI thousands of times spend most of their time starting up. The daemon
+imports everything once and then serves CLI commands: each connection is
+handed to a child forked from the warm process, which runs the command
+line it was sent in the client's working directory and environment and
+streams its output back. The client only needs the standard library and
+click to forward a command.
+
+Protocol: the client sends one JSON line, ``{"argv": [...], "cwd": ...,
+"env": {...}, "isatty": ...}``, and reads JSON lines back until the exit
+status: ``{"out": text}``, ``{"err": text}``, ``{"exit": code}``.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Set in the children that run forwarded commands, so they are not forwarded again
+SERVING = False
+
+
+def default_socket_path() -> str:
+    """Per-user socket path: in XDG_RUNTIME_DIR when set, otherwise in the temp directory."""
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(directory, f"pdfcompressor-{os.getuid()}.sock")
+
+
+class _Channel:
+    """A text stream that sends what is written to the client as JSON lines."""
+
+    def __init__(self, connection: socket.socket, name: str, tty: bool):
+        self.connection = connection
+        self.name = name
+        self.tty = tty
+
+    def write(self, text: str) -> int:
+        if text:
+            self.connection.sendall(json.dumps({self.name: text}).encode() + b"\n")
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    @property
+    def closed(self) -> bool:
+        return False
+
+    @property
+    def encoding(self) -> str:
+        return 'utf-8'
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """Runs one forwarded command line; always in a forked child."""
+
+    def handle(self) -> None:
+        global SERVING
+        SERVING = True
+        line = self.rfile.readline()
+        if not line:
+            return  # a connection that only checked the daemon is there
+        request = json.loads(line)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.stdin = open(os.devnull)
+        sys.stdout = _Channel(self.connection, 'out', request.get('isatty', False))
+        sys.stderr = _Channel(self.connection, 'err', request.get('isatty', False))
+        code = 0
+        try:
+            self.server.run(request['argv'])
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                sys.stderr.write(e.code + "\n")
+                code = 1
+            else:
+                code = e.code or 0
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            code = 1
+        self.connection.sendall(json.dumps({'exit': code}).encode() + b"\n")
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def serve(socket_path: str, run: Callable[[List[str]], None],
+          warm_up: Optional[Callable[[], None]] = None, max_jobs: int = 8,
+          on_ready: Optional[Callable[[], None]] = None) -> None:
+    """
+    Serve forwarded commands on a Unix socket until interrupted.
+
+    Args:
+        socket_path: Path of the socket to listen on; only the current
+            user can connect to it
+        run: Runs one command line (without the program name); its output
+            goes to sys.stdout and sys.stderr
+        warm_up: Called once before serving, to import what the commands need
+        max_jobs: Number of commands run at the same time; further
+            connections wait
+        on_ready: Called once the socket accepts connections
+
+    Raises:
+        RuntimeError: If a daemon is already listening on the socket
+    """
+    if os.path.exists(socket_path):
+        if _connect(socket_path) is not None:
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+        # Left behind by a daemon that did not shut down cleanly
+        os.remove(socket_path)
+    if warm_up is not None:
+        warm_up()
+
+    previous_umask = os.umask(0o177)
+    try:
+        server = _Server(socket_path, _CommandHandler)
+    finally:
+        os.umask(previous_umask)
+    server.run = run
+    server.max_children = max_jobs
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        if on_ready is not None:
+            on_ready()
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def _connect(socket_path: str) -> Optional[socket.socket]:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def forward(socket_path: str, argv: List[str]) -> Optional[int]:
+    """
+    Run a command line in the daemon, copying its output to this process.
+
+    Returns:
+        The command's exit status, or None when no daemon is listening on
+        the socket
+    """
+    connection = _connect(socket_path)
+    if connection is None:
+        return None
+    with connection, connection.makefile('rb') as replies:
+        connection.sendall(json.dumps({
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'isatty': sys.stdout.isatty(),
+        }).encode() + b"\n")
+        for line in replies:
+            reply = json.loads(line)
+            if 'out' in reply:
+                sys.stdout.write(reply['out'])
+                sys.stdout.flush()
+            elif 'err' in reply:
+                sys.stderr.write(reply['err'])
+                sys.stderr.flush()
+            elif 'exit' in reply:
+                return reply['exit']
+    # The child went away without an exit status
+    return 1
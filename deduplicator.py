@@ -0,0 +1,152 @@
+"""
+Content-addressed deduplication of PDF stream objects.
+
+Merged reports and batch exports often embed the same image, font file or
+form XObject once per page. This pass hashes every stream reachable from
+the pages, keeps one copy of each identical stream and points all
+references at it, so that a PdfWriter only writes it once.
+"""
+
+import hashlib
+import io
+from typing import Dict, List, Tuple
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+# Stream data is fed to the hash in slices of this size. The slices are
+# memoryviews over the data PyPDF2 has already read, so no stream is ever
+# copied while it is hashed.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Streams that refer to other streams (an image and its /SMask, a font
+# descriptor's font file) only match once their children have been merged,
+# so matching is repeated until nothing changes or this limit is reached.
+MAX_ROUNDS = 4
+
+# Keys that point back up the document tree rather than at page resources.
+_SKIPPED_KEYS = ('/Parent', '/P')
+
+
+def _data_digest(stream) -> bytes:
+    """Hash the raw (still encoded) data of a stream in fixed-size slices."""
+    digest = hashlib.sha256()
+    data = memoryview(stream._data if isinstance(stream._data, bytes)
+                      else stream._data.encode('latin-1'))
+    for offset in range(0, len(data), HASH_CHUNK_SIZE):
+        digest.update(data[offset:offset + HASH_CHUNK_SIZE])
+    return digest.digest()
+
+
+def _serialize(value, canonical: Dict[int, int], out: io.BytesIO) -> None:
+    """Serialize a dictionary value, resolving references to their canonical copy."""
+    if isinstance(value, IndirectObject):
+        out.write(b'%d R ' % _resolve(value.idnum, canonical))
+    elif isinstance(value, DictionaryObject):
+        out.write(b'<<')
+        for key in sorted(value.keys()):
+            if key == '/Length':
+                continue
+            out.write(key.encode() + b' ')
+            _serialize(value.raw_get(key), canonical, out)
+        out.write(b'>>')
+    elif isinstance(value, ArrayObject):
+        out.write(b'[')
+        for item in value:
+            _serialize(item, canonical, out)
+        out.write(b']')
+    else:
+        value.write_to_stream(out, None)
+        out.write(b' ')
+
+
+def _resolve(idnum: int, canonical: Dict[int, int]) -> int:
+    """Follow duplicate links to the copy that is kept."""
+    while idnum in canonical:
+        idnum = canonical[idnum]
+    return idnum
+
+
+def _collect_references(reader) -> Tuple[Dict[int, StreamObject], List[tuple]]:
+    """
+    Walk the object graph below the pages of a PDF.
+
+    Returns:
+        Tuple of (streams by object number, references to streams as
+        (container, key, reference) tuples)
+    """
+    streams = {}
+    references = []
+    visited = set()
+    stack = [page for page in reader.pages]
+
+    while stack:
+        container = stack.pop()
+        if isinstance(container, DictionaryObject):
+            items = [(key, container.raw_get(key)) for key in container.keys()
+                     if key not in _SKIPPED_KEYS]
+        else:
+            items = list(enumerate(container))
+
+        for key, value in items:
+            if isinstance(value, IndirectObject):
+                target = value.get_object()
+                if isinstance(target, StreamObject):
+                    references.append((container, key, value))
+                    streams[value.idnum] = target
+                if value.idnum in visited:
+                    continue
+                visited.add(value.idnum)
+                value = target
+            if isinstance(value, (DictionaryObject, ArrayObject)):
+                stack.append(value)
+
+    return streams, references
+
+
+def deduplicate_streams(reader) -> dict:
+    """
+    Merge identical stream objects of an open PDF in place.
+
+    Two streams are identical when their encoded data and their dictionaries
+    (ignoring /Length) match. The stream with the lowest object number is
+    kept and every reference to a duplicate is rewritten to point at it, so
+    any PdfWriter the reader's pages are added to afterwards writes it once.
+
+    Args:
+        reader: An open PyPDF2.PdfReader
+
+    Returns:
+        Dictionary with the number of streams scanned, the number of
+        duplicates removed and the bytes saved
+    """
+    streams, references = _collect_references(reader)
+    data_digests = {idnum: _data_digest(stream) for idnum, stream in streams.items()}
+    canonical = {}
+
+    for _ in range(MAX_ROUNDS):
+        seen = {}
+        merged = False
+        for idnum in sorted(streams):
+            if idnum in canonical:
+                continue
+            out = io.BytesIO()
+            _serialize(streams[idnum], canonical, out)
+            key = (data_digests[idnum], hashlib.sha256(out.getvalue()).digest())
+            if key in seen:
+                canonical[idnum] = seen[key]
+                merged = True
+            else:
+                seen[key] = idnum
+        if not merged:
+            break
+
+    for container, key, reference in references:
+        if reference.idnum in canonical:
+            kept = _resolve(reference.idnum, canonical)
+            container[key] = IndirectObject(kept, reference.generation, reader)
+
+    return {
+        'streams': len(streams),
+        'duplicates': len(canonical),
+        'bytes_saved': sum(len(streams[idnum]._data) for idnum in canonical),
+    }
@@ -0,0 +1,150 @@
+"""
+Automatic engine selection.
+
+Profiles a PDF without decoding any streams (image byte share, stream
+filters, fonts, pages) and picks the cheapest engine that is likely to
+shrink it: PyPDF2 rewrites the file in a fraction of Ghostscript's time
+but cannot resample images or subset fonts, while Ghostscript re-renders
+every page.
+"""
+
+import shutil
+from collections import Counter
+from typing import Optional
+
+from PyPDF2.generic import IndirectObject, StreamObject
+
+from pdf_document import PDFDocument
+
+# Images at least this share of the file are worth resampling
+IMAGE_SHARE_THRESHOLD = 0.4
+# Embedded fonts at least this share of the file are worth subsetting
+FONT_SHARE_THRESHOLD = 0.3
+# Unfiltered streams at least this share of all stream bytes are worth deflating
+UNCOMPRESSED_SHARE_THRESHOLD = 0.1
+
+_FONT_FILE_KEYS = ('/FontFile', '/FontFile2', '/FontFile3')
+
+
+def ghostscript_available() -> bool:
+    """Whether the gs executable is on the PATH."""
+    return shutil.which('gs') is not None
+
+
+def _first_filter(stream: StreamObject) -> Optional[str]:
+    filters = stream.get('/Filter')
+    if isinstance(filters, list):
+        filters = filters[0] if filters else None
+    return str(filters) if filters is not None else None
+
+
+def profile_document(document: PDFDocument) -> dict:
+    """
+    Summarise what a PDF's bytes are spent on.
+
+    Every indirect object is visited once; stream data is measured but not
+    decoded.
+
+    Returns:
+        Dictionary with pages, file_size, stream_bytes, image_count,
+        image_bytes, image_share, font_count, font_bytes, font_share,
+        uncompressed_bytes, uncompressed_share and filters (bytes per
+        first stream filter)
+    """
+    reader = document.reader
+    image_count = image_bytes = stream_bytes = uncompressed_bytes = 0
+    font_count = font_bytes = 0
+    filters = Counter()
+    # idnum -> reference of every embedded font program
+    font_files = {}
+
+    references = [(idnum, generation) for generation, objects in reader.xref.items()
+                  for idnum in objects]
+    # Objects packed into object streams are never streams themselves, but
+    # may be fonts
+    references += [(idnum, 0) for idnum in reader.xref_objStm]
+    for idnum, generation in references:
+        obj = reader.get_object(IndirectObject(idnum, generation, reader))
+        if not hasattr(obj, 'get'):
+            continue
+        if obj.get('/Type') == '/Font':
+            font_count += 1
+        elif obj.get('/Type') == '/FontDescriptor':
+            for key in _FONT_FILE_KEYS:
+                reference = obj.raw_get(key) if key in obj else None
+                if isinstance(reference, IndirectObject):
+                    font_files[reference.idnum] = reference
+        if not isinstance(obj, StreamObject):
+            continue
+        size = len(obj._data)
+        stream_bytes += size
+        first_filter = _first_filter(obj)
+        filters[first_filter or 'none'] += size
+        if first_filter is None:
+            uncompressed_bytes += size
+        if obj.get('/Subtype') == '/Image':
+            image_count += 1
+            image_bytes += size
+
+    for reference in font_files.values():
+        stream = reference.get_object()
+        if isinstance(stream, StreamObject):
+            font_bytes += len(stream._data)
+
+    file_size = document.size
+    return {
+        'pages': document.page_count,
+        'file_size': file_size,
+        'stream_bytes': stream_bytes,
+        'image_count': image_count,
+        'image_bytes': image_bytes,
+        'image_share': round(image_bytes / file_size, 3) if file_size else 0.0,
+        'font_count': font_count,
+        'font_bytes': font_bytes,
+        'font_share': round(font_bytes / file_size, 3) if file_size else 0.0,
+        'uncompressed_bytes': uncompressed_bytes,
+        'uncompressed_share': round(uncompressed_bytes / stream_bytes, 3) if stream_bytes else 0.0,
+        'filters': dict(filters),
+    }
+
+
+def choose_engine(profile: dict, gs_available: Optional[bool] = None) -> dict:
+    """
+    Pick an engine for a profiled document.
+
+    Args:
+        profile: Result of profile_document
+        gs_available: Whether Ghostscript can be used (looked up on the
+            PATH when None)
+
+    Returns:
+        Dictionary with engine ('pypdf' or 'ghostscript'), the pypdf level
+        and recompress_images flag to use, and a human-readable reason
+    """
+    if gs_available is None:
+        gs_available = ghostscript_available()
+    image_share = profile['image_share']
+    font_share = profile['font_share']
+
+    if image_share >= IMAGE_SHARE_THRESHOLD:
+        if gs_available:
+            return {'engine': 'ghostscript', 'level': None, 'recompress_images': False,
+                    'reason': f"images are {image_share:.0%} of the file; Ghostscript resamples them"}
+        return {'engine': 'pypdf', 'level': 'high', 'recompress_images': True,
+                'reason': f"images are {image_share:.0%} of the file; Ghostscript is not "
+                          f"installed, so images are recompressed with PyPDF2"}
+
+    if font_share >= FONT_SHARE_THRESHOLD and gs_available:
+        return {'engine': 'ghostscript', 'level': None, 'recompress_images': False,
+                'reason': f"embedded fonts are {font_share:.0%} of the file; "
+                          f"Ghostscript subsets them"}
+
+    if profile['uncompressed_share'] >= UNCOMPRESSED_SHARE_THRESHOLD:
+        return {'engine': 'pypdf', 'level': 'high', 'recompress_images': False,
+                'reason': f"{profile['uncompressed_share']:.0%} of stream data is "
+                          f"uncompressed; deflating it is enough"}
+
+    return {'engine': 'pypdf', 'level': 'medium', 'recompress_images': False,
+            'reason': f"mostly compressed text and vector content ({profile['pages']} pages, "
+                      f"{image_share:.0%} images); re-rendering with Ghostscript "
+                      f"would cost more than it saves"}
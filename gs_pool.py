@@ -0,0 +1,362 @@
+"""
+Managed pool of Ghostscript workers for the web application.
+
+Jobs are queued to a fixed set of long-lived worker threads, each of which
+drives Ghostscript for one file at a time. The queue is bounded: when it is
+full new work is refused straight away instead of piling up behind the
+request threads.
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from subprocess import CalledProcessError, Popen, PIPE, STDOUT, TimeoutExpired, run
+from typing import Callable, List, Optional, Tuple
+
+from linearizer import linearize_pdf
+from metrics import STAGE_SECONDS, StageTimer, record_result
+
+logger = logging.getLogger(__name__)
+
+GS_QUALITY_MAP = {
+    'screen': '/screen',
+    'ebook': '/ebook',
+    'printer': '/printer',
+    'prepress': '/prepress',
+    'default': '/default',
+}
+
+# Number of finished jobs whose timings are kept for stats().
+TIMING_HISTORY = 1000
+
+# Progress lines Ghostscript prints when it is not run with -dQUIET
+_PAGES_RE = re.compile(rb'Processing pages (\d+) through (\d+)')
+_PAGE_RE = re.compile(rb'^Page (\d+)')
+
+
+class PoolSaturated(Exception):
+    """Raised when a batch does not fit in the Ghostscript job queue."""
+
+    def __init__(self, message: str, retry: bool = True):
+        super().__init__(message)
+        # False when the batch could never fit, however long the caller waits
+        self.retry = retry
+
+
+def build_gs_command(input_path: str, output_path: str,
+                     gs_quality: str = 'ebook', quiet: bool = True,
+                     object_streams: bool = False) -> List[str]:
+    """
+    Build the Ghostscript command line for compressing one PDF.
+
+    Args:
+        input_path: Path to the input PDF file
+        output_path: Path where the compressed PDF will be saved
+        gs_quality: Key of GS_QUALITY_MAP
+        quiet: Whether to suppress Ghostscript's per-page progress output
+        object_streams: Whether to write PDF 1.5 with object streams and a
+            cross-reference stream instead of PDF 1.4
+    """
+    gs_quality_flag = GS_QUALITY_MAP.get(gs_quality, '/ebook')
+    if object_streams:
+        compatibility = ['-dCompatibilityLevel=1.5', '-dWriteObjStms=true', '-dWriteXRefStm=true']
+    else:
+        compatibility = ['-dCompatibilityLevel=1.4']
+    return [
+        'gs',
+        '-sDEVICE=pdfwrite',
+    ] + compatibility + [
+        f'-dPDFSETTINGS={gs_quality_flag}',
+        '-dNOPAUSE',
+    ] + (['-dQUIET'] if quiet else []) + [
+        '-dBATCH',
+        f'-sOutputFile={output_path}',
+        input_path
+    ]
+
+
+def run_ghostscript(input_path: str, output_path: str, gs_quality: str = 'ebook',
+                    timeout: Optional[float] = None, object_streams: bool = False) -> None:
+    """
+    Run Ghostscript once, outside any pool.
+
+    Raises:
+        CalledProcessError: If Ghostscript fails
+        TimeoutExpired: If it runs longer than timeout seconds
+    """
+    run(build_gs_command(input_path, output_path, gs_quality, object_streams=object_streams),
+        check=True, capture_output=True, timeout=timeout)
+
+
+class GhostscriptPool:
+    """
+    A fixed-size pool of Ghostscript workers with a bounded job queue.
+    """
+
+    def __init__(self, size: Optional[int] = None, queue_size: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        """
+        Start the worker threads.
+
+        Args:
+            size: Number of concurrent Ghostscript jobs (defaults to the
+                number of CPU cores)
+            queue_size: Maximum number of jobs waiting or running at once
+                (defaults to four per worker)
+            timeout: Seconds after which a single Ghostscript run is killed
+        """
+        self.size = size or os.cpu_count() or 2
+        self.queue_size = queue_size or self.size * 4
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._busy = 0
+        self._completed = 0
+        self._failed = 0
+        self._timings = deque(maxlen=TIMING_HISTORY)
+        self._closed = False
+        self._threads = []
+        for i in range(self.size):
+            thread = threading.Thread(target=self._worker, name=f'gs-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit_batch(self, jobs: List[Tuple[str, str, str]],
+                     on_progress: Optional[Callable[[int, dict], None]] = None) -> List[Future]:
+        """
+        Queue a batch of compression jobs, all or nothing.
+
+        Args:
+            jobs: List of (input_path, output_path, gs_quality) tuples,
+                optionally followed by the engine: 'ghostscript' (the
+                default) or 'auto' to let the file's profile decide
+                between Ghostscript and PyPDF2, by whether to write object
+                streams and by whether to linearize the output
+            on_progress: Called from the worker thread with the job's index
+                in the batch and a dictionary of pages_done, pages_total and
+                bytes_written each time Ghostscript finishes a page
+
+        Returns:
+            One Future per job, resolving to a dictionary with the job's
+            timings, the engine that compressed the file and, when asked
+            for, whether it was linearized
+
+        Raises:
+            PoolSaturated: If the batch does not fit in the queue
+        """
+        with self._lock:
+            if self._closed:
+                raise PoolSaturated('Ghostscript pool is shut down')
+            if len(jobs) > self.queue_size:
+                raise PoolSaturated(
+                    f'Too many files in one request (maximum {self.queue_size})', retry=False
+                )
+            if self._pending + len(jobs) > self.queue_size:
+                raise PoolSaturated('Ghostscript queue is full, try again shortly')
+            self._pending += len(jobs)
+
+        futures = []
+        for index, job in enumerate(jobs):
+            future = Future()
+            progress = None
+            if on_progress is not None:
+                progress = (lambda index: lambda update: on_progress(index, update))(index)
+            self._queue.put((job, progress, future, time.monotonic()))
+            futures.append(future)
+        return futures
+
+    def submit(self, input_path: str, output_path: str, gs_quality: str = 'ebook',
+               engine: str = 'ghostscript', object_streams: bool = False,
+               linearize: bool = False) -> Future:
+        """Queue a single compression job. See submit_batch."""
+        return self.submit_batch([(input_path, output_path, gs_quality, engine, object_streams,
+                                   linearize)])[0]
+
+    def _worker(self) -> None:
+        """Take jobs off the queue until a shutdown sentinel arrives."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, progress, future, queued_at = item
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                with self._lock:
+                    self._busy += 1
+                try:
+                    future.set_result(self._run_job(*job, queued_at=queued_at, progress=progress))
+                except Exception as e:
+                    with self._lock:
+                        self._failed += 1
+                    future.set_exception(e)
+                finally:
+                    with self._lock:
+                        self._busy -= 1
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def _run_job(self, input_path: str, output_path: str, gs_quality: str,
+                 engine: str = 'ghostscript', object_streams: bool = False,
+                 linearize: bool = False, queued_at: float = 0.0,
+                 progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """Compress one file and return its timings and the engine used."""
+        started_at = time.monotonic()
+        STAGE_SECONDS.observe(started_at - queued_at, stage='queue_wait')
+        try:
+            if engine == 'auto':
+                route = self._run_auto(input_path, output_path, gs_quality, object_streams,
+                                       linearize, progress)
+            else:
+                if progress is not None:
+                    progress({'stage': 'ghostscript', 'bytes_read': os.path.getsize(input_path)})
+                with StageTimer().stage('ghostscript'):
+                    self._run_gs(build_gs_command(input_path, output_path, gs_quality,
+                                                  quiet=progress is None,
+                                                  object_streams=object_streams),
+                                 output_path, progress)
+                route = {'engine': 'ghostscript'}
+                if linearize:
+                    route['linearized'] = self._linearize(output_path)
+                record_result('ghostscript', os.path.getsize(input_path), os.path.getsize(output_path))
+        finally:
+            finished_at = time.monotonic()
+        timings = {
+            'queued': round(started_at - queued_at, 4),
+            'runtime': round(finished_at - started_at, 4),
+        }
+        with self._lock:
+            self._completed += 1
+            self._timings.append(timings)
+        logger.info(f"{route['engine']} job {os.path.basename(input_path)} finished: "
+                    f"queued {timings['queued']:.3f}s, ran {timings['runtime']:.3f}s")
+        return dict(timings, **route)
+
+    def _linearize(self, output_path: str) -> bool:
+        """Linearize a finished output; a failure leaves it as it is."""
+        try:
+            with StageTimer().stage('linearize'):
+                linearize_pdf(output_path, timeout=self.timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not linearize {os.path.basename(output_path)}: {str(e)}")
+            return False
+
+    def _run_auto(self, input_path: str, output_path: str, gs_quality: str,
+                  object_streams: bool, linearize: bool,
+                  progress: Optional[Callable[[dict], None]]) -> dict:
+        """
+        Compress one file with the engine its profile calls for.
+
+        Returns:
+            Dictionary with the engine and engine_reason, and whether the
+            output was linearized when that was asked for
+
+        Raises:
+            CalledProcessError: If Ghostscript was chosen and failed
+            TimeoutExpired: If Ghostscript was chosen and timed out
+            RuntimeError: For any other failure, raised from its cause
+        """
+        # Imported here because pdf_compressor imports this module
+        from pdf_compressor import PDFCompressor
+        compressor = PDFCompressor(progress=progress)
+        success, message = compressor.compress_auto(
+            input_path, output_path, gs_quality,
+            run_ghostscript=lambda i, o, q, object_streams=False: self._run_gs(
+                build_gs_command(i, o, q, quiet=progress is None,
+                                 object_streams=object_streams), o, progress
+            ),
+            object_streams=object_streams,
+            linearize=linearize
+        )
+        if not success:
+            # Ghostscript failures surface as they do for the ghostscript engine
+            if isinstance(compressor.error, (CalledProcessError, TimeoutExpired)):
+                raise compressor.error
+            raise RuntimeError(message) from compressor.error
+        choice = compressor.engine_choice
+        route = {'engine': choice['engine'], 'engine_reason': choice['reason']}
+        if linearize:
+            route['linearized'] = compressor.linearized
+        return route
+
+    def _run_gs(self, gs_cmd: List[str], output_path: str,
+                progress: Optional[Callable[[dict], None]]) -> None:
+        """
+        Run one Ghostscript process, reporting pages as they are written.
+
+        Raises:
+            CalledProcessError: If Ghostscript fails; its messages are in stderr
+            TimeoutExpired: If Ghostscript runs longer than the pool timeout
+        """
+        process = Popen(gs_cmd, stdout=PIPE, stderr=STDOUT)
+        timed_out = threading.Event()
+        timer = None
+        if self.timeout:
+            def kill():
+                timed_out.set()
+                process.kill()
+            timer = threading.Timer(self.timeout, kill)
+            timer.start()
+
+        messages = []
+        state = {'stage': 'ghostscript', 'pages_done': 0, 'pages_total': None, 'bytes_written': 0}
+        try:
+            for line in process.stdout:
+                page = _PAGE_RE.match(line)
+                pages = _PAGES_RE.search(line)
+                if page and progress is not None:
+                    state['pages_done'] = int(page.group(1))
+                    if os.path.exists(output_path):
+                        state['bytes_written'] = os.path.getsize(output_path)
+                    progress(dict(state))
+                elif pages:
+                    state['pages_total'] = int(pages.group(2)) - int(pages.group(1)) + 1
+                else:
+                    messages.append(line)
+            returncode = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out.is_set():
+            raise TimeoutExpired(gs_cmd, self.timeout)
+        if returncode != 0:
+            raise CalledProcessError(returncode, gs_cmd, stderr=b''.join(messages))
+        if progress is not None:
+            state['bytes_written'] = os.path.getsize(output_path)
+            progress(dict(state))
+
+    def stats(self) -> dict:
+        """Return the pool's current load and recent job timings."""
+        with self._lock:
+            timings = list(self._timings)
+            stats = {
+                'size': self.size,
+                'queue_size': self.queue_size,
+                'pending': self._pending,
+                'busy': self._busy,
+                'completed': self._completed,
+                'failed': self._failed,
+            }
+        if timings:
+            stats['avg_queued'] = sum(t['queued'] for t in timings) / len(timings)
+            stats['avg_runtime'] = sum(t['runtime'] for t in timings) / len(timings)
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs and stop the workers once the queue drains."""
+        with self._lock:
+            self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
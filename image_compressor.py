@@ -0,0 +1,342 @@
+"""
+Image XObject recompression for PDF files.
+
+Finds every image XObject referenced from the pages of a document, works
+out how large it is drawn on the page, and re-encodes it as JPEG -
+downsampled to a target resolution - whenever that makes it smaller.
+"""
+
+import io
+import logging
+import math
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Container, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+from PyPDF2.generic import ContentStream, IndirectObject, NameObject, NumberObject
+
+logger = logging.getLogger(__name__)
+
+# Images are only downsampled when their effective resolution exceeds the
+# target by this factor, so that images already close to the target are
+# not resampled for a negligible gain (Ghostscript uses the same default).
+DOWNSAMPLE_THRESHOLD = 1.5
+
+# Limit on nested form XObjects followed when looking for image placements.
+MAX_FORM_DEPTH = 8
+
+_IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+_COLOR_MODES = {'/DeviceRGB': 'RGB', '/DeviceGray': 'L'}
+_ICC_MODES = {1: 'L', 3: 'RGB'}
+
+
+def _multiply(m: Tuple[float, ...], n: Tuple[float, ...]) -> Tuple[float, ...]:
+    """Multiply two PDF transformation matrices (``m`` applied first)."""
+    return (
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    )
+
+
+def _image_mode(image) -> Optional[str]:
+    """Return the Pillow mode for an image XObject, or None if unsupported."""
+    color_space = image.get('/ColorSpace')
+    if isinstance(color_space, IndirectObject):
+        color_space = color_space.get_object()
+    if isinstance(color_space, list):
+        if len(color_space) == 2 and color_space[0] == '/ICCBased':
+            profile = color_space[1].get_object()
+            return _ICC_MODES.get(int(profile.get('/N', 0)))
+        return None
+    return _COLOR_MODES.get(color_space)
+
+
+def _walk_content(reader, content, resources, ctm, page_num: int,
+                  placements: Dict[int, dict], depth: int = 0) -> None:
+    """Record the placed size of every image drawn by a content stream."""
+    if content is None or resources is None or depth > MAX_FORM_DEPTH:
+        return
+    resources = resources.get_object()
+    xobjects = resources.get('/XObject')
+    if xobjects is None:
+        return
+    xobjects = xobjects.get_object()
+
+    if not isinstance(content, ContentStream):
+        content = ContentStream(content, reader)
+
+    stack = []
+    for operands, operator in content.operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop() if stack else _IDENTITY
+        elif operator == b'cm' and len(operands) == 6:
+            ctm = _multiply(tuple(float(x) for x in operands), ctm)
+        elif operator == b'Do' and operands:
+            reference = xobjects.raw_get(operands[0]) if operands[0] in xobjects else None
+            if not isinstance(reference, IndirectObject):
+                continue
+            xobject = reference.get_object()
+            subtype = xobject.get('/Subtype')
+
+            if subtype == '/Image':
+                placement = placements.setdefault(reference.idnum, {
+                    'reference': reference,
+                    'pages': [],
+                    'width': 0.0,
+                    'height': 0.0,
+                })
+                if page_num + 1 not in placement['pages']:
+                    placement['pages'].append(page_num + 1)
+                # The largest placement decides how much resolution is needed
+                placement['width'] = max(placement['width'], math.hypot(ctm[0], ctm[1]))
+                placement['height'] = max(placement['height'], math.hypot(ctm[2], ctm[3]))
+            elif subtype == '/Form':
+                matrix = xobject.get('/Matrix')
+                form_ctm = _multiply(tuple(float(x) for x in matrix), ctm) if matrix else ctm
+                _walk_content(reader, xobject, xobject.get('/Resources', resources),
+                              form_ctm, page_num, placements, depth + 1)
+
+
+def find_images(reader, pages: Optional[Iterable[Tuple[int, Any]]] = None) -> Dict[int, dict]:
+    """
+    Find the image XObjects drawn on the pages of a PDF.
+
+    Args:
+        reader: An open PyPDF2.PdfReader
+        pages: (page index, page) pairs to look at (defaults to every page)
+
+    Returns:
+        Dictionary mapping object numbers to placement information: the
+        indirect reference, the page numbers it appears on, and its largest
+        placed width and height in points
+    """
+    placements = {}
+    for page_num, page in (enumerate(reader.pages) if pages is None else pages):
+        _walk_content(reader, page.get_contents(), page.get('/Resources'),
+                      _IDENTITY, page_num, placements)
+    return placements
+
+
+def _build_job(image, placement: dict, quality: int, target_dpi: int) -> dict:
+    """Describe the recompression of one image for a worker process."""
+    job = {
+        'object': placement['reference'].idnum,
+        'pages': placement['pages'],
+        'width': int(image.get('/Width', 0)),
+        'height': int(image.get('/Height', 0)),
+        'original_size': len(image._data),
+        'quality': quality,
+        'scale': 1.0,
+    }
+
+    filters = image.get('/Filter')
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else None
+    mode = _image_mode(image)
+
+    if image.get('/ImageMask') or '/Decode' in image:
+        job['skip'] = 'image mask or decode array'
+    elif mode is None:
+        job['skip'] = 'unsupported color space'
+    elif int(image.get('/BitsPerComponent', 8)) != 8:
+        job['skip'] = 'unsupported bit depth'
+    elif filters not in (None, '/DCTDecode', '/FlateDecode'):
+        job['skip'] = f'unsupported filter {filters}'
+    elif filters == '/FlateDecode' and image.get('/DecodeParms'):
+        job['skip'] = 'predictor-encoded image'
+    else:
+        job.update({'mode': mode, 'filter': filters, 'data': image._data})
+
+    if placement['width'] and placement['height'] and job['width'] and job['height']:
+        dpi = min(job['width'] / (placement['width'] / 72.0),
+                  job['height'] / (placement['height'] / 72.0))
+        job['dpi'] = round(dpi)
+        job['scale'] = downsample_scale(dpi, target_dpi)
+
+    return job
+
+
+def downsample_scale(dpi: Optional[float], target_dpi: int) -> float:
+    """Scale factor that brings an image placed at dpi down to target_dpi."""
+    if dpi and dpi > target_dpi * DOWNSAMPLE_THRESHOLD:
+        return target_dpi / dpi
+    return 1.0
+
+
+def scaled_size(job: dict, scale: float) -> Tuple[int, int]:
+    """Pixel size of a job's image after scaling."""
+    return max(1, round(job['width'] * scale)), max(1, round(job['height'] * scale))
+
+
+def decode_image(job: dict, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    Decode a job's image data with Pillow.
+
+    Args:
+        job: Job description built by ``_build_job``, not skipped
+        size: Size the image is about to be scaled to; JPEG images are
+            then decoded at a reduced size where possible
+
+    Returns:
+        The image, in the job's color mode
+    """
+    if job['filter'] == '/DCTDecode':
+        image = Image.open(io.BytesIO(job['data']))
+        if size is not None:
+            # Let the JPEG decoder do most of the downscaling
+            image.draft(job['mode'], size)
+        if image.mode != job['mode']:
+            image = image.convert(job['mode'])
+        return image
+    raw = zlib.decompress(job['data']) if job['filter'] else job['data']
+    return Image.frombytes(job['mode'], (job['width'], job['height']), raw)
+
+
+def encode_jpeg(image: Image.Image, size: Tuple[int, int], quality: int) -> bytes:
+    """Scale an image to size and encode it as JPEG."""
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def recompress_image(job: dict) -> dict:
+    """
+    Decode, downsample and re-encode a single image as JPEG.
+
+    Runs inside a worker process.
+
+    Args:
+        job: Job description built by ``_build_job``
+
+    Returns:
+        Result dictionary with the original and new sizes; ``data`` holds
+        the new JPEG stream when it is smaller than the original
+    """
+    result = {
+        'object': job['object'],
+        'pages': job['pages'],
+        'dpi': job.get('dpi'),
+        'original_size': job['original_size'],
+        'compressed_size': job['original_size'],
+        'saved': 0,
+        'data': None,
+    }
+    if 'skip' in job:
+        result['status'] = 'skipped'
+        result['reason'] = job['skip']
+        return result
+
+    try:
+        new_size = scaled_size(job, job['scale'])
+        data = encode_jpeg(decode_image(job, new_size), new_size, job['quality'])
+    except Exception as e:
+        result['status'] = 'failed'
+        result['reason'] = str(e)
+        return result
+
+    if len(data) >= job['original_size']:
+        result['status'] = 'kept'
+        result['reason'] = 'recompressed image is not smaller'
+        return result
+
+    result.update({
+        'status': 'replaced',
+        'compressed_size': len(data),
+        'saved': job['original_size'] - len(data),
+        'data': data,
+        'new_width': new_size[0],
+        'new_height': new_size[1],
+    })
+    return result
+
+
+def replace_image(image, result: dict) -> None:
+    """Swap the stream data of an image XObject for a recompressed JPEG."""
+    # PyPDF2 has no public setter for encoded stream data
+    image._data = result['data']
+    if hasattr(image, 'decoded_self'):
+        image.decoded_self = None
+    image[NameObject('/Filter')] = NameObject('/DCTDecode')
+    image[NameObject('/Width')] = NumberObject(result['new_width'])
+    image[NameObject('/Height')] = NumberObject(result['new_height'])
+    image[NameObject('/BitsPerComponent')] = NumberObject(8)
+    if '/DecodeParms' in image:
+        del image['/DecodeParms']
+
+
+def image_jobs(reader, quality: int = 85, target_dpi: int = 150,
+               pages: Optional[Iterable[Tuple[int, Any]]] = None,
+               exclude: Container[int] = ()) -> Tuple[Dict[int, object], List[dict]]:
+    """
+    Describe the recompression of every image drawn on the pages of a PDF.
+
+    Args:
+        reader: An open PyPDF2.PdfReader, or a PdfWriter holding pages
+        quality: JPEG quality for the re-encoded images (1-100)
+        target_dpi: Resolution to downsample images to
+        pages: (page index, page) pairs whose images are included (defaults
+            to every page); placements on other pages are then not considered
+        exclude: Object numbers of images to leave out
+
+    Returns:
+        Tuple of the image XObjects by object number and one job per image
+        (see recompress_image)
+    """
+    placements = {idnum: placement for idnum, placement in find_images(reader, pages).items()
+                  if idnum not in exclude}
+    images = {idnum: placement['reference'].get_object()
+              for idnum, placement in placements.items()}
+    jobs = [_build_job(images[idnum], placement, quality, target_dpi)
+            for idnum, placement in placements.items()]
+    return images, jobs
+
+
+def recompress_images(reader, quality: int = 85, target_dpi: int = 150,
+                      workers: int = 1, pages: Optional[Iterable[Tuple[int, Any]]] = None,
+                      exclude: Container[int] = ()) -> List[dict]:
+    """
+    Recompress the image XObjects of an open PDF in place.
+
+    Each image is decoded with Pillow, downsampled to ``target_dpi`` based
+    on its placed size, re-encoded as JPEG and swapped in only when the
+    result is smaller. Modified images are picked up by any PdfWriter the
+    reader's pages are added to afterwards.
+
+    Args:
+        reader: An open PyPDF2.PdfReader
+        quality: JPEG quality for the re-encoded images (1-100)
+        target_dpi: Resolution to downsample images to
+        workers: Number of worker processes (0 uses one per CPU core)
+        pages: Only recompress the images on these (page index, page) pairs
+        exclude: Object numbers of images to leave alone
+
+    Returns:
+        List with one result dictionary per image, reporting its status
+        and the bytes saved
+    """
+    images, jobs = image_jobs(reader, quality, target_dpi, pages, exclude)
+
+    if workers == 1 or len(jobs) <= 1:
+        results = [recompress_image(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            results = list(pool.map(recompress_image, jobs, chunksize=4))
+
+    for result in results:
+        if result['status'] == 'replaced':
+            replace_image(images[result['object']], result)
+        elif result['status'] == 'failed':
+            logger.warning(f"Could not recompress image {result['object']}: {result['reason']}")
+        result.pop('data')
+
+    return results
@@ -0,0 +1,268 @@
+"""
+Asynchronous compression jobs for the web application.
+
+A job groups the files of one upload. It is queued on the Ghostscript pool
+and returns immediately; callers poll its status, wait for it, or follow
+its progress as a stream of events.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from subprocess import CalledProcessError, TimeoutExpired
+from typing import Callable, Iterator, List, Optional
+
+from result_cache import make_key
+
+# Finished jobs are forgotten after this many seconds.
+JOB_TTL = 3600
+
+
+class CompressionJob:
+    """
+    The files of one upload and their progress through the Ghostscript pool.
+    """
+
+    def __init__(self, files: List[dict], gs_quality: str, engine: str = 'ghostscript',
+                 object_streams: bool = False, linearize: bool = False):
+        """
+        Args:
+            files: One dictionary per uploaded file. Accepted files carry
+                filename, output_filename, input_path and output_path;
+                rejected files carry a finished ``result`` instead.
+            gs_quality: Ghostscript quality preset for every file
+            engine: 'ghostscript', or 'auto' to pick an engine per file
+            object_streams: Whether outputs are written with object streams
+            linearize: Whether outputs are linearized for fast web view
+        """
+        self.id = uuid.uuid4().hex
+        self.gs_quality = gs_quality
+        self.engine = engine
+        self.object_streams = object_streams
+        self.linearize = linearize
+        self.created = time.time()
+        self.finished = None
+        self.files = files
+        for entry in files:
+            entry.setdefault('status', 'finished' if 'result' in entry else 'queued')
+            entry.setdefault('stage', None)
+            entry.setdefault('pages_done', 0)
+            entry.setdefault('pages_total', None)
+            entry.setdefault('bytes_read', 0)
+            entry.setdefault('bytes_written', 0)
+        # Bumped on every change so event streams know when to send an update
+        self.version = 0
+        self._changed = threading.Condition()
+        if self.status == 'finished':
+            self.finished = self.created
+
+    @property
+    def status(self) -> str:
+        """'queued', 'running' or 'finished'."""
+        statuses = [entry['status'] for entry in self.files if 'input_path' in entry]
+        if all(status == 'finished' for status in statuses):
+            return 'finished'
+        if all(status == 'queued' for status in statuses):
+            return 'queued'
+        return 'running'
+
+    def update(self, index: int, **changes) -> None:
+        """Apply changes to one file and wake up anyone following the job."""
+        with self._changed:
+            self.files[index].update(changes)
+            if self.status == 'finished' and self.finished is None:
+                self.finished = time.time()
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the job changes past ``version`` or finishes.
+
+        Returns:
+            True if the job changed, False on timeout
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self.status == 'finished' or (version is not None and self.version != version),
+                timeout
+            )
+
+    def progress(self) -> dict:
+        """Return the job's status and per-file progress."""
+        with self._changed:
+            files = [{
+                'filename': entry.get('filename') or entry['result'].get('original_filename'),
+                'status': entry['status'],
+                'stage': entry['stage'],
+                'pages_done': entry['pages_done'],
+                'pages_total': entry['pages_total'],
+                'bytes_read': entry['bytes_read'],
+                'bytes_written': entry['bytes_written'],
+            } for entry in self.files]
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'version': self.version,
+                'files_done': sum(1 for f in files if f['status'] == 'finished'),
+                'files_total': len(files),
+                'pages_done': sum(f['pages_done'] for f in files),
+                'bytes_written': sum(f['bytes_written'] for f in files),
+                'files': files,
+            }
+
+    def results(self) -> List[dict]:
+        """Return the per-file results, in upload order."""
+        with self._changed:
+            return [entry.get('result') for entry in self.files]
+
+
+class JobManager:
+    """
+    Creates compression jobs, runs them on a GhostscriptPool and keeps
+    track of them until they expire.
+    """
+
+    def __init__(self, pool, build_result: Callable[[dict, Optional[dict]], dict],
+                 ttl: float = JOB_TTL, cache=None):
+        """
+        Args:
+            pool: The GhostscriptPool that runs the files
+            build_result: Builds the result dictionary of a compressed file
+                from its entry and Ghostscript timings
+            ttl: Seconds finished jobs are kept for
+            cache: Optional ResultCache; files already compressed with the
+                same preset are served from it without running Ghostscript
+        """
+        self.pool = pool
+        self.build_result = build_result
+        self.ttl = ttl
+        self.cache = cache
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, files: List[dict], gs_quality: str, engine: str = 'ghostscript',
+               object_streams: bool = False, linearize: bool = False) -> CompressionJob:
+        """
+        Queue the accepted files of an upload and return the job at once.
+        
+        With engine 'auto' each file is profiled in the pool and compressed
+        with PyPDF2 or Ghostscript, whichever suits it. With object_streams
+        outputs are written as PDF 1.5 with object streams and a
+        cross-reference stream; with linearize they are linearized for fast
+        web view.
+
+        Raises:
+            PoolSaturated: If the files do not fit in the Ghostscript queue
+        """
+        self._expire()
+        for entry in files:
+            if 'result' not in entry:
+                self._serve_from_cache(entry, gs_quality, engine, object_streams, linearize)
+        job = CompressionJob(files, gs_quality, engine, object_streams, linearize)
+        accepted = [i for i, entry in enumerate(files) if 'result' not in entry]
+
+        futures = self.pool.submit_batch(
+            [(files[i]['input_path'], files[i]['output_path'], gs_quality, engine, object_streams,
+              linearize) for i in accepted],
+            on_progress=lambda n, update: job.update(accepted[n], status='running', **update)
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+        for index, future in zip(accepted, futures):
+            future.add_done_callback(
+                lambda future, index=index: self._finish_file(job, index, future)
+            )
+        return job
+
+    def _cache_key(self, entry: dict, gs_quality: str, engine: str,
+                   object_streams: bool, linearize: bool) -> Optional[str]:
+        """Return the cache key of an entry, or None when it cannot be cached."""
+        if self.cache is None or not entry.get('sha256'):
+            return None
+        return make_key(entry['sha256'], engine, gs_quality=gs_quality,
+                        object_streams=object_streams, linearize=linearize)
+
+    def _serve_from_cache(self, entry: dict, gs_quality: str, engine: str,
+                          object_streams: bool, linearize: bool) -> None:
+        """Finish an entry straight away if its result is already cached."""
+        key = self._cache_key(entry, gs_quality, engine, object_streams, linearize)
+        if key is None or not self.cache.get(key, entry['output_path']):
+            return
+        try:
+            timings = {'queued': 0.0, 'runtime': 0.0, 'cached': True}
+            if linearize:
+                # Only linearized outputs are cached when linearization is asked for
+                timings['linearized'] = True
+            entry['result'] = self.build_result(entry, timings)
+            entry['status'] = 'finished'
+            entry['bytes_written'] = os.path.getsize(entry['output_path'])
+        finally:
+            os.remove(entry['input_path'])
+
+    def _finish_file(self, job: CompressionJob, index: int, future) -> None:
+        """Record the outcome of one file once Ghostscript is done with it."""
+        entry = job.files[index]
+        try:
+            outcome = future.result()
+            result = self.build_result(entry, outcome)
+            key = self._cache_key(entry, job.gs_quality, job.engine, job.object_streams, job.linearize)
+            # An output whose linearization failed is not what the key describes
+            if key is not None and outcome.get('linearized', False) == job.linearize:
+                self.cache.put(key, entry['output_path'])
+        except CalledProcessError as e:
+            result = {
+                'success': False,
+                'original_filename': entry['filename'],
+                'error': f'Ghostscript compression failed: {e.stderr.decode() if e.stderr else str(e)}'
+            }
+        except TimeoutExpired:
+            result = {
+                'success': False,
+                'original_filename': entry['filename'],
+                'error': 'Ghostscript compression timed out'
+            }
+        except Exception as e:
+            result = {
+                'success': False,
+                'original_filename': entry['filename'],
+                'error': f'An error occurred: {str(e)}'
+            }
+        finally:
+            if os.path.exists(entry['input_path']):
+                os.remove(entry['input_path'])
+        job.update(index, status='finished', result=result)
+
+    def get(self, job_id: str) -> Optional[CompressionJob]:
+        """Return a job by id, or None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def events(self, job: CompressionJob, keepalive: float = 15.0) -> Iterator[str]:
+        """
+        Yield the job's progress as Server-Sent Events until it finishes.
+
+        A ``progress`` event is sent for every change, a comment line after
+        ``keepalive`` seconds without one, and a final ``done`` event.
+        """
+        version = None
+        while True:
+            progress = job.progress()
+            if progress['status'] == 'finished':
+                yield f"event: done\ndata: {json.dumps(progress)}\n\n"
+                return
+            if progress['version'] != version:
+                version = progress['version']
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            if not job.wait(version, keepalive):
+                yield ": keep-alive\n\n"
+
+    def _expire(self) -> None:
+        """Forget finished jobs older than the TTL."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished is not None and job.finished < cutoff]:
+                del self._jobs[job_id]
@@ -0,0 +1,101 @@
+"""
+Linearization ("fast web view") of compressed PDFs.
+
+A linearized PDF starts with a dictionary announcing it, followed by the
+first page and everything it needs, and hint tables locating the objects
+of every other page. A viewer fetching the file with HTTP range requests
+can then show page one after the first few kilobytes instead of after the
+whole file.
+
+qpdf (its command line tool, or the pikepdf binding) linearizes without
+touching any content. When only Ghostscript is installed it is used
+instead with -dFastWebView, which re-distills the file.
+"""
+
+import importlib.util
+import logging
+import os
+import shutil
+import tempfile
+from subprocess import CalledProcessError, run
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# The linearization dictionary must be the first object, well within this
+# many bytes of the start of the file
+LINEARIZED_PROBE_BYTES = 1024
+
+# qpdf exits with 3 when it succeeded but printed warnings
+_QPDF_WARNINGS = 3
+
+
+class LinearizationUnavailable(Exception):
+    """Raised when no tool that can linearize a PDF is installed."""
+
+
+def available_tool() -> Optional[str]:
+    """Return the linearization tool that would be used: 'qpdf', 'pikepdf', 'ghostscript' or None."""
+    if shutil.which('qpdf'):
+        return 'qpdf'
+    if importlib.util.find_spec('pikepdf') is not None:
+        return 'pikepdf'
+    if shutil.which('gs'):
+        return 'ghostscript'
+    return None
+
+
+def is_linearized(path: str) -> bool:
+    """Whether a PDF file announces itself as linearized."""
+    with open(path, 'rb') as file:
+        return b'/Linearized' in file.read(LINEARIZED_PROBE_BYTES)
+
+
+def linearize_pdf(path: str, tool: Optional[str] = None, timeout: Optional[float] = None) -> str:
+    """
+    Linearize a PDF file in place.
+
+    The linearized copy is written next to the file and moved over it, so
+    the file is never left half-written.
+
+    Args:
+        path: The PDF file to linearize
+        tool: 'qpdf', 'pikepdf' or 'ghostscript' (defaults to available_tool())
+        timeout: Seconds the qpdf or Ghostscript process may run for
+
+    Returns:
+        The tool that linearized the file
+
+    Raises:
+        LinearizationUnavailable: If no linearization tool is installed
+        CalledProcessError: If qpdf or Ghostscript fails
+        TimeoutExpired: If they run longer than timeout
+    """
+    tool = tool or available_tool()
+    if tool is None:
+        raise LinearizationUnavailable('Linearization needs qpdf, pikepdf or Ghostscript')
+
+    fd, temp_path = tempfile.mkstemp(suffix='.pdf', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        if tool == 'qpdf':
+            command = ['qpdf', '--linearize', path, temp_path]
+            result = run(command, capture_output=True, timeout=timeout)
+            if result.returncode not in (0, _QPDF_WARNINGS):
+                raise CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+        elif tool == 'pikepdf':
+            import pikepdf
+            with pikepdf.open(path) as pdf:
+                pdf.save(temp_path, linearize=True)
+        elif tool == 'ghostscript':
+            run(['gs', '-sDEVICE=pdfwrite', '-dFastWebView=true', '-dNOPAUSE', '-dQUIET',
+                 '-dBATCH', f'-sOutputFile={temp_path}', path],
+                check=True, capture_output=True, timeout=timeout)
+        else:
+            raise ValueError(f"Unknown linearization tool: {tool}")
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info(f"Linearized {os.path.basename(path)} with {tool}")
+    return tool
@@ -6,25 +6,40 @@ PDF Compressor Web Application - A modern web interface for PDF compression.
 import os
 import tempfile
 import uuid
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
+import time
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, flash, redirect, url_for
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from pdf_compressor import PDFCompressor
+from gs_pool import GhostscriptPool, PoolSaturated
+from jobs import JobManager
+from queue_pool import QueuePool
+from work_queue import WorkQueue
+from output_store import OutputStore
+import metrics
+from upload_stream import InvalidUpload, StreamingRequest, UploadFile
+from result_cache import open_cache
+from size_estimator import SAMPLE_PAGES, estimate_sizes
+from zip_stream import stream_zip
 import logging
-from subprocess import run, CalledProcessError
-import zipfile
-import io
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Stream uploaded PDFs straight to disk while the request body is parsed
+app.request_class = StreamingRequest
 app.secret_key = 'atlverse-pdf-compressor-secret-key-2024'
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 COMPRESSED_FOLDER = 'compressed'
 ALLOWED_EXTENSIONS = {'pdf'}
+# 'auto' profiles each file and uses PyPDF2 or Ghostscript, whichever suits it
+COMPRESSION_METHODS = ('ghostscript', 'auto')
+# Most pages /estimate compresses per setting, however many are asked for
+MAX_ESTIMATE_PAGES = 16
 
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -32,15 +47,58 @@ os.makedirs(COMPRESSED_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['COMPRESSED_FOLDER'] = COMPRESSED_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+# Uploads are streamed to disk, so this only bounds disk usage, not memory
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 50)) * 1024 * 1024
 
-GS_QUALITY_MAP = {
-    'screen': '/screen',
-    'ebook': '/ebook',
-    'printer': '/printer',
-    'prepress': '/prepress',
-    'default': '/default',
-}
+# Ghostscript worker pool: concurrent jobs, jobs allowed to wait or run at
+# once, and seconds after which a single Ghostscript run is killed
+app.config['GS_POOL_SIZE'] = int(os.environ.get('GS_POOL_SIZE', os.cpu_count() or 2))
+app.config['GS_QUEUE_SIZE'] = int(os.environ.get('GS_QUEUE_SIZE', app.config['GS_POOL_SIZE'] * 4))
+app.config['GS_TIMEOUT'] = float(os.environ.get('GS_TIMEOUT', 600))
+
+# Shared work queue (a SQLite file every worker host can reach). When set,
+# uploads are compressed by `cli.py worker` processes instead of in here
+app.config['WORK_QUEUE'] = os.environ.get('WORK_QUEUE', '')
+app.config['WORK_QUEUE_LIMIT'] = int(os.environ.get('WORK_QUEUE_LIMIT', 1000))
+
+# Result cache for repeated uploads (set RESULT_CACHE_DIR to '' to disable)
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', 'cache')
+app.config['RESULT_CACHE_MB'] = int(os.environ.get('RESULT_CACHE_MB', 1024))
+
+# Retention of compressed outputs: seconds they are kept for, total size they
+# are trimmed to (0 for no quota), and how often the background reaper runs
+app.config['OUTPUT_TTL'] = float(os.environ.get('OUTPUT_TTL', 3600))
+app.config['OUTPUT_QUOTA_MB'] = int(os.environ.get('OUTPUT_QUOTA_MB', 0))
+app.config['OUTPUT_REAPER_INTERVAL'] = float(os.environ.get('OUTPUT_REAPER_INTERVAL', 60))
+
+result_cache = open_cache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MB'] * 1024 * 1024)
+output_store = OutputStore(COMPRESSED_FOLDER, ttl=app.config['OUTPUT_TTL'],
+                           max_bytes=app.config['OUTPUT_QUOTA_MB'] * 1024 * 1024 or None)
+output_store.start_reaper(app.config['OUTPUT_REAPER_INTERVAL'])
+if app.config['WORK_QUEUE']:
+    gs_pool = QueuePool(WorkQueue(app.config['WORK_QUEUE']), app.config['WORK_QUEUE_LIMIT'],
+                        app.config['GS_TIMEOUT'])
+else:
+    gs_pool = GhostscriptPool(app.config['GS_POOL_SIZE'], app.config['GS_QUEUE_SIZE'],
+                              app.config['GS_TIMEOUT'])
+
+def gs_queue_depth():
+    """Jobs waiting for a worker, from a single snapshot of the pool."""
+    stats = gs_pool.stats()
+    return stats['pending'] - stats['busy']
+
+# Load and capacity, read whenever /metrics is scraped
+metrics.gauge('pdfcompressor_gs_queue_depth', 'Ghostscript jobs waiting for a worker',
+              gs_queue_depth)
+metrics.gauge('pdfcompressor_gs_busy_workers', 'Ghostscript workers running a job',
+              lambda: gs_pool.stats()['busy'])
+metrics.gauge('pdfcompressor_output_bytes', 'Bytes of compressed outputs kept for download',
+              lambda: output_store.usage()['bytes'])
+if result_cache is not None:
+    metrics.gauge('pdfcompressor_cache_hits', 'Result cache hits since start',
+                  lambda: result_cache.stats()['hits'])
+    metrics.gauge('pdfcompressor_cache_misses', 'Result cache misses since start',
+                  lambda: result_cache.stats()['misses'])
 
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension."""
@@ -56,115 +114,277 @@ def get_file_size(file_path):
         size /= 1024.0
     return f"{size:.1f} TB"
 
+@app.teardown_request
+def discard_uploads(exc):
+    """Delete uploaded files that no route took ownership of."""
+    if isinstance(request, StreamingRequest):
+        request.discard_unclaimed_uploads()
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Observe the latency of every request, and count server errors."""
+    if 'request_started' in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_started,
+                                        endpoint=request.endpoint or 'unknown',
+                                        status=response.status_code)
+    if response.status_code >= 500:
+        metrics.ERRORS.inc(stage='request')
+    return response
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Report uploads over MAX_CONTENT_LENGTH as JSON."""
+    max_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'Upload exceeds the maximum size of {max_mb}MB'}), 413
+
+@app.errorhandler(InvalidUpload)
+def invalid_upload(e):
+    """Report files rejected while streaming as JSON."""
+    return jsonify({'error': e.description}), 415
+
 @app.route('/')
 def index():
     """Main page with upload form."""
-    return render_template('index.html')
+    return render_template('index.html',
+                           max_upload_mb=app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024))
+
+def save_uploads(files):
+    """
+    Save uploaded files and describe them for a compression job.
+    
+    Files with a disallowed extension are not saved; their entry carries
+    a finished error result instead.
+    """
+    entries = []
+    try:
+        for file in files:
+            save_upload(file, entries)
+    except Exception:
+        for entry in entries:
+            if 'input_path' in entry and os.path.exists(entry['input_path']):
+                os.remove(entry['input_path'])
+        raise
+    return entries
+
+def save_upload(file, entries):
+    """Save one uploaded file and append its entry to entries."""
+    if file.filename == '':
+        return
+    if not allowed_file(file.filename):
+        entries.append({'result': {
+            'success': False,
+            'original_filename': file.filename,
+            'error': 'File type not allowed.'
+        }})
+        return
+
+    filename = secure_filename(file.filename)
+    name, ext = os.path.splitext(filename)
+    output_filename = f"{name}_compressed{ext}"
+    output_path = os.path.join(app.config['COMPRESSED_FOLDER'], f"{uuid.uuid4().hex}_{output_filename}")
+    input_path, sha256 = claim_upload(file, filename)
+    entries.append({
+        'filename': filename,
+        'output_filename': output_filename,
+        'input_path': input_path,
+        'output_path': output_path,
+        'sha256': sha256,
+        'owner': request.remote_addr,
+    })
+
+def claim_upload(file, filename, prefix=''):
+    """
+    Take ownership of an uploaded file on disk.
+    
+    Returns:
+        Tuple of (path, SHA-256 hex digest or None)
+    """
+    if isinstance(file.stream, UploadFile):
+        # Already streamed to the upload folder while the body was parsed
+        return file.stream.claim(), file.stream.sha256
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{prefix}{uuid.uuid4().hex}_{filename}")
+    file.save(input_path)
+    return input_path, None
+
+def build_file_result(entry, timings):
+    """Build the JSON result for a successfully compressed file."""
+    timings = dict(timings)
+    engine = timings.pop('engine', None)
+    engine_reason = timings.pop('engine_reason', None)
+    linearized = timings.pop('linearized', False)
+    original_size = os.path.getsize(entry['input_path'])
+    compressed_size = os.path.getsize(entry['output_path'])
+    space_saved = original_size - compressed_size
+    compression_ratio = (space_saved / original_size) * 100 if original_size else 0
+    file_id = output_store.add(entry['output_path'], entry['output_filename'], entry.get('owner'))
+    download_path = f"/download/{os.path.basename(entry['output_path'])}?download_name={entry['output_filename']}"
+    return {
+        'success': True,
+        'file_id': file_id,
+        'original_filename': entry['filename'],
+        'compressed_filename': entry['output_filename'],
+        'download_path': download_path,
+        'view_path': f"{download_path}&inline=1",
+        'stats': {
+            'original_size': f'{original_size/1024:.1f} KB',
+            'compressed_size': f'{compressed_size/1024:.1f} KB',
+            'space_saved': f'{space_saved/1024:.1f} KB',
+            'compression_ratio': f'{compression_ratio:.1f}%'
+        },
+        'engine': engine,
+        'engine_reason': engine_reason,
+        'linearized': linearized,
+        'timings': timings
+    }
+
+job_manager = JobManager(gs_pool, build_file_result, cache=result_cache)
+
+def submit_upload():
+    """
+    Save the files of the current request and queue them as a job.
+    
+    Returns:
+        Tuple of (job, error response); exactly one of them is None
+    """
+    # Parsing the body streams the uploads to disk
+    with metrics.timed_stage(None, 'upload_save'):
+        files = request.files.getlist('file')
+    if not files or all(f.filename == '' for f in files):
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    
+    gs_quality = request.form.get('gs_quality', 'ebook')
+    engine = request.form.get('compression_method', 'ghostscript')
+    if engine not in COMPRESSION_METHODS:
+        return None, (jsonify({'error': f'Unknown compression method: {engine}'}), 400)
+    # PDF 1.5 output with object streams and a cross-reference stream
+    object_streams = request.form.get('object_streams', '').lower() in ('1', 'true', 'on', 'yes')
+    # Linearized output, so browsers can show page one before the download ends
+    linearize = request.form.get('linearize', '').lower() in ('1', 'true', 'on', 'yes')
+    with metrics.timed_stage(None, 'upload_save'):
+        entries = save_uploads(files)
+    try:
+        # Queue every file at once so they are compressed concurrently
+        return job_manager.submit(entries, gs_quality, engine, object_streams, linearize), None
+    except PoolSaturated as e:
+        for entry in entries:
+            if 'input_path' in entry and os.path.exists(entry['input_path']):
+                os.remove(entry['input_path'])
+        if e.retry:
+            return None, (jsonify({'error': str(e)}), 503, {'Retry-After': '5'})
+        return None, (jsonify({'error': str(e)}), 429)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handle file upload and compression."""
+    """Handle file upload and compression, waiting for the results."""
     try:
-        files = request.files.getlist('file')
-        if not files or all(f.filename == '' for f in files):
-            return jsonify({'error': 'No file selected'}), 400
-        
-        results = []
-        
-        for file in files:
-            if file.filename == '':
-                continue
-            if not allowed_file(file.filename):
-                results.append({
-                    'success': False,
-                    'original_filename': file.filename,
-                    'error': 'File type not allowed.'
-                })
-                continue
-
-            gs_quality = request.form.get('gs_quality', 'ebook')
-            filename = secure_filename(file.filename)
-            name, ext = os.path.splitext(filename)
-            output_filename = f"{name}_compressed{ext}"
-            output_path = os.path.join(app.config['COMPRESSED_FOLDER'], f"{uuid.uuid4().hex}_{output_filename}")
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
-            file.save(input_path)
-            gs_quality_flag = GS_QUALITY_MAP.get(gs_quality, '/ebook')
-            gs_cmd = [
-                'gs',
-                '-sDEVICE=pdfwrite',
-                '-dCompatibilityLevel=1.4',
-                f'-dPDFSETTINGS={gs_quality_flag}',
-                '-dNOPAUSE',
-                '-dQUIET',
-                '-dBATCH',
-                f'-sOutputFile={output_path}',
-                input_path
-            ]
-            try:
-                run(gs_cmd, capture_output=True, check=True)
-                # Get stats
-                original_size = os.path.getsize(input_path)
-                compressed_size = os.path.getsize(output_path)
-                space_saved = original_size - compressed_size
-                compression_ratio = (space_saved / original_size) * 100 if original_size else 0
-                results.append({
-                    'success': True,
-                    'original_filename': filename,
-                    'compressed_filename': output_filename,
-                    'download_path': f'/download/{os.path.basename(output_path)}?download_name={output_filename}',
-                    'stats': {
-                        'original_size': f'{original_size/1024:.1f} KB',
-                        'compressed_size': f'{compressed_size/1024:.1f} KB',
-                        'space_saved': f'{space_saved/1024:.1f} KB',
-                        'compression_ratio': f'{compression_ratio:.1f}%'
-                    }
-                })
-            except CalledProcessError as e:
-                results.append({
-                    'success': False,
-                    'original_filename': filename,
-                    'error': f'Ghostscript compression failed: {e.stderr.decode() if e.stderr else str(e)}'
-                })
-            finally:
-                os.remove(input_path)
-        return jsonify({'results': results})
+        job, error = submit_upload()
+        if error:
+            return error
+        job.wait()
+        return jsonify({'results': job.results()})
+    except HTTPException:
+        # Rejected uploads are reported by the error handlers
+        raise
     except Exception as e:
         logger.error(f"Error processing upload: {str(e)}")
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue uploaded files for compression and return a job id right away."""
+    try:
+        job, error = submit_upload()
+        if error:
+            return error
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('job_status', job_id=job.id),
+            'result_url': url_for('job_result', job_id=job.id),
+            'events_url': url_for('job_events', job_id=job.id),
+        }), 202
+    except HTTPException:
+        # Rejected uploads are reported by the error handlers
+        raise
+    except Exception as e:
+        logger.error(f"Error submitting job: {str(e)}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status and progress of a compression job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.progress())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Return the results of a finished compression job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status != 'finished':
+        return jsonify(job.progress()), 202
+    return jsonify({'results': job.results()})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream the progress of a compression job as Server-Sent Events."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(job_manager.events(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/download/<filename>')
 def download_file(filename):
-    """Download compressed PDF file."""
+    """
+    Download compressed PDF file.
+    
+    Range requests are answered with 206 Partial Content, so PDF viewers can
+    show the first page of a linearized file before the rest arrives. Pass
+    ``inline=1`` to open the file in the browser instead of saving it.
+    """
     try:
-        file_path = os.path.join(app.config['COMPRESSED_FOLDER'], filename)
-        download_name = request.args.get('download_name', filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True, download_name=download_name)
-        else:
+        record = output_store.find(filename)
+        if record is None:
             return jsonify({'error': 'File not found'}), 404
+        download_name = request.args.get('download_name', record['download_name'])
+        inline = request.args.get('inline', '').lower() in ('1', 'true', 'yes')
+        return send_file(record['path'], as_attachment=not inline, download_name=download_name,
+                         conditional=True)
     except Exception as e:
         logger.error(f"Error downloading file: {str(e)}")
         return jsonify({'error': 'Download failed'}), 500
 
 @app.route('/download-zip', methods=['POST'])
 def download_zip():
+    """
+    Download several compressed files as one ZIP archive.
+    
+    Takes a JSON body with ``file_ids``, or ``files`` holding download
+    paths as returned in upload results. The archive is streamed while it
+    is built, with the PDFs stored rather than deflated again.
+    """
     try:
-        data = request.get_json()
-        files = data.get('files', [])
-        mem_zip = io.BytesIO()
-        with zipfile.ZipFile(mem_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for url in files:
-                # Extract filename from url
-                filename = url.split('download_name=')[-1]
-                # Find the actual file in compressed folder
-                for f in os.listdir(app.config['COMPRESSED_FOLDER']):
-                    if f.endswith(filename):
-                        file_path = os.path.join(app.config['COMPRESSED_FOLDER'], f)
-                        zf.write(file_path, arcname=filename)
-                        break
-        mem_zip.seek(0)
-        return send_file(mem_zip, as_attachment=True, download_name='compressed_pdfs.zip', mimetype='application/zip')
+        data = request.get_json(silent=True) or {}
+        file_ids = list(data.get('file_ids', []))
+        for url in data.get('files', []):
+            # /download/<file id>_<name>?download_name=<name>
+            file_ids.append(OutputStore.file_id(url.split('?')[0]))
+        
+        records = output_store.get_many(file_ids)
+        if not records:
+            return jsonify({'error': 'File not found'}), 404
+        
+        members = [(record['path'], record['download_name']) for record in records]
+        return Response(stream_zip(members), mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=compressed_pdfs.zip'})
     except Exception as e:
         logger.error(f"Error creating zip: {str(e)}")
         return jsonify({'error': 'Failed to create zip'}), 500
@@ -185,56 +405,114 @@ def get_file_info():
         
         # Save file temporarily
         filename = secure_filename(file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{uuid.uuid4().hex}_{filename}")
-        file.save(temp_path)
+        temp_path, _ = claim_upload(file, filename, prefix='temp_')
         
         # Get file info
         compressor = PDFCompressor()
-        is_valid, message = compressor.validate_pdf(temp_path)
-        
-        if not is_valid:
-            os.remove(temp_path)
-            return jsonify({'error': message}), 400
-        
-        info = compressor.get_pdf_info(temp_path)
+        with compressor.open(temp_path) as document:
+            is_valid, message = compressor.validate_pdf(document)
+            info = compressor.get_pdf_info(document) if is_valid else None
         
         # Clean up
         os.remove(temp_path)
         
+        if not is_valid:
+            return jsonify({'error': message}), 400
+        
         return jsonify({
             'success': True,
             'info': info
         })
         
+    except HTTPException:
+        # Rejected uploads are reported by the error handlers
+        raise
     except Exception as e:
         logger.error(f"Error getting file info: {str(e)}")
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+@app.route('/estimate', methods=['POST'])
+def estimate_file():
+    """Estimate the compressed size and runtime of an uploaded PDF for every setting."""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file selected'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Only PDF files are allowed'}), 400
+
+        try:
+            pages = max(1, min(int(request.form.get('pages', SAMPLE_PAGES)), MAX_ESTIMATE_PAGES))
+        except ValueError:
+            return jsonify({'error': 'pages must be a number'}), 400
+
+        # Save file temporarily
+        filename = secure_filename(file.filename)
+        temp_path, _ = claim_upload(file, filename, prefix='temp_')
+
+        try:
+            compressor = PDFCompressor()
+            with compressor.open(temp_path) as document:
+                is_valid, message = compressor.validate_pdf(document)
+                # Samples take their turn in the Ghostscript pool like uploads,
+                # from the upload folder queue workers can read
+                estimate = estimate_sizes(
+                    document, pages=pages,
+                    run_ghostscript=lambda i, o, q: gs_pool.submit(i, o, q).result(),
+                    workdir=app.config['UPLOAD_FOLDER']
+                ) if is_valid else None
+        except PoolSaturated as e:
+            if e.retry:
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            return jsonify({'error': str(e)}), 429
+        finally:
+            os.remove(temp_path)
+
+        if not is_valid:
+            return jsonify({'error': message}), 400
+
+        return jsonify({
+            'success': True,
+            'estimate': estimate
+        })
+
+    except HTTPException:
+        # Rejected uploads are reported by the error handlers
+        raise
+    except Exception as e:
+        logger.error(f"Error estimating file: {str(e)}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
 @app.route('/cleanup', methods=['POST'])
 def cleanup_files():
-    """Clean up old compressed files."""
+    """Expire old compressed files now instead of waiting for the reaper."""
     try:
-        import time
-        current_time = time.time()
-        max_age = 3600  # 1 hour
-        
-        cleaned_count = 0
-        for filename in os.listdir(app.config['COMPRESSED_FOLDER']):
-            file_path = os.path.join(app.config['COMPRESSED_FOLDER'], filename)
-            if os.path.isfile(file_path):
-                file_age = current_time - os.path.getmtime(file_path)
-                if file_age > max_age:
-                    os.remove(file_path)
-                    cleaned_count += 1
+        stats = output_store.expire()
+        cleaned_count = stats['expired'] + stats['evicted']
         
         return jsonify({
             'success': True,
-            'message': f'Cleaned up {cleaned_count} old files'
+            'message': f'Cleaned up {cleaned_count} old files',
+            'stats': stats
         })
         
     except Exception as e:
         logger.error(f"Error cleaning up files: {str(e)}")
         return jsonify({'error': 'Cleanup failed'}), 500
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose stage timings, sizes, queue depth and errors to Prometheus."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/storage')
+def storage_usage():
+    """Report the disk space taken by compressed outputs."""
+    return jsonify(output_store.usage())
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8080) 
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+Lightweight instrumentation: counters, gauges, histograms and stage timers.
+
+Metrics live in a process-wide registry and are rendered in the Prometheus
+text exposition format by ``render``. ``StageTimer`` times the stages of
+one operation (parse, page compression, Ghostscript...), keeping a
+per-operation breakdown while feeding the shared stage histogram.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Output size / input size
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.25)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[Tuple[str, str], ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, tuple, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value read from a callback each time metrics are collected."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, function: Callable[[], float]):
+        super().__init__(name, help)
+        self.function = function
+
+    def samples(self):
+        return [(self.name, (), self.function())]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe how long the block takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, values in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, values):
+                    samples.append((f"{self.name}_bucket", key + (('le', _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", key, values[-2]))
+                samples.append((f"{self.name}_count", key, values[-1]))
+        return samples
+
+
+class Registry:
+    """The metrics of a process, by name."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, replacing any earlier one with the same name."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pdfcompressor_stage_seconds', 'Time spent in each compression stage', ('stage',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'pdfcompressor_request_seconds', 'HTTP request latency', ('endpoint', 'status')))
+BYTES_IN = REGISTRY.register(Counter(
+    'pdfcompressor_bytes_in_total', 'Bytes of PDF input compressed', ('engine',)))
+BYTES_OUT = REGISTRY.register(Counter(
+    'pdfcompressor_bytes_out_total', 'Bytes of compressed PDF output', ('engine',)))
+FILES = REGISTRY.register(Counter(
+    'pdfcompressor_files_total', 'Files compressed', ('engine',)))
+RATIO = REGISTRY.register(Histogram(
+    'pdfcompressor_compression_ratio', 'Output size divided by input size', ('engine',),
+    buckets=RATIO_BUCKETS))
+ERRORS = REGISTRY.register(Counter(
+    'pdfcompressor_errors_total', 'Failures, by the stage they happened in', ('stage',)))
+
+
+def gauge(name: str, help: str, function: Callable[[], float]) -> Gauge:
+    """Register a gauge whose value is read from function."""
+    return REGISTRY.register(Gauge(name, help, function))
+
+
+def record_result(engine: str, bytes_in: int, bytes_out: int) -> None:
+    """Count one compressed file and its sizes."""
+    BYTES_IN.inc(bytes_in, engine=engine)
+    BYTES_OUT.inc(bytes_out, engine=engine)
+    FILES.inc(engine=engine)
+    if bytes_in:
+        RATIO.observe(bytes_out / bytes_in, engine=engine)
+
+
+def render() -> str:
+    """Return all metrics in the Prometheus text format."""
+    return REGISTRY.render()
+
+
+class StageTimer:
+    """
+    Times the stages of an operation.
+
+    Each stage's duration is added to ``stages`` (so repeated stages
+    accumulate) and observed in the shared stage histogram; failures are
+    counted against the stage they happened in. A stage that runs inside
+    another is only counted once: its time is taken out of the outer one.
+    """
+
+    def __init__(self, listener: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            listener: Called with the name of every stage as it starts
+        """
+        self.listener = listener
+        self.stages: Dict[str, float] = {}
+        # Time spent in nested stages, for each stage currently running
+        self._nested: List[float] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if self.listener is not None:
+            self.listener(name)
+        started = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        except Exception:
+            ERRORS.inc(stage=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            own = elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.stages[name] = self.stages.get(name, 0.0) + own
+            STAGE_SECONDS.observe(own, stage=name)
+
+    def reset(self) -> None:
+        self.stages = {}
+
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+
+def timed_stage(timer: Optional[StageTimer], name: str):
+    """timer.stage(name), or a stage that only feeds the histogram when timer is None."""
+    return (timer or StageTimer()).stage(name)
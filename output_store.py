@@ -0,0 +1,274 @@
+"""
+Index and retention of the compressed files kept for download.
+
+Every output is stored as ``<file id>_<name>`` in the output folder and
+recorded in a small SQLite index with its size, owner and creation time.
+Downloads look files up by id, and a background reaper expires them by age
+and by a total-bytes quota straight from the index, so neither ever scans
+the folder.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Outputs are kept for this many seconds by default.
+DEFAULT_TTL = 3600
+# Rows deleted per transaction when expiring.
+EXPIRE_BATCH = 500
+
+_FILE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    file_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    download_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    owner TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created);
+"""
+
+
+class OutputStore:
+    """
+    SQLite-indexed store of output files with TTL and quota expiry.
+    """
+
+    def __init__(self, folder: str, index_path: Optional[str] = None,
+                 ttl: Optional[float] = DEFAULT_TTL, max_bytes: Optional[int] = None):
+        """
+        Open (or create) the index of an output folder.
+
+        When the index is created, files already in the folder are imported
+        once; after that the folder is never listed.
+
+        Args:
+            folder: Directory holding the compressed files
+            index_path: SQLite database file (defaults to index.sqlite3 in
+                folder)
+            ttl: Seconds outputs are kept for (None keeps them forever)
+            max_bytes: Total size outputs are trimmed to, oldest first
+                (None for no quota)
+        """
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.index_path = index_path or os.path.join(folder, 'index.sqlite3')
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stop = threading.Event()
+
+        is_new = not os.path.exists(self.index_path)
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False, isolation_level=None)
+        # The rollback journal only exists during a write, unlike WAL's -wal
+        # and -shm files, which would sit next to the outputs for good
+        self._db.execute('PRAGMA journal_mode=DELETE')
+        self._db.executescript(_SCHEMA)
+        if is_new:
+            self._import_folder()
+
+    def _import_folder(self) -> None:
+        """Index the outputs written before the index existed."""
+        rows = []
+        for entry in os.scandir(self.folder):
+            file_id, sep, download_name = entry.name.partition('_')
+            if sep and _FILE_ID_RE.match(file_id) and entry.is_file():
+                stat = entry.stat()
+                rows.append((file_id, entry.path, download_name, stat.st_size, None, stat.st_mtime))
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)', rows)
+        if rows:
+            logger.info(f"Indexed {len(rows)} existing outputs in {self.folder}")
+
+    @staticmethod
+    def file_id(path: str) -> str:
+        """Return the file id of a stored path."""
+        return os.path.basename(path).partition('_')[0]
+
+    def add(self, path: str, download_name: str, owner: Optional[str] = None) -> str:
+        """
+        Register an output file.
+
+        Args:
+            path: Path of the stored file, named ``<file id>_<name>``
+            download_name: Name the file is downloaded as
+            owner: Who the file belongs to (e.g. the client address)
+
+        Returns:
+            The file's id
+        """
+        file_id = self.file_id(path)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)',
+                (file_id, path, download_name, os.path.getsize(path), owner, time.time())
+            )
+        return file_id
+
+    def get(self, file_id: str) -> Optional[dict]:
+        """Return the record of a file id, or None if it is unknown or gone."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT path, download_name, size, owner, created FROM outputs WHERE file_id = ?',
+                (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(row[0]):
+            self.remove(file_id)
+            return None
+        return {
+            'file_id': file_id,
+            'path': row[0],
+            'download_name': row[1],
+            'size': row[2],
+            'owner': row[3],
+            'created': row[4],
+        }
+
+    def get_many(self, file_ids: List[str]) -> List[dict]:
+        """Return the records of the known file ids, in the given order."""
+        return [record for record in map(self.get, file_ids) if record is not None]
+
+    def find(self, name: str) -> Optional[dict]:
+        """
+        Return the record of a stored file by its name in the output folder.
+
+        A file the index does not know, such as an output written while
+        another index was in use, is indexed from the folder on the way.
+
+        Args:
+            name: The stored file's name, ``<file id>_<name>``
+
+        Returns:
+            The file's record, or None if there is no such output
+        """
+        file_id, sep, download_name = name.partition('_')
+        if not sep or not _FILE_ID_RE.match(file_id) or os.path.basename(name) != name:
+            return None
+        record = self.get(file_id)
+        if record is None:
+            path = os.path.join(self.folder, name)
+            if not os.path.isfile(path):
+                return None
+            stat = os.stat(path)
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)',
+                                 (file_id, path, download_name, stat.st_size, None, stat.st_mtime))
+            record = self.get(file_id)
+        if record is None or os.path.basename(record['path']) != name:
+            return None
+        return record
+
+    def remove(self, file_id: str) -> None:
+        """Forget a file id (the file itself is left alone)."""
+        with self._lock:
+            self._db.execute('DELETE FROM outputs WHERE file_id = ?', (file_id,))
+
+    def usage(self) -> dict:
+        """Return the number and total size of stored outputs, and the limits."""
+        with self._lock:
+            files, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outputs').fetchone()
+        return {
+            'files': files,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+        }
+
+    def _delete(self, rows: List[tuple]) -> int:
+        """Delete the files and index rows of (file_id, path, size) rows; return bytes freed."""
+        freed = 0
+        for _, path, size in rows:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove expired output {path}: {str(e)}")
+                continue
+            freed += size
+        with self._lock:
+            self._db.executemany('DELETE FROM outputs WHERE file_id = ?', [(row[0],) for row in rows])
+        return freed
+
+    def expire(self, now: Optional[float] = None) -> dict:
+        """
+        Delete outputs older than the TTL, then the oldest outputs until the
+        total fits the quota.
+
+        Returns:
+            Dictionary with the number of files expired by age and evicted
+            by the quota, and the bytes freed
+        """
+        now = time.time() if now is None else now
+        stats = {'expired': 0, 'evicted': 0, 'bytes_freed': 0}
+
+        if self.ttl is not None:
+            while True:
+                with self._lock:
+                    rows = self._db.execute(
+                        'SELECT file_id, path, size FROM outputs WHERE created < ? '
+                        'ORDER BY created LIMIT ?', (now - self.ttl, EXPIRE_BATCH)
+                    ).fetchall()
+                if not rows:
+                    break
+                stats['bytes_freed'] += self._delete(rows)
+                stats['expired'] += len(rows)
+
+        if self.max_bytes is not None:
+            excess = self.usage()['bytes'] - self.max_bytes
+            while excess > 0:
+                with self._lock:
+                    rows = self._db.execute(
+                        'SELECT file_id, path, size FROM outputs ORDER BY created LIMIT ?',
+                        (EXPIRE_BATCH,)
+                    ).fetchall()
+                if not rows:
+                    break
+                # Only as many of the oldest as it takes to fit the quota
+                selected = []
+                for row in rows:
+                    if excess <= 0:
+                        break
+                    selected.append(row)
+                    excess -= row[2]
+                stats['bytes_freed'] += self._delete(selected)
+                stats['evicted'] += len(selected)
+
+        if stats['expired'] or stats['evicted']:
+            logger.info(f"Expired {stats['expired']} and evicted {stats['evicted']} outputs, "
+                        f"freeing {stats['bytes_freed']} bytes")
+        return stats
+
+    def start_reaper(self, interval: float = 60.0) -> None:
+        """Run expire() every interval seconds on a daemon thread."""
+        if self._reaper is not None:
+            return
+
+        def reap():
+            while not self._stop.wait(interval):
+                try:
+                    self.expire()
+                except Exception as e:
+                    logger.error(f"Error expiring outputs: {str(e)}")
+
+        self._stop.clear()
+        self._reaper = threading.Thread(target=reap, name='output-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self) -> None:
+        """Stop the background reaper, if it is running."""
+        if self._reaper is not None:
+            self._stop.set()
+            self._reaper.join()
+            self._reaper = None
@@ -1,10 +1,78 @@
 import os
 import PyPDF2
+from PyPDF2.generic import ContentStream, NameObject
 from PIL import Image
 import io
 import tempfile
-from typing import Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple, Union
 import logging
+from deduplicator import deduplicate_streams
+from engine_selector import choose_engine, profile_document
+from gs_pool import run_ghostscript as _run_ghostscript
+from image_compressor import image_jobs, recompress_images as _recompress_images
+from linearizer import linearize_pdf
+from metrics import StageTimer, record_result
+from pdf_document import METADATA_KEYS, PDFDocument, open_document
+from pdf_writer import write_object_streams
+from resource_pruner import prune_resources as _prune_resources
+from result_cache import ResultCache, file_sha256, make_key
+from scan_optimizer import optimize_scans as _optimize_scans
+from stream_optimizer import optimize_streams as _optimize_streams
+from streaming_writer import StreamingWriter, iter_pages
+from size_target import (DEFAULT_TOLERANCE, ImageVariants, TargetSizeSearch, apply_setting,
+                         restore_images, snapshot_images)
+
+# Pages handed to a worker process in one go. Small enough to keep every
+# worker busy on uneven documents, large enough to amortise re-opening the
+# input file in each worker.
+PAGES_PER_CHUNK = 32
+
+
+def _split_page_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Split ``page_count`` pages into ordered ``(start, stop)`` ranges."""
+    chunk = max(1, min(PAGES_PER_CHUNK, -(-page_count // max(1, workers))))
+    return [(start, min(start + chunk, page_count))
+            for start in range(0, page_count, chunk)]
+
+
+def _compress_reader_pages(reader: PyPDF2.PdfReader, start: int, stop: int,
+                           compression_level: str) -> List[Optional[dict]]:
+    """
+    Compress the pages ``start:stop`` of an open PDF.
+
+    Returns one entry per page: a dictionary of page keys to replace, or
+    None when the page is left untouched.
+    """
+    return [_compress_page(reader, reader.pages[page_num], compression_level)
+            for page_num in range(start, stop)]
+
+
+def _compress_page(reader: PyPDF2.PdfReader, page: PyPDF2.PageObject,
+                   compression_level: str) -> Optional[dict]:
+    """Return the keys of one page to replace, or None to leave it untouched."""
+    updates = {}
+
+    if compression_level == 'high':
+        content = page.get_contents()
+        if content is not None:
+            if not isinstance(content, ContentStream):
+                content = ContentStream(content, reader)
+            updates['/Contents'] = content.flate_encode()
+
+    return updates or None
+
+
+def _compress_page_range(input_path: str, start: int, stop: int,
+                         compression_level: str) -> List[Optional[dict]]:
+    """
+    Compress the pages ``start:stop`` of a PDF file.
+
+    Runs inside a worker process, so it opens its own reader.
+    """
+    with open(input_path, 'rb') as file:
+        return _compress_reader_pages(PyPDF2.PdfReader(file), start, stop, compression_level)
+
 
 class PDFCompressor:
     """
@@ -12,134 +80,853 @@ class PDFCompressor:
     through various optimization techniques.
     """
     
-    def __init__(self):
+    def __init__(self, cache: Optional[ResultCache] = None,
+                 progress: Optional[Callable[[dict], None]] = None):
+        """
+        Args:
+            cache: Optional result cache; identical inputs compressed with
+                identical settings are then served from it
+            progress: Optional callback, called with a progress event
+                dictionary as compression moves along (see _report)
+        """
         self.logger = logging.getLogger(__name__)
+        self.cache = cache
+        self.progress = progress
+        self._progress_state = {'stage': None, 'pages_done': 0, 'pages_total': None,
+                                'bytes_read': 0, 'bytes_written': 0}
+        # Per-image results of the last image recompression run
+        self.image_report = []
+        # Per-image results of the last scanned page optimization run
+        self.scan_report = []
+        # Statistics of the last stream deduplication pass
+        self.dedup_stats = {}
+        # Statistics of the last unused resource pruning pass
+        self.prune_stats = {}
+        # Statistics of the last lossless stream recompression pass
+        self.optimize_stats = {}
+        # Engine picked by the last compress_auto call, why, and the profile
+        self.engine_choice = {}
+        # Whether the last output was linearized for fast web view
+        self.linearized = False
+        # Outcome of the last compress_to_target search
+        self.target_report = {}
+        # Exception behind the last failed compression, when one was raised
+        self.error = None
+        # Time spent in each stage (parse, page_compress, write...) by this compressor
+        self.timer = StageTimer(listener=lambda stage: self._report(stage=stage))
         
-    def compress_pdf(self, input_path: str, output_path: str, 
+    def compress_pdf(self, input_path: Union[str, PDFDocument], output_path: str, 
                     compression_level: str = 'medium',
                     image_quality: int = 85,
-                    remove_metadata: bool = True) -> Tuple[bool, str]:
+                    remove_metadata: bool = True,
+                    workers: int = 1,
+                    recompress_images: bool = False,
+                    target_dpi: int = 150,
+                    deduplicate: bool = True,
+                    object_streams: bool = False,
+                    prune_resources: bool = False,
+                    linearize: bool = False,
+                    streaming: bool = False,
+                    memory_limit: Optional[int] = None,
+                    optimize_streams: bool = False,
+                    optimize_scans: bool = False) -> Tuple[bool, str]:
         """
         Compress a PDF file using various optimization techniques.
         
         Args:
-            input_path: Path to the input PDF file
+            input_path: Path to the input PDF file, or a PDFDocument that
+                has already been opened (its parsed reader is reused)
             output_path: Path where the compressed PDF will be saved
             compression_level: 'low', 'medium', or 'high'
             image_quality: JPEG quality for image compression (1-100)
             remove_metadata: Whether to remove PDF metadata
+            workers: Number of worker processes for page compression
+                (0 uses one per CPU core). The output is identical for
+                any number of workers.
+            recompress_images: Whether to downsample and re-encode images
+                as JPEG at image_quality
+            target_dpi: Resolution images are downsampled to
+            deduplicate: Whether to merge identical streams (images,
+                fonts, form XObjects) into a single object
+            object_streams: Whether to write a PDF 1.5 file with object
+                streams and a cross-reference stream (see pdf_writer)
+            prune_resources: Whether to drop page resources the content
+                never uses and subset embedded fonts (see resource_pruner)
+            linearize: Whether to linearize the output for fast web view
+                (see linearizer)
+            streaming: Whether to write the output page by page so memory
+                use does not grow with the document (see streaming_writer).
+                Pages are compressed in this process, images are sized by
+                the first page they are drawn on, and pruning and object
+                streams are not available.
+            memory_limit: Resident memory in bytes a streaming run may use;
+                it fails rather than go above it
+            optimize_streams: Whether to recompress every stream losslessly
+                at the highest zlib level, trying PNG predictors on images
+                (see stream_optimizer)
+            optimize_scans: Whether to re-encode images that are effectively
+                gray or black and white as 8-bit gray or CCITT Group 4 (see
+                scan_optimizer); needs NumPy
             
         Returns:
             Tuple of (success: bool, message: str)
         """
+        self.error = None
+        document, owned = open_document(input_path, self.timer)
+        input_path = document.path
+        if streaming and (prune_resources or object_streams):
+            # Both need the whole document at once
+            self.logger.info("Streaming output: skipping resource pruning and object streams")
+            prune_resources = object_streams = False
         try:
             # Validate input file
             if not os.path.exists(input_path):
                 return False, f"Input file not found: {input_path}"
             
             # Get original file size
-            original_size = os.path.getsize(input_path)
+            original_size = document.size
+            self._start_progress(original_size)
             
-            # Read the original PDF
-            with open(input_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                writer = PyPDF2.PdfWriter()
-                
-                # Copy pages with compression
-                for page_num in range(len(reader.pages)):
-                    page = reader.pages[page_num]
-                    
-                    # Apply compression based on level
-                    if compression_level == 'high':
-                        page.compress_content_streams()
-                    
-                    writer.add_page(page)
-                
-                # Remove metadata if requested
-                if remove_metadata:
-                    writer.remove_links()
-                    # Note: PyPDF2 doesn't have direct metadata removal
-                    # but we can minimize it by not copying metadata
-                
-                # Write compressed PDF
-                with open(output_path, 'wb') as output_file:
-                    writer.write(output_file)
+            # Serve identical work from the result cache
+            cache_key = None
+            cached = False
+            if self.cache is not None:
+                with self.timer.stage('cache_lookup'):
+                    cache_key = make_key(
+                        file_sha256(input_path), 'pypdf',
+                        level=compression_level, quality=image_quality,
+                        remove_metadata=remove_metadata, images=recompress_images,
+                        dpi=target_dpi, dedupe=deduplicate, object_streams=object_streams,
+                        prune=prune_resources, linearize=linearize, streaming=streaming,
+                        optimize=optimize_streams, scans=optimize_scans
+                    )
+                    cached = self.cache.get(cache_key, output_path)
+            
+            linearize_message = None
+            if cached:
+                self.image_report = []
+                self.scan_report = []
+                self.dedup_stats = {}
+                self.prune_stats = {}
+                self.optimize_stats = {}
+                self.linearized = linearize
+            else:
+                if streaming:
+                    self._write_streaming(document, output_path, compression_level,
+                                          image_quality, recompress_images, target_dpi,
+                                          deduplicate, memory_limit, optimize_streams,
+                                          optimize_scans)
+                else:
+                    self._write_compressed(document, output_path, compression_level,
+                                           image_quality, remove_metadata, workers,
+                                           recompress_images, target_dpi, deduplicate,
+                                           object_streams, prune_resources, optimize_streams,
+                                           optimize_scans)
+                self.linearized = False
+                if linearize:
+                    linearize_message = self._linearize(output_path)
+                if cache_key is not None and self.linearized == linearize:
+                    with self.timer.stage('cache_store'):
+                        self.cache.put(cache_key, output_path)
             
-            # Get compressed file size
             compressed_size = os.path.getsize(output_path)
+            self._report(stage='done', bytes_written=compressed_size)
+            record_result('cache' if cached else 'pypdf', original_size, compressed_size)
+            success_message = self._size_message(original_size, compressed_size)
             
-            # Calculate compression ratio
-            compression_ratio = ((original_size - compressed_size) / original_size) * 100
+            if cached:
+                success_message += "\nServed from the result cache"
             
-            success_message = (
-                f"Compression completed successfully!\n"
-                f"Original size: {self._format_size(original_size)}\n"
-                f"Compressed size: {self._format_size(compressed_size)}\n"
-                f"Space saved: {self._format_size(original_size - compressed_size)} "
-                f"({compression_ratio:.1f}%)"
-            )
+            if linearize_message:
+                success_message += f"\n{linearize_message}"
+            
+            if prune_resources and self.prune_stats.get('removed'):
+                pruned = sum(saved for category, saved in self.prune_stats['bytes_saved'].items()
+                             if category != 'font_subsetting')
+                success_message += (
+                    f"\nUnused resources removed: {self.prune_stats['removed']} "
+                    f"(saved {self._format_size(pruned)})"
+                )
+            
+            if prune_resources and self.prune_stats.get('fonts_subset'):
+                success_message += (
+                    f"\nFonts subset: {self.prune_stats['fonts_subset']} "
+                    f"(saved {self._format_size(self.prune_stats['bytes_saved']['font_subsetting'])})"
+                )
+            
+            if deduplicate and self.dedup_stats.get('duplicates'):
+                success_message += (
+                    f"\nDuplicate streams removed: {self.dedup_stats['duplicates']} "
+                    f"(saved {self._format_size(self.dedup_stats['bytes_saved'])})"
+                )
+            
+            if optimize_streams and self.optimize_stats.get('optimized'):
+                success_message += (
+                    f"\nStreams recompressed: {self.optimize_stats['optimized']} of "
+                    f"{self.optimize_stats['streams']} "
+                    f"(saved {self._format_size(self.optimize_stats['bytes_saved'])})"
+                )
+            
+            if optimize_scans and not cached:
+                replaced = [r for r in self.scan_report if r['status'] == 'replaced']
+                success_message += (
+                    f"\nScanned images re-encoded: {len(replaced)} of {len(self.scan_report)} "
+                    f"(saved {self._format_size(sum(r['saved'] for r in replaced))})"
+                )
+            
+            if recompress_images and not cached:
+                replaced = [r for r in self.image_report if r['status'] == 'replaced']
+                success_message += (
+                    f"\nImages recompressed: {len(replaced)} of {len(self.image_report)} "
+                    f"(saved {self._format_size(sum(r['saved'] for r in replaced))})"
+                )
+            
+            return True, success_message
+            
+        except Exception as e:
+            self.error = e
+            self.logger.error(f"Error compressing PDF: {str(e)}")
+            return False, f"Error compressing PDF: {str(e)}"
+        finally:
+            if owned:
+                document.close()
+            else:
+                # The passes above edited the reader's objects in place
+                document.release_reader()
+    
+    def compress_ghostscript(self, input_path: str, output_path: str,
+                             gs_quality: str = 'ebook',
+                             run_ghostscript: Optional[Callable[..., None]] = None,
+                             object_streams: bool = False,
+                             linearize: bool = False) -> Tuple[bool, str]:
+        """
+        Compress a PDF file by re-rendering it with Ghostscript.
+        
+        Args:
+            input_path: Path to the input PDF file
+            output_path: Path where the compressed PDF will be saved
+            gs_quality: Ghostscript quality preset (see gs_pool.GS_QUALITY_MAP)
+            run_ghostscript: Called with (input_path, output_path, gs_quality)
+                and the object_streams keyword to run Ghostscript; defaults
+                to a plain subprocess
+            object_streams: Whether Ghostscript writes a PDF 1.5 file with
+                object streams and a cross-reference stream
+            linearize: Whether to linearize the output for fast web view
             
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        self.error = None
+        try:
+            if not os.path.exists(input_path):
+                return False, f"Input file not found: {input_path}"
+            
+            original_size = os.path.getsize(input_path)
+            self._start_progress(original_size)
+            
+            # Shares its cache entries with the web application's Ghostscript jobs
+            cache_key = None
+            cached = False
+            if self.cache is not None:
+                with self.timer.stage('cache_lookup'):
+                    cache_key = make_key(file_sha256(input_path), 'ghostscript',
+                                         gs_quality=gs_quality, object_streams=object_streams,
+                                         linearize=linearize)
+                    cached = self.cache.get(cache_key, output_path)
+            
+            linearize_message = None
+            if cached:
+                self.linearized = linearize
+            else:
+                with self.timer.stage('ghostscript'):
+                    (run_ghostscript or _run_ghostscript)(input_path, output_path, gs_quality,
+                                                          object_streams=object_streams)
+                self.linearized = False
+                if linearize:
+                    linearize_message = self._linearize(output_path)
+                if cache_key is not None and self.linearized == linearize:
+                    with self.timer.stage('cache_store'):
+                        self.cache.put(cache_key, output_path)
+            
+            compressed_size = os.path.getsize(output_path)
+            self._report(stage='done', bytes_written=compressed_size)
+            record_result('cache' if cached else 'ghostscript', original_size, compressed_size)
+            success_message = self._size_message(original_size, compressed_size)
+            if cached:
+                success_message += "\nServed from the result cache"
+            if linearize_message:
+                success_message += f"\n{linearize_message}"
             return True, success_message
             
         except Exception as e:
+            self.error = e
+            self.logger.error(f"Error compressing PDF with Ghostscript: {str(e)}")
+            return False, f"Error compressing PDF with Ghostscript: {str(e)}"
+    
+    def compress_auto(self, input_path: Union[str, PDFDocument], output_path: str,
+                      gs_quality: str = 'ebook',
+                      image_quality: int = 85,
+                      remove_metadata: bool = True,
+                      workers: int = 1,
+                      run_ghostscript: Optional[Callable[..., None]] = None,
+                      object_streams: bool = False,
+                      linearize: bool = False) -> Tuple[bool, str]:
+        """
+        Compress a PDF file with whichever engine suits its content.
+        
+        The file is profiled first (see engine_selector) and then handed to
+        PyPDF2 or Ghostscript. The chosen engine, the reason and the profile
+        are kept in ``engine_choice`` and the choice is added to the message.
+        
+        Args:
+            input_path: Path to the input PDF file, or an open PDFDocument
+            output_path: Path where the compressed PDF will be saved
+            gs_quality: Ghostscript quality preset, if Ghostscript is chosen
+            image_quality: JPEG quality, if PyPDF2 recompresses images
+            remove_metadata: Whether to remove PDF metadata (PyPDF2 only)
+            workers: Number of worker processes for PyPDF2
+            run_ghostscript: See compress_ghostscript
+            object_streams: Whether to write a PDF 1.5 file with object
+                streams and a cross-reference stream, whichever engine runs
+            linearize: Whether to linearize the output for fast web view
+            
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        self.error = None
+        document, owned = open_document(input_path, self.timer)
+        try:
+            if not os.path.exists(document.path):
+                return False, f"Input file not found: {document.path}"
+            self._start_progress(document.size)
+            
+            with self.timer.stage('profile'):
+                profile = profile_document(document)
+                choice = choose_engine(profile)
+            self.engine_choice = dict(choice, profile=profile)
+            self.logger.info(f"Auto engine chose {choice['engine']} for "
+                             f"{os.path.basename(document.path)}: {choice['reason']}")
+            
+            if choice['engine'] == 'ghostscript':
+                # Ghostscript reads the file itself
+                document.release_reader()
+                success, message = self.compress_ghostscript(
+                    document.path, output_path, gs_quality, run_ghostscript, object_streams,
+                    linearize
+                )
+            else:
+                success, message = self.compress_pdf(
+                    document, output_path, choice['level'], image_quality,
+                    remove_metadata, workers, recompress_images=choice['recompress_images'],
+                    object_streams=object_streams, linearize=linearize
+                )
+            
+            if success:
+                message += f"\nEngine: {choice['engine']} ({choice['reason']})"
+            return success, message
+            
+        except Exception as e:
+            self.error = e
             self.logger.error(f"Error compressing PDF: {str(e)}")
             return False, f"Error compressing PDF: {str(e)}"
+        finally:
+            if owned:
+                document.close()
     
-    def compress_images_in_pdf(self, input_path: str, output_path: str, 
-                             quality: int = 85) -> Tuple[bool, str]:
+    def compress_to_target(self, input_path: Union[str, PDFDocument], output_path: str,
+                           target_size: int,
+                           compression_level: str = 'high',
+                           max_quality: int = 85,
+                           remove_metadata: bool = True,
+                           workers: int = 1,
+                           deduplicate: bool = True,
+                           object_streams: bool = False,
+                           prune_resources: bool = False,
+                           linearize: bool = False,
+                           tolerance: float = DEFAULT_TOLERANCE,
+                           optimize_streams: bool = False,
+                           optimize_scans: bool = False) -> Tuple[bool, str]:
+        """
+        Compress a PDF file to at most target_size bytes, keeping images as good as possible.
+
+        The document is parsed and compressed once; then image quality and
+        resolution are searched for the best setting that fits (see
+        size_target). The setting picked and the number of settings tried
+        are kept in ``target_report``. When even the smallest setting does
+        not fit, the smallest output is written and the message says so.
+
+        Args:
+            input_path: Path to the input PDF file, or an open PDFDocument
+            output_path: Path where the compressed PDF will be saved
+            target_size: Size budget in bytes
+            compression_level: 'low', 'medium', or 'high'
+            max_quality: Highest JPEG quality the search considers
+            remove_metadata: Whether to remove PDF metadata
+            workers: Number of worker processes for page compression
+            deduplicate: Whether to merge identical streams
+            object_streams: Whether to write a PDF 1.5 file with object
+                streams and a cross-reference stream
+            prune_resources: Whether to drop unused page resources and
+                subset embedded fonts
+            linearize: Whether to linearize the output for fast web view
+            tolerance: Fraction below target_size that is close enough to
+                stop searching
+            optimize_streams: Whether to recompress every stream losslessly
+            optimize_scans: Whether to re-encode effectively gray or black
+                and white images first; the search then leaves Group 4
+                images alone
+
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        self.error = None
+        document, owned = open_document(input_path, self.timer)
+        input_path = document.path
+        try:
+            if not os.path.exists(input_path):
+                return False, f"Input file not found: {input_path}"
+
+            original_size = document.size
+            self._start_progress(original_size)
+
+            cache_key = None
+            cached = False
+            if self.cache is not None:
+                with self.timer.stage('cache_lookup'):
+                    cache_key = make_key(
+                        file_sha256(input_path), 'pypdf-target',
+                        target=target_size, level=compression_level, quality=max_quality,
+                        remove_metadata=remove_metadata, dedupe=deduplicate,
+                        object_streams=object_streams, prune=prune_resources,
+                        linearize=linearize, tolerance=tolerance, optimize=optimize_streams,
+                        scans=optimize_scans
+                    )
+                    cached = self.cache.get(cache_key, output_path)
+
+            linearize_message = None
+            if cached:
+                self.image_report = []
+                self.scan_report = []
+                self.dedup_stats = {}
+                self.prune_stats = {}
+                self.optimize_stats = {}
+                self.target_report = {}
+                self.linearized = linearize
+            else:
+                writer = self._build_writer(document, compression_level, max_quality,
+                                            remove_metadata, workers, False, 0,
+                                            deduplicate, prune_resources, optimize_streams,
+                                            optimize_scans)
+
+                def save() -> int:
+                    self._save(writer, output_path, object_streams)
+                    self.linearized = False
+                    if linearize:
+                        nonlocal linearize_message
+                        linearize_message = self._linearize(output_path)
+                    return os.path.getsize(output_path)
+
+                self.target_report = self._search_target(writer, save, target_size,
+                                                         max_quality, tolerance)
+                if cache_key is not None and self.linearized == linearize:
+                    with self.timer.stage('cache_store'):
+                        self.cache.put(cache_key, output_path)
+
+            compressed_size = os.path.getsize(output_path)
+            self._report(stage='done', bytes_written=compressed_size)
+            record_result('cache' if cached else 'pypdf', original_size, compressed_size)
+            success_message = self._size_message(original_size, compressed_size)
+
+            if cached:
+                success_message += "\nServed from the result cache"
+
+            report = self.target_report
+            if report:
+                if report['quality'] is None:
+                    setting = "images left as they were"
+                else:
+                    resolution = f"{report['dpi']} DPI" if report['dpi'] else "full resolution"
+                    setting = f"image quality {report['quality']} at {resolution}"
+                if report['reached']:
+                    success_message += (
+                        f"\nTarget {self._format_size(target_size)} reached with {setting} "
+                        f"({report['settings_tried']} settings tried, {report['writes']} written)"
+                    )
+                else:
+                    success_message += (
+                        f"\nTarget {self._format_size(target_size)} not reached; "
+                        f"smallest output uses {setting}"
+                    )
+
+            if linearize_message:
+                success_message += f"\n{linearize_message}"
+
+            return True, success_message
+
+        except Exception as e:
+            self.error = e
+            self.logger.error(f"Error compressing PDF: {str(e)}")
+            return False, f"Error compressing PDF: {str(e)}"
+        finally:
+            if owned:
+                document.close()
+            else:
+                document.release_reader()
+
+    def _search_target(self, writer: PyPDF2.PdfWriter, save: Callable[[], int],
+                       target_size: int, max_quality: int, tolerance: float) -> dict:
+        """
+        Find and write the best image setting for a size budget.
+
+        Args:
+            writer: The compressed document, images untouched
+            save: Writes the writer's document and returns the file size
+            target_size: Size budget in bytes
+            max_quality: Highest JPEG quality considered
+            tolerance: See compress_to_target
+
+        Returns:
+            Dictionary with the dpi and quality picked (both None when the
+            images were left alone), the output size, whether the target
+            was reached, and how many settings were tried and written
+        """
+        self.image_report = []
+        base_size = save()
+        report = {'target': target_size, 'dpi': None, 'quality': None, 'size': base_size,
+                  'reached': base_size <= target_size, 'settings_tried': 0, 'writes': 1}
+        if report['reached']:
+            return report
+
+        with self.timer.stage('target_search'):
+            images, jobs = image_jobs(writer, max_quality)
+            variants = ImageVariants(jobs)
+            search = TargetSizeSearch(variants, base_size, max_quality, tolerance)
+            snapshot = snapshot_images(images)
+        if not variants.jobs:
+            # Nothing left to trade for size
+            return report
+
+        budget = target_size
+        tried = set()
+        while True:
+            with self.timer.stage('target_search'):
+                setting = search.search(budget) or search.smallest()
+                restore_images(images, snapshot)
+                self.image_report = apply_setting(images, variants, setting)
+            size = save()
+            tried.add(setting)
+            report.update({'dpi': setting[0], 'quality': setting[1], 'size': size,
+                           'reached': size <= target_size,
+                           'settings_tried': len(search.estimates), 'writes': report['writes'] + 1})
+            if report['reached'] or setting == search.smallest():
+                break
+            # The estimate was off by what the writer adds around the image
+            # streams; search again with a budget tightened by as much
+            budget -= max(1, size - search.estimate(setting))
+            if search.search(budget) in tried:
+                break
+
+        self.logger.info(f"Target size search for {self._format_size(target_size)}: "
+                         f"quality {report['quality']}, dpi {report['dpi']}, "
+                         f"{self._format_size(report['size'])} after {report['settings_tried']} settings")
+        return report
+
+    def _linearize(self, output_path: str) -> str:
+        """Linearize an output in place and describe the outcome; failures are not fatal."""
+        try:
+            with self.timer.stage('linearize'):
+                tool = linearize_pdf(output_path)
+        except Exception as e:
+            self.linearized = False
+            self.logger.warning(f"Could not linearize {output_path}: {str(e)}")
+            return f"Linearization skipped: {str(e)}"
+        self.linearized = True
+        return f"Linearized for fast web view ({tool})"
+    
+    def _write_compressed(self, document: PDFDocument, output_path: str,
+                          compression_level: str, image_quality: int,
+                          remove_metadata: bool, workers: int,
+                          recompress_images: bool, target_dpi: int,
+                          deduplicate: bool, object_streams: bool = False,
+                          prune_resources: bool = False,
+                          optimize_streams: bool = False,
+                          optimize_scans: bool = False) -> None:
+        """Run the compression passes and write the output file."""
+        writer = self._build_writer(document, compression_level, image_quality,
+                                    remove_metadata, workers, recompress_images,
+                                    target_dpi, deduplicate, prune_resources,
+                                    optimize_streams, optimize_scans)
+        self._save(writer, output_path, object_streams)
+    
+    def _write_streaming(self, document: PDFDocument, output_path: str,
+                         compression_level: str, image_quality: int,
+                         recompress_images: bool, target_dpi: int,
+                         deduplicate: bool, memory_limit: Optional[int],
+                         optimize_streams: bool = False, optimize_scans: bool = False) -> None:
+        """Compress and write the output one page at a time (see streaming_writer)."""
+        reader = document.reader
+        # Pages are walked one at a time; drop the page list validation may
+        # have built, which holds every page dictionary
+        reader.flattened_pages = None
+        # The page count from the page tree, without building the page list
+        count = reader.trailer['/Root']['/Pages'].get('/Count')
+        self._report(pages_total=int(count.get_object()) if count is not None else None)
+        self.image_report = []
+        self.scan_report = []
+        self.dedup_stats = {}
+        self.prune_stats = {}
+        self.optimize_stats = {}
+        try:
+            with open(output_path, 'wb') as output_file, \
+                    StreamingWriter(output_file, reader, deduplicate, memory_limit) as writer:
+                for page_num, page in enumerate(iter_pages(reader)):
+                    with self.timer.stage('page_compress'):
+                        updates = _compress_page(reader, page, compression_level)
+                    # Images already written with an earlier page are left as they are
+                    if optimize_scans:
+                        with self.timer.stage('scan_optimize'):
+                            self.scan_report.extend(_optimize_scans(
+                                reader, image_quality, pages=[(page_num, page)], exclude=writer
+                            ))
+                    if recompress_images:
+                        with self.timer.stage('image_recompress'):
+                            self.image_report.extend(_recompress_images(
+                                reader, image_quality, target_dpi,
+                                pages=[(page_num, page)], exclude=writer
+                            ))
+                    if optimize_streams:
+                        with self.timer.stage('optimize_streams'):
+                            stats = _optimize_streams(reader, pages=[page], exclude=writer)
+                        for key, value in stats.items():
+                            self.optimize_stats[key] = self.optimize_stats.get(key, 0) + value
+                    with self.timer.stage('write'):
+                        writer.add_page(page, updates)
+                    self._report(pages_done=page_num + 1, bytes_written=writer.position)
+        except Exception:
+            # Do not leave a truncated file behind
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        if deduplicate:
+            self.dedup_stats = writer.stats
+    
+    def _build_writer(self, document: PDFDocument, compression_level: str,
+                      image_quality: int, remove_metadata: bool, workers: int,
+                      recompress_images: bool, target_dpi: int,
+                      deduplicate: bool, prune_resources: bool,
+                      optimize_streams: bool = False,
+                      optimize_scans: bool = False) -> PyPDF2.PdfWriter:
+        """Run the compression passes and copy the pages into a new writer."""
+        # Read the original PDF
+        reader = document.reader
+        writer = PyPDF2.PdfWriter()
+        
+        # Compress page ranges (in parallel when workers > 1) before the
+        # other passes edit the reader's objects
+        with self.timer.stage('page_compress'):
+            page_updates = self._compress_pages(
+                document, compression_level, workers
+            )
+        
+        # Drop unused resources before the other passes spend time on them
+        if prune_resources:
+            with self.timer.stage('prune'):
+                self.prune_stats = _prune_resources(reader)
+        
+        # Turn effectively gray or black-and-white scans into gray or
+        # Group 4 images before image recompression sees them as color JPEGs
+        if optimize_scans:
+            with self.timer.stage('scan_optimize'):
+                self.scan_report = _optimize_scans(reader, image_quality, workers)
+        
+        # Recompress images in place before the pages are copied
+        if recompress_images:
+            with self.timer.stage('image_recompress'):
+                self.image_report = _recompress_images(
+                    reader, image_quality, target_dpi, workers
+                )
+        
+        # Merge identical streams so shared resources are written once
+        if deduplicate:
+            with self.timer.stage('dedupe'):
+                self.dedup_stats = deduplicate_streams(reader)
+        
+        with self.timer.stage('write'):
+            self._report(pages_done=0)
+            # Copy pages across in their original order
+            for page_num, (page, updates) in enumerate(zip(reader.pages, page_updates)):
+                if updates:
+                    for key, value in updates.items():
+                        page[NameObject(key)] = value
+                
+                writer.add_page(page)
+                self._report(pages_done=page_num + 1)
+            
+            # Remove metadata if requested
+            if remove_metadata:
+                writer.remove_links()
+                # Note: PyPDF2 doesn't have direct metadata removal
+                # but we can minimize it by not copying metadata
+        
+        # Recompress streams losslessly once the pages, with the content
+        # streams page compression made for them, are in the writer
+        if optimize_streams:
+            with self.timer.stage('optimize_streams'):
+                self.optimize_stats = _optimize_streams(writer, workers)
+        
+        return writer
+    
+    def _save(self, writer: PyPDF2.PdfWriter, output_path: str, object_streams: bool) -> None:
+        """Write a writer's document to the output file."""
+        with self.timer.stage('write'):
+            with open(output_path, 'wb') as output_file:
+                if object_streams:
+                    write_object_streams(writer, output_file)
+                else:
+                    writer.write(output_file)
+        self._report(bytes_written=os.path.getsize(output_path))
+    
+    def _compress_pages(self, document: PDFDocument,
+                        compression_level: str,
+                        workers: int) -> List[Optional[dict]]:
+        """
+        Compress all pages of a PDF file, split into page ranges.
+        
+        Args:
+            document: The input PDF
+            compression_level: 'low', 'medium', or 'high'
+            workers: Number of worker processes (0 uses one per CPU core)
+            
+        Returns:
+            List with the page updates for every page, in page order
+        """
+        # The pages themselves rather than the root /Count, which may be wrong;
+        # the updates are matched to them one for one
+        page_count = len(document.reader.pages)
+        self._report(pages_done=0, pages_total=page_count)
+        if compression_level != 'high':
+            return [None] * page_count
+        
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        ranges = _split_page_ranges(page_count, workers)
+        
+        results = []
+        if workers == 1 or len(ranges) <= 1:
+            # In-process: reuse the document's reader instead of parsing again
+            for start, stop in ranges:
+                results.append(_compress_reader_pages(document.reader, start, stop,
+                                                      compression_level))
+                self._report(pages_done=stop)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+                # Ranges come back in order, so the pages before each one are done
+                for (_, stop), chunk in zip(ranges, pool.map(
+                    _compress_page_range,
+                    [document.path] * len(ranges),
+                    [start for start, _ in ranges],
+                    [stop for _, stop in ranges],
+                    [compression_level] * len(ranges),
+                )):
+                    results.append(chunk)
+                    self._report(pages_done=stop)
+        
+        return [updates for chunk in results for updates in chunk]
+    
+    def compress_images_in_pdf(self, input_path: Union[str, PDFDocument], output_path: str, 
+                             quality: int = 85,
+                             target_dpi: int = 150,
+                             workers: int = 1) -> Tuple[bool, str]:
         """
         Compress images within a PDF file.
         
+        Every image XObject is downsampled to target_dpi based on its placed
+        size and re-encoded as JPEG, keeping the original whenever that is
+        smaller. Per-image savings are available in ``image_report``.
+        
         Args:
             input_path: Path to the input PDF file
             output_path: Path where the compressed PDF will be saved
             quality: JPEG quality for image compression (1-100)
+            target_dpi: Resolution images are downsampled to
+            workers: Number of worker processes (0 uses one per CPU core)
             
         Returns:
             Tuple of (success: bool, message: str)
         """
         try:
-            # This is a simplified version - in a full implementation,
-            # you would extract images from PDF, compress them, and re-insert
-            # For now, we'll use the basic compression method
-            return self.compress_pdf(input_path, output_path, 'high', quality, True)
+            return self.compress_pdf(input_path, output_path, 'high', quality, True,
+                                     workers=workers, recompress_images=True,
+                                     target_dpi=target_dpi)
             
         except Exception as e:
             self.logger.error(f"Error compressing images in PDF: {str(e)}")
             return False, f"Error compressing images in PDF: {str(e)}"
     
-    def get_pdf_info(self, file_path: str) -> dict:
+    def get_pdf_info(self, file_path: Union[str, PDFDocument]) -> dict:
         """
         Get information about a PDF file.
         
         Args:
-            file_path: Path to the PDF file
+            file_path: Path to the PDF file, or an open PDFDocument
             
         Returns:
             Dictionary containing PDF information
         """
+        document, owned = open_document(file_path, self.timer)
         try:
-            with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                
+            with self.timer.stage('info'):
                 info = {
-                    'pages': len(reader.pages),
-                    'size': os.path.getsize(file_path),
-                    'size_formatted': self._format_size(os.path.getsize(file_path)),
-                    'title': reader.metadata.get('/Title', 'Unknown'),
-                    'author': reader.metadata.get('/Author', 'Unknown'),
-                    'subject': reader.metadata.get('/Subject', 'Unknown'),
-                    'creator': reader.metadata.get('/Creator', 'Unknown'),
-                    'producer': reader.metadata.get('/Producer', 'Unknown'),
-                    'creation_date': reader.metadata.get('/CreationDate', 'Unknown'),
-                    'modification_date': reader.metadata.get('/ModDate', 'Unknown')
+                    'pages': document.page_count,
+                    'size': document.size,
+                    'size_formatted': self._format_size(document.size),
                 }
-                
-                return info
+                for name, key in METADATA_KEYS.items():
+                    info[name] = document.metadata.get(key, 'Unknown')
+            
+            return info
                 
         except Exception as e:
             self.logger.error(f"Error getting PDF info: {str(e)}")
             return {}
+        finally:
+            if owned:
+                document.close()
+    
+    def _start_progress(self, bytes_read: int) -> None:
+        """Reset the progress state at the start of a compression run."""
+        self._progress_state = {'stage': None, 'pages_done': 0, 'pages_total': None,
+                                'bytes_read': bytes_read, 'bytes_written': 0}
+    
+    def _report(self, **changes) -> None:
+        """
+        Update the progress state and pass a copy of it to the progress callback.
+        
+        Events carry the current ``stage`` (the StageTimer stage names, and
+        'done' at the end), ``pages_done`` and ``pages_total`` (counted
+        again by each stage that goes page by page; a streaming run counts
+        pages written), ``bytes_read`` (the input size) and
+        ``bytes_written`` (the output written so far). The callback's
+        exceptions are logged and otherwise ignored.
+        """
+        self._progress_state.update(changes)
+        if self.progress is None:
+            return
+        try:
+            self.progress(dict(self._progress_state))
+        except Exception as e:
+            self.logger.warning(f"Progress callback failed: {str(e)}")
+    
+    def _size_message(self, original_size: int, compressed_size: int) -> str:
+        """Describe the outcome of a compression run."""
+        compression_ratio = ((original_size - compressed_size) / original_size) * 100
+        return (
+            f"Compression completed successfully!\n"
+            f"Original size: {self._format_size(original_size)}\n"
+            f"Compressed size: {self._format_size(compressed_size)}\n"
+            f"Space saved: {self._format_size(original_size - compressed_size)} "
+            f"({compression_ratio:.1f}%)"
+        )
     
     def _format_size(self, size_bytes: int) -> str:
         """Convert bytes to human readable format."""
@@ -154,30 +941,30 @@ class PDFCompressor:
         
         return f"{size_bytes:.1f}{size_names[i]}"
     
-    def validate_pdf(self, file_path: str) -> Tuple[bool, str]:
+    def open(self, file_path: str) -> PDFDocument:
+        """
+        Open a PDF once for validation, inspection and compression.
+        
+        The returned document can be passed to validate_pdf, get_pdf_info
+        and compress_pdf in place of the path, so the file is parsed only
+        once. Close it (or use it as a context manager) when done.
+        """
+        return PDFDocument(file_path, self.timer)
+    
+    def validate_pdf(self, file_path: Union[str, PDFDocument]) -> Tuple[bool, str]:
         """
         Validate if a file is a valid PDF.
         
         Args:
-            file_path: Path to the file to validate
+            file_path: Path to the file to validate, or an open PDFDocument
             
         Returns:
             Tuple of (is_valid: bool, message: str)
         """
+        document, owned = open_document(file_path, self.timer)
         try:
-            with open(file_path, 'rb') as file:
-                # Check if file starts with PDF signature
-                header = file.read(4)
-                if header != b'%PDF':
-                    return False, "File is not a valid PDF (missing PDF signature)"
-                
-                # Try to read with PyPDF2
-                file.seek(0)
-                reader = PyPDF2.PdfReader(file)
-                if len(reader.pages) == 0:
-                    return False, "PDF appears to be empty or corrupted"
-                
-                return True, "PDF is valid"
-                
-        except Exception as e:
-            return False, f"Error validating PDF: {str(e)}" 
\ No newline at end of file
+            with self.timer.stage('validate'):
+                return document.validate()
+        finally:
+            if owned:
+                document.close() 
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+A PDF file opened once and shared by validation, inspection and compression.
+
+Parsing the cross-reference table and trailer is the expensive part of
+opening a PDF, so a ``PDFDocument`` does it at most once and only when
+something actually needs it. The page count and metadata are read from
+the parsed trailer on first use and then remembered.
+"""
+
+import os
+from typing import Optional, Tuple
+
+import PyPDF2
+
+from metrics import StageTimer, timed_stage
+
+PDF_SIGNATURE = b'%PDF'
+
+# Metadata fields reported for a document, by the name they are reported under
+METADATA_KEYS = {
+    'title': '/Title',
+    'author': '/Author',
+    'subject': '/Subject',
+    'creator': '/Creator',
+    'producer': '/Producer',
+    'creation_date': '/CreationDate',
+    'modification_date': '/ModDate',
+}
+
+
+class PDFDocument:
+    """
+    Lazily parsed handle on a PDF file.
+
+    Nothing is read until it is needed: ``has_signature`` reads the first
+    bytes, ``reader`` parses the xref and trailer, ``page_count`` and
+    ``metadata`` are looked up in the trailer once. Use it as a context
+    manager, or call close(), to release the file.
+    """
+
+    def __init__(self, path: str, timer: Optional[StageTimer] = None):
+        """
+        Args:
+            path: Path to the PDF file
+            timer: Optional StageTimer the parse is recorded in
+        """
+        self.path = path
+        self.timer = timer
+        self._file = None
+        self._reader = None
+        self._size = None
+        self._page_count = None
+        self._metadata = None
+
+    def __enter__(self) -> 'PDFDocument':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def size(self) -> int:
+        """Size of the file in bytes."""
+        if self._size is None:
+            self._size = os.path.getsize(self.path)
+        return self._size
+
+    @property
+    def has_signature(self) -> bool:
+        """Whether the file starts with the %PDF signature."""
+        with open(self.path, 'rb') as file:
+            return file.read(len(PDF_SIGNATURE)) == PDF_SIGNATURE
+
+    @property
+    def reader(self) -> PyPDF2.PdfReader:
+        """The PdfReader of the file, parsed on first access."""
+        if self._reader is None:
+            with timed_stage(self.timer, 'parse'):
+                self._file = open(self.path, 'rb')
+                self._reader = PyPDF2.PdfReader(self._file)
+        return self._reader
+
+    @property
+    def page_count(self) -> int:
+        """
+        Number of pages, taken from the page tree's /Count.
+
+        Only when the root /Count is missing or not a valid number is the
+        page tree walked to count its pages.
+        """
+        if self._page_count is None:
+            try:
+                count = int(self.reader.trailer['/Root']['/Pages']['/Count'])
+            except (KeyError, TypeError, ValueError):
+                count = -1
+            self._page_count = count if count >= 0 else len(self.reader.pages)
+        return self._page_count
+
+    @property
+    def metadata(self) -> dict:
+        """The document information dictionary (empty if there is none)."""
+        if self._metadata is None:
+            self._metadata = dict(self.reader.metadata or {})
+        return self._metadata
+
+    def validate(self) -> Tuple[bool, str]:
+        """
+        Check that the file is a readable PDF with at least one page.
+
+        Unlike page_count, this walks the page tree and reads the first page,
+        so a broken tree or a wrong /Count is caught here (and the count
+        corrected) rather than midway through compression.
+
+        Returns:
+            Tuple of (is_valid: bool, message: str)
+        """
+        try:
+            if not self.has_signature:
+                return False, "File is not a valid PDF (missing PDF signature)"
+            if not self.reader.is_encrypted:
+                # Pages of an encrypted file can only be read once decrypted,
+                # which Ghostscript does for itself
+                self._page_count = len(self.reader.pages)
+                if self._page_count:
+                    self.reader.pages[0]
+            if self.page_count == 0:
+                return False, "PDF appears to be empty or corrupted"
+            return True, "PDF is valid"
+        except Exception as e:
+            return False, f"Error validating PDF: {str(e)}"
+
+    def release_reader(self) -> None:
+        """
+        Drop the parsed reader, keeping the page count and metadata.
+
+        Compression edits the reader's objects in place, so it is released
+        afterwards; anything that needs it again gets a fresh parse.
+        """
+        self._reader = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        """Release the reader and the open file."""
+        self.release_reader()
+
+
+def open_document(source, timer: Optional[StageTimer] = None) -> Tuple[PDFDocument, bool]:
+    """
+    Return a PDFDocument for a path or an existing document.
+
+    A document opened here records its parse in timer.
+
+    Returns:
+        Tuple of (document, owned); owned is True when the document was
+        opened here and should be closed by the caller
+    """
+    if isinstance(source, PDFDocument):
+        return source, False
+    return PDFDocument(source, timer), True
@@ -0,0 +1,164 @@
+"""
+Compact PDF output with object streams and a cross-reference stream.
+
+PyPDF2 writes every object on its own and ends the file with a classic
+cross-reference table, twenty bytes per object. ``write_object_streams``
+writes the same objects as a PDF 1.5 file instead: objects that are not
+streams (page dictionaries, resources, annotations, the catalog...) are
+packed into Flate-compressed object streams, and the cross-reference table
+becomes a compressed cross-reference stream. Stream objects (content,
+images, fonts) are written exactly as PyPDF2 would write them.
+"""
+
+import io
+import zlib
+from typing import BinaryIO, List, Tuple
+
+import PyPDF2
+from PyPDF2.generic import (ArrayObject, DictionaryObject, NameObject, NumberObject,
+                            PdfObject, StreamObject)
+
+# Objects packed into one object stream. Larger streams compress a little
+# better, but a reader has to inflate a whole stream to reach any object
+# in it.
+OBJECTS_PER_STREAM = 100
+
+# Cross-reference stream entry types
+_FREE, _IN_FILE, _COMPRESSED = 0, 1, 2
+
+
+def _serialize(obj: PdfObject) -> bytes:
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+def _width(value: int) -> int:
+    """Bytes needed to store value in a cross-reference stream field."""
+    return max(1, (value.bit_length() + 7) // 8)
+
+
+def _predict_rows(rows: List[bytes]) -> bytes:
+    """Apply the PNG Up predictor to equal-length rows (Predictor 12)."""
+    encoded = bytearray()
+    previous = bytes(len(rows[0])) if rows else b''
+    for row in rows:
+        encoded.append(2)
+        encoded.extend((a - b) & 0xFF for a, b in zip(row, previous))
+        previous = row
+    return bytes(encoded)
+
+
+def _object_stream(objects: List[Tuple[int, PdfObject]]) -> StreamObject:
+    """Build an object stream holding (object number, object) pairs."""
+    offsets = []
+    body = io.BytesIO()
+    for idnum, obj in objects:
+        offsets.append(f"{idnum} {body.tell()}")
+        body.write(_serialize(obj))
+        body.write(b"\n")
+    header = (' '.join(offsets) + '\n').encode()
+
+    stream = StreamObject()
+    stream._data = zlib.compress(header + body.getvalue(), 9)
+    stream.update({
+        NameObject('/Type'): NameObject('/ObjStm'),
+        NameObject('/N'): NumberObject(len(objects)),
+        NameObject('/First'): NumberObject(len(header)),
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+    })
+    return stream
+
+
+def write_object_streams(writer: PyPDF2.PdfWriter, stream: BinaryIO,
+                         objects_per_stream: int = OBJECTS_PER_STREAM) -> None:
+    """
+    Write a PdfWriter's document with object streams and a cross-reference stream.
+
+    Encrypted documents are written the classic way, as the encryption
+    dictionary may not be stored in an object stream.
+
+    Args:
+        writer: The writer holding the document, pages already added
+        stream: Binary file object the PDF is written to
+        objects_per_stream: Maximum number of objects per object stream
+    """
+    if hasattr(writer, '_encrypt'):
+        writer.write_stream(stream)
+        return
+
+    # The same preparation PdfWriter.write_stream does before writing
+    if not writer._root:
+        writer._root = writer._add_object(writer._root_object)
+    writer._sweep_indirect_references(writer._root)
+
+    objects = writer._objects
+    packed = [(i + 1, obj) for i, obj in enumerate(objects)
+              if obj is not None and not isinstance(obj, StreamObject)]
+    groups = [packed[i:i + objects_per_stream]
+              for i in range(0, len(packed), objects_per_stream)]
+    # Object streams and the cross-reference stream are numbered after
+    # the document's own objects
+    first_stream_number = len(objects) + 1
+    xref_number = first_stream_number + len(groups)
+
+    # Object number -> (entry type, field 2, field 3)
+    entries = {0: (_FREE, 0, 65535)}
+    position = 0
+
+    def write(data: bytes) -> None:
+        nonlocal position
+        stream.write(data)
+        position += len(data)
+
+    def write_object(idnum: int, obj: PdfObject) -> None:
+        entries[idnum] = (_IN_FILE, position, 0)
+        write(f"{idnum} 0 obj\n".encode())
+        write(_serialize(obj))
+        write(b"\nendobj\n")
+
+    version = max(writer.pdf_header[5:].decode(), '1.5')
+    write(f"%PDF-{version}\n".encode())
+    write(b"%\xE2\xE3\xCF\xD3\n")
+
+    for i, obj in enumerate(objects):
+        if isinstance(obj, StreamObject):
+            write_object(i + 1, obj)
+        elif obj is None:
+            entries[i + 1] = (_FREE, 0, 0)
+
+    for number, group in enumerate(groups, first_stream_number):
+        for index, (idnum, _) in enumerate(group):
+            entries[idnum] = (_COMPRESSED, number, index)
+        write_object(number, _object_stream(group))
+
+    # The cross-reference stream lists itself
+    xref_offset = position
+    entries[xref_number] = (_IN_FILE, xref_offset, 0)
+    widths = [1,
+              _width(max(entry[1] for entry in entries.values())),
+              _width(max(entry[2] for entry in entries.values()))]
+    rows = [b''.join(value.to_bytes(width, 'big')
+                     for value, width in zip(entries[idnum], widths))
+            for idnum in range(xref_number + 1)]
+
+    xref = StreamObject()
+    xref._data = zlib.compress(_predict_rows(rows), 9)
+    xref.update({
+        NameObject('/Type'): NameObject('/XRef'),
+        NameObject('/Size'): NumberObject(xref_number + 1),
+        NameObject('/W'): ArrayObject(NumberObject(width) for width in widths),
+        NameObject('/Root'): writer._root,
+        NameObject('/Info'): writer._info,
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+        NameObject('/DecodeParms'): DictionaryObject({
+            NameObject('/Columns'): NumberObject(sum(widths)),
+            NameObject('/Predictor'): NumberObject(12),
+        }),
+    })
+    if hasattr(writer, '_ID'):
+        xref[NameObject('/ID')] = writer._ID
+    write(f"{xref_number} 0 obj\n".encode())
+    write(_serialize(xref))
+    write(b"\nendobj\n")
+    write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
@@ -0,0 +1,253 @@
+"""
+Compression through the shared work queue.
+
+QueuePool stands in for the GhostscriptPool of the web application: it
+takes the same batches, but queues them in a WorkQueue for ``cli.py
+worker`` processes on any host to run, and resolves their futures and
+progress callbacks by polling the queue. compress_task is the handler
+those workers run, for web uploads and for batch files alike.
+
+Input and output paths are queued as absolute paths, so the upload,
+output and batch directories must be mounted at the same place on every
+host running workers.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from subprocess import CalledProcessError, TimeoutExpired
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PyPDF2.errors import PyPdfError
+
+from gs_pool import GhostscriptPool, PoolSaturated
+from work_queue import TaskFailed, WorkQueue
+
+logger = logging.getLogger(__name__)
+
+# Tasks allowed to wait or run in the queue at once, from every submitter
+DEFAULT_QUEUE_LIMIT = 1000
+# Seconds between looks at the queue for progress and results
+POLL_INTERVAL = 0.5
+
+# Engine, object streams and linearization of jobs given without them
+_JOB_DEFAULTS = ('ghostscript', False, False)
+
+
+class QueuePool:
+    """
+    A GhostscriptPool lookalike whose jobs run on queue workers.
+    """
+
+    def __init__(self, queue: WorkQueue, queue_size: int = DEFAULT_QUEUE_LIMIT,
+                 timeout: Optional[float] = None, poll_interval: float = POLL_INTERVAL):
+        """
+        Start following the queue.
+
+        Args:
+            queue: The shared work queue
+            queue_size: Maximum number of tasks waiting or running in the
+                queue, counting those of other submitters
+            timeout: Seconds after which a worker kills a Ghostscript run
+            poll_interval: Seconds between looks at the queue
+        """
+        self.queue = queue
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # Task id -> (future, progress callback, last progress seen)
+        self._waiting: Dict[str, list] = {}
+        self._completed = 0
+        self._failed = 0
+        self._stop = threading.Event()
+        self._poller = threading.Thread(target=self._poll, name='queue-poller', daemon=True)
+        self._poller.start()
+
+    def submit_batch(self, jobs: List[Tuple[str, str, str]],
+                     on_progress: Optional[Callable[[int, dict], None]] = None) -> List[Future]:
+        """
+        Queue a batch of compression jobs, all or nothing.
+
+        Takes the same jobs and returns the same futures as
+        GhostscriptPool.submit_batch. Futures of failed jobs raise
+        CalledProcessError or TimeoutExpired for Ghostscript failures, and
+        RuntimeError for anything else.
+
+        Raises:
+            PoolSaturated: If the batch does not fit in the queue
+        """
+        if self._stop.is_set():
+            raise PoolSaturated('Work queue is shut down')
+        if len(jobs) > self.queue_size:
+            raise PoolSaturated(f'Too many files in one request (maximum {self.queue_size})',
+                                retry=False)
+        stats = self.queue.stats()
+        if stats['queued'] + stats['running'] + len(jobs) > self.queue_size:
+            raise PoolSaturated('Work queue is full, try again shortly')
+
+        payloads = []
+        for job in jobs:
+            input_path, output_path, gs_quality, engine, object_streams, linearize = \
+                tuple(job) + _JOB_DEFAULTS[len(job) - 3:]
+            payloads.append({
+                'kind': 'upload',
+                'input': os.path.abspath(input_path),
+                'output': os.path.abspath(output_path),
+                'gs_quality': gs_quality,
+                'engine': engine,
+                'object_streams': object_streams,
+                'linearize': linearize,
+                'timeout': self.timeout,
+            })
+
+        futures = [Future() for _ in jobs]
+        task_ids = self.queue.enqueue(payloads)
+        with self._lock:
+            for index, (task_id, future) in enumerate(zip(task_ids, futures)):
+                progress = None
+                if on_progress is not None:
+                    progress = (lambda index: lambda update: on_progress(index, update))(index)
+                self._waiting[task_id] = [future, progress, None]
+        return futures
+
+    def submit(self, input_path: str, output_path: str, gs_quality: str = 'ebook',
+               engine: str = 'ghostscript', object_streams: bool = False,
+               linearize: bool = False) -> Future:
+        """Queue a single compression job. See submit_batch."""
+        return self.submit_batch([(input_path, output_path, gs_quality, engine, object_streams,
+                                   linearize)])[0]
+
+    def _poll(self) -> None:
+        """Pass progress and results of the queued tasks on to their futures."""
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                task_ids = list(self._waiting)
+            if not task_ids:
+                continue
+            try:
+                tasks = self.queue.get_many(task_ids)
+            except Exception as e:
+                logger.error(f"Error reading the work queue: {str(e)}")
+                continue
+
+            finished = []
+            missing = set(task_ids) - {task['id'] for task in tasks}
+            for task_id in missing:
+                with self._lock:
+                    future = self._waiting.pop(task_id)[0]
+                future.set_exception(RuntimeError('Task was removed from the work queue'))
+            for task in tasks:
+                with self._lock:
+                    waiting = self._waiting.get(task['id'])
+                if waiting is None:
+                    continue
+                future, progress, seen = waiting
+                if task['status'] in ('done', 'failed'):
+                    finished.append(task['id'])
+                    with self._lock:
+                        del self._waiting[task['id']]
+                    self._resolve(future, task)
+                elif task['status'] == 'running' and progress is not None and \
+                        (seen is None or task['progress'] != seen):
+                    waiting[2] = task['progress'] or {}
+                    progress(dict(waiting[2]))
+            if finished:
+                self.queue.remove(finished)
+
+    def _resolve(self, future: Future, task: dict) -> None:
+        """Settle a future with its task's result or error."""
+        if task['status'] == 'done':
+            with self._lock:
+                self._completed += 1
+            # The time spent in the queue, rather than in the worker's own pool
+            result = dict(task['result'])
+            result['queued'] = round(max(task['started'] - task['created'], 0.0), 4)
+            future.set_result(result)
+            return
+        with self._lock:
+            self._failed += 1
+        if task['error_kind'] == 'ghostscript':
+            future.set_exception(CalledProcessError(1, 'gs', stderr=task['error'].encode()))
+        elif task['error_kind'] == 'timeout':
+            future.set_exception(TimeoutExpired('gs', self.timeout or 0))
+        else:
+            future.set_exception(RuntimeError(task['error'] or 'Task failed'))
+
+    def stats(self) -> dict:
+        """Return the load of the whole queue, in the keys GhostscriptPool.stats uses."""
+        stats = self.queue.stats()
+        with self._lock:
+            return {
+                'size': None,
+                'queue_size': self.queue_size,
+                'pending': stats['queued'] + stats['running'],
+                'busy': stats['running'],
+                'completed': self._completed,
+                'failed': self._failed,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop following the queue; queued tasks stay for the workers."""
+        self._stop.set()
+        if wait:
+            self._poller.join()
+
+
+# Ghostscript pools of this worker process, by timeout
+_pools = {}
+
+
+def _worker_pool(timeout: Optional[float]) -> GhostscriptPool:
+    """One single-slot pool per worker process, so its jobs run like the web app's."""
+    if timeout not in _pools:
+        _pools[timeout] = GhostscriptPool(size=1, queue_size=1, timeout=timeout)
+    return _pools[timeout]
+
+
+def compress_task(payload: dict, progress: Callable[[dict], None]) -> dict:
+    """
+    Run one queued task. Runs inside a worker process.
+
+    Args:
+        payload: An 'upload' task queued by QueuePool, or a 'batch' task
+            holding a task dictionary for batch.compress_file
+        progress: Called with progress updates for the submitter
+
+    Returns:
+        For uploads, the timings and engine of the job as
+        GhostscriptPool returns them; for batch files, their journal record
+
+    Raises:
+        TaskFailed: If the input is missing, invalid or cannot be parsed,
+            or Ghostscript rejects it, for good; if Ghostscript crashes or
+            times out, to be retried. Other errors are retried as they are.
+    """
+    if payload['kind'] == 'batch':
+        from batch import compress_file
+        return compress_file(payload['task'])
+
+    pool = _worker_pool(payload.get('timeout'))
+    future = pool.submit_batch(
+        [(payload['input'], payload['output'], payload['gs_quality'], payload['engine'],
+          payload['object_streams'], payload['linearize'])],
+        on_progress=lambda index, update: progress(update)
+    )[0]
+    try:
+        return future.result()
+    except CalledProcessError as e:
+        # Killed by a signal rather than exiting on a file it could not read
+        raise TaskFailed(e.stderr.decode(errors='replace') if e.stderr else str(e), 'ghostscript',
+                         retry=e.returncode < 0)
+    except TimeoutExpired:
+        raise TaskFailed('Ghostscript compression timed out', 'timeout', retry=True)
+    except FileNotFoundError as e:
+        raise TaskFailed(f'Input file not found: {e.filename}', 'input')
+    except RuntimeError as e:
+        # The auto engine failed: for good when the file was rejected or
+        # could not be parsed, and with a retry when it ran out of disk,
+        # memory or the like
+        if e.__cause__ is None or isinstance(e.__cause__, PyPdfError):
+            raise TaskFailed(str(e), 'input')
+        raise
@@ -0,0 +1,497 @@
+"""
+Removal of unused page resources and subsetting of embedded fonts.
+
+Pages split out of a larger document often keep its whole resource
+dictionary: every font, image and form of the original, most of which the
+page never draws. This pass reads the content streams of the pages (and of
+the form XObjects and annotation appearances they draw), drops resource
+entries that no content refers to, and, when fontTools is installed, cuts
+embedded TrueType fonts down to the glyphs that are actually shown.
+
+Anything the pass cannot read completely (a content stream that fails to
+parse, tiling patterns, Type 3 fonts, AcroForm default resources) is left
+as it is, along with every font reachable from it.
+"""
+
+import hashlib
+import importlib.util
+import io
+import logging
+import re
+import zlib
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from PyPDF2.generic import (ArrayObject, ContentStream, DecodedStreamObject, DictionaryObject,
+                            IndirectObject, NameObject, NumberObject, StreamObject)
+
+# fonttools is optional (fonts are left whole without it) and slow to
+# import, so it is only imported once there is a font to subset
+HAVE_FONTTOOLS = importlib.util.find_spec('fontTools') is not None
+
+logger = logging.getLogger(__name__)
+
+# Resource categories content streams refer to by name
+RESOURCE_CATEGORIES = ('/Font', '/XObject', '/ExtGState', '/ColorSpace',
+                       '/Pattern', '/Shading', '/Properties')
+
+# Keys that point back up the document tree rather than at page resources
+_SKIPPED_KEYS = ('/Parent', '/P')
+
+_TEXT_OPERATORS = (b'Tj', b'TJ', b"'", b'"')
+
+# Name tokens of a content stream. Names inside strings and inline image
+# data match too; keeping a resource too many is harmless.
+_NAME_RE = re.compile(rb'/([^\s/\[\]()<>{}%]*)')
+_NAME_ESCAPE_RE = re.compile(rb'#([0-9A-Fa-f]{2})')
+
+# Single-byte encodings a simple TrueType font's codes may be read with
+_CODE_PAGES = ('cp1252', 'mac_roman', 'latin-1')
+
+
+def _resolve(value):
+    return value.get_object() if isinstance(value, IndirectObject) else value
+
+
+def _string_bytes(value) -> Optional[bytes]:
+    """The bytes of a string operand as they appear in the content stream."""
+    if hasattr(value, 'get_original_bytes'):
+        return value.get_original_bytes()
+    if isinstance(value, bytes):
+        return bytes(value)
+    return None
+
+
+def _content_data(content) -> bytes:
+    """The decoded data of a content stream, or of an array of them."""
+    content = _resolve(content)
+    if isinstance(content, ArrayObject):
+        return b'\n'.join(_resolve(part).get_data() for part in content)
+    return content.get_data()
+
+
+def _content_names(data: bytes) -> Set[str]:
+    """Every name a content stream may refer to a resource by."""
+    names = set()
+    for token in set(_NAME_RE.findall(data)):
+        token = _NAME_ESCAPE_RE.sub(lambda m: bytes([int(m.group(1), 16)]), token)
+        names.add('/' + token.decode('utf-8', 'replace'))
+        names.add('/' + token.decode('latin-1'))
+    return names
+
+
+def _walk(value, visited: Set[int]) -> Iterator[Tuple[int, object]]:
+    """Yield (object number, object) for every indirect object below value."""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, IndirectObject):
+            if value.idnum in visited:
+                continue
+            visited.add(value.idnum)
+            target = value.get_object()
+            yield value.idnum, target
+            value = target
+        if isinstance(value, DictionaryObject):
+            stack.extend(value.raw_get(key) for key in value.keys() if key not in _SKIPPED_KEYS)
+        elif isinstance(value, ArrayObject):
+            stack.extend(value)
+
+
+def _label(category: str, resource) -> str:
+    """Report category of a resource entry."""
+    if category == '/Font':
+        return 'fonts'
+    if category == '/XObject':
+        return 'images' if _resolve(resource).get('/Subtype') == '/Image' else 'forms'
+    return 'other'
+
+
+class _Scanner:
+    """Records which resources and glyphs the content of a document uses."""
+
+    def __init__(self, reader, subset_fonts: bool):
+        self.reader = reader
+        # Whether to record the glyphs shown with embedded TrueType fonts
+        self.subset_fonts = subset_fonts
+        # id of a category dictionary -> [dictionary, category, names used]
+        self.usage: Dict[int, list] = {}
+        # ids of category dictionaries that must be left whole
+        self.opaque: Set[int] = set()
+        # Forms already scanned, with the resources they were scanned against
+        self.scanned: Set[tuple] = set()
+        # id of a font dictionary -> [font, strings shown with it]
+        self.fonts: Dict[int, list] = {}
+        # ids of fonts used somewhere that was not scanned
+        self.unsafe_fonts: Set[int] = set()
+        # id of a font dictionary -> whether it embeds a program that can be subset
+        self._subsettable: Dict[int, bool] = {}
+
+    def _categories(self, resources) -> Iterator[Tuple[str, DictionaryObject]]:
+        for category in RESOURCE_CATEGORIES:
+            entries = _resolve(resources.get(category)) if resources is not None else None
+            if isinstance(entries, DictionaryObject):
+                yield category, entries
+
+    def leave_whole(self, resources) -> None:
+        """Keep every entry of a resource dictionary and every font in it."""
+        resources = _resolve(resources)
+        if not isinstance(resources, DictionaryObject):
+            return
+        for category, entries in self._categories(resources):
+            self.opaque.add(id(entries))
+            if category == '/Font':
+                for name in entries:
+                    self.unsafe_fonts.add(id(_resolve(entries[name])))
+
+    def scan(self, content, resources) -> None:
+        """Scan a page or form content stream drawn with resources."""
+        resources = _resolve(resources)
+        if not isinstance(resources, DictionaryObject):
+            return
+        try:
+            data = _content_data(content) if content is not None else b''
+        except Exception as e:
+            logger.warning(f"Could not read a content stream, keeping its resources: {str(e)}")
+            self.leave_whole(resources)
+            return
+
+        names = _content_names(data)
+        for category, entries in self._categories(resources):
+            self.usage.setdefault(id(entries), [entries, category, set()])[2].update(names)
+        fonts = _resolve(resources.get('/Font'))
+        if self.subset_fonts and isinstance(fonts, DictionaryObject):
+            self._record_glyphs(data, fonts)
+        self._follow(resources, names)
+
+    def _can_subset(self, font) -> bool:
+        key = id(font)
+        if key not in self._subsettable:
+            self._subsettable[key] = _font_program(font)[0] is not None
+        return self._subsettable[key]
+
+    def _record_glyphs(self, data: bytes, fonts: DictionaryObject) -> None:
+        """Record the strings shown with each embedded TrueType font of fonts."""
+        if not any(self._can_subset(_resolve(fonts[name])) for name in fonts):
+            return
+        try:
+            # Only parsed in full when there is a font to subset: PyPDF2's
+            # parser is far slower than scanning for names
+            stream = DecodedStreamObject()
+            stream.set_data(data)
+            operations = ContentStream(stream, self.reader).operations
+        except Exception as e:
+            logger.warning(f"Could not parse a content stream, keeping its fonts whole: {str(e)}")
+            self.unsafe_fonts.update(id(_resolve(fonts[name])) for name in fonts)
+            return
+
+        font = None
+        saved_fonts = []
+        for operands, operator in operations:
+            if operator == b'q':
+                saved_fonts.append(font)
+            elif operator == b'Q':
+                font = saved_fonts.pop() if saved_fonts else None
+            elif operator == b'Tf' and operands:
+                font = operands[0]
+            elif operator in _TEXT_OPERATORS and operands and font in fonts:
+                strings = operands[-1] if isinstance(operands[-1], ArrayObject) else [operands[-1]]
+                entry = _resolve(fonts[font])
+                shown = self.fonts.setdefault(id(entry), [entry, set()])[1]
+                shown.update(value for value in map(_string_bytes, strings) if value is not None)
+
+    def _follow(self, resources, names: Set[str]) -> None:
+        """Scan the forms, soft masks, patterns and Type 3 fonts a content stream uses."""
+        xobjects = _resolve(resources.get('/XObject'))
+        if isinstance(xobjects, DictionaryObject):
+            for name in names & set(xobjects.keys()):
+                self.scan_form(xobjects.raw_get(name), resources)
+
+        states = _resolve(resources.get('/ExtGState'))
+        if isinstance(states, DictionaryObject):
+            for name in names & set(states.keys()):
+                mask = _resolve(_resolve(states[name]).get('/SMask'))
+                if isinstance(mask, DictionaryObject) and '/G' in mask:
+                    self.scan_form(mask.raw_get('/G'), resources)
+
+        # Tiling patterns and Type 3 glyphs are content streams of their own
+        # that this pass does not read
+        for category, kind_key, kind in (('/Pattern', '/PatternType', 1), ('/Font', '/Subtype', '/Type3')):
+            entries = _resolve(resources.get(category))
+            if not isinstance(entries, DictionaryObject):
+                continue
+            for name in names & set(entries.keys()):
+                entry = _resolve(entries[name])
+                if entry.get(kind_key) != kind:
+                    continue
+                if '/Resources' in entry:
+                    self.leave_whole(entry['/Resources'])
+                else:
+                    self.leave_whole(resources)
+
+    def scan_form(self, reference, resources) -> None:
+        """Scan a form XObject, against its own resources or the ones it inherits."""
+        form = _resolve(reference)
+        if not isinstance(form, StreamObject) or form.get('/Subtype', '/Form') != '/Form':
+            return
+        own = form.get('/Resources')
+        key = (id(form), None if own is not None else id(resources))
+        if key in self.scanned:
+            return
+        self.scanned.add(key)
+        self.scan(form, own if own is not None else resources)
+
+    def scan_annotations(self, page) -> None:
+        """Scan the appearance streams of a page's annotations."""
+        for annotation in _resolve(page.get('/Annots')) or []:
+            appearances = _resolve(_resolve(annotation).get('/AP'))
+            if not isinstance(appearances, DictionaryObject):
+                continue
+            for key in ('/N', '/R', '/D'):
+                appearance = appearances.raw_get(key) if key in appearances else None
+                states = _resolve(appearance)
+                if isinstance(states, StreamObject):
+                    self.scan_form(appearance, page.get('/Resources'))
+                elif isinstance(states, DictionaryObject):
+                    for state in states:
+                        self.scan_form(states.raw_get(state), page.get('/Resources'))
+
+
+def _simple_glyphs(font: DictionaryObject, codes: Set[int], tt) -> Optional[Set[int]]:
+    """
+    Glyph ids a simple TrueType font may draw for codes, or None when a
+    code cannot be mapped.
+
+    A code is looked up in every cmap subtable the way PDF readers do
+    (directly, in the 0xF000 symbol range, and through its character in the
+    font's encoding); every match is kept, since keeping a glyph too many
+    is harmless.
+    """
+    from fontTools import agl
+    glyph_ids = tt.getReverseGlyphMap()
+    differences = {}
+    encoding = _resolve(font.get('/Encoding'))
+    if isinstance(encoding, DictionaryObject):
+        code = 0
+        for item in _resolve(encoding.get('/Differences')) or []:
+            if isinstance(item, NameObject):
+                differences[code] = item[1:]
+                code += 1
+            else:
+                code = int(item)
+
+    tables = tt['cmap'].tables if 'cmap' in tt else []
+    glyphs = {0}
+    for code in codes:
+        characters = {bytes([code]).decode(page, 'ignore') for page in _CODE_PAGES}
+        found = set()
+        name = differences.get(code)
+        if name is not None:
+            if name in glyph_ids:
+                found.add(glyph_ids[name])
+            characters.add(agl.toUnicode(name))
+        for table in tables:
+            candidates = [code, 0xF000 + code, 0xF100 + code, 0xF200 + code]
+            if table.isUnicode():
+                candidates += [ord(c) for c in characters if len(c) == 1]
+            for candidate in candidates:
+                if candidate in table.cmap:
+                    found.add(glyph_ids[table.cmap[candidate]])
+        if not found:
+            return None
+        glyphs |= found
+    return glyphs
+
+
+def _cid_glyphs(font: DictionaryObject, strings: Set[bytes], glyph_count: int) -> Optional[Set[int]]:
+    """Glyph ids drawn by a Type 0 font with an Identity CMap, or None."""
+    descendant = _resolve(_resolve(font['/DescendantFonts'])[0])
+    cid_to_gid = _resolve(descendant.get('/CIDToGIDMap', NameObject('/Identity')))
+    gid_map = cid_to_gid.get_data() if isinstance(cid_to_gid, StreamObject) else None
+    glyphs = {0}
+    for data in strings:
+        for i in range(0, len(data) - 1, 2):
+            cid = int.from_bytes(data[i:i + 2], 'big')
+            if gid_map is not None:
+                if 2 * cid + 2 > len(gid_map):
+                    return None
+                cid = int.from_bytes(gid_map[2 * cid:2 * cid + 2], 'big')
+            if cid >= glyph_count:
+                return None
+            glyphs.add(cid)
+    return glyphs
+
+
+def _font_program(font: DictionaryObject) -> Tuple[Optional[IndirectObject], List[DictionaryObject]]:
+    """
+    The embedded TrueType program of a font that can be subset, and the
+    dictionaries naming it.
+
+    Returns:
+        Tuple of (reference to the /FontFile2 stream or None, font and
+        descriptor dictionaries)
+    """
+    subtype = font.get('/Subtype')
+    if subtype == '/TrueType':
+        named = [font]
+    elif subtype == '/Type0' and font.get('/Encoding') in ('/Identity-H', '/Identity-V'):
+        descendant = _resolve(_resolve(font['/DescendantFonts'])[0])
+        if descendant.get('/Subtype') != '/CIDFontType2':
+            return None, []
+        named = [font, descendant]
+    else:
+        return None, []
+    descriptor = _resolve(named[-1].get('/FontDescriptor'))
+    if not isinstance(descriptor, DictionaryObject) or '/FontFile2' not in descriptor:
+        return None, []
+    reference = descriptor.raw_get('/FontFile2')
+    if not isinstance(reference, IndirectObject):
+        return None, []
+    return reference, named + [descriptor]
+
+
+def _subset_tag(glyphs: Set[int]) -> str:
+    """Six capital letters identifying a subset, as the PDF format asks for."""
+    digest = hashlib.sha256(repr(sorted(glyphs)).encode()).digest()
+    return ''.join(chr(ord('A') + byte % 26) for byte in digest[:6])
+
+
+def _tag_names(dictionaries: List[DictionaryObject], tag: str) -> None:
+    for dictionary in dictionaries:
+        for key in ('/BaseFont', '/FontName'):
+            name = dictionary.get(key)
+            if isinstance(name, NameObject) and not (len(name) > 7 and name[7] == '+'):
+                dictionary[NameObject(key)] = NameObject(f"/{tag}+{name[1:]}")
+
+
+def _subset_program(stream: StreamObject, glyphs: Set[int]) -> bytes:
+    """Return the TrueType program of stream cut down to glyphs."""
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+    options = font_subset.Options()
+    # Glyph ids stay where they are, so codes keep drawing the same glyphs
+    options.retain_gids = True
+    options.notdef_outline = True
+    options.symbol_cmap = True
+    options.legacy_cmap = True
+    options.name_IDs = ['*']
+    options.name_languages = ['*']
+    options.layout_features = ['*']
+    tt = TTFont(io.BytesIO(stream.get_data()))
+    subsetter = font_subset.Subsetter(options)
+    subsetter.populate(gids=sorted(glyphs))
+    subsetter.subset(tt)
+    out = io.BytesIO()
+    tt.save(out)
+    return out.getvalue()
+
+
+def _subset_fonts(scanner: _Scanner) -> Tuple[int, int]:
+    """
+    Subset the embedded TrueType fonts the scanned content draws with.
+
+    Returns:
+        Tuple of (number of font programs subset, bytes saved)
+    """
+    from fontTools.ttLib import TTFont
+    # Font program -> [stream, glyphs, naming dictionaries, mappable]
+    programs: Dict[int, list] = {}
+    unsafe_programs = set()
+    for key, (font, strings) in scanner.fonts.items():
+        reference, named = _font_program(font)
+        if reference is None:
+            continue
+        if key in scanner.unsafe_fonts:
+            unsafe_programs.add(reference.idnum)
+            continue
+        program = programs.setdefault(reference.idnum, [reference.get_object(), set(), [], True])
+        program[2].extend(named)
+        try:
+            tt = TTFont(io.BytesIO(program[0].get_data()), lazy=True)
+            if font['/Subtype'] == '/Type0':
+                glyphs = _cid_glyphs(font, strings, len(tt.getGlyphOrder()))
+            else:
+                glyphs = _simple_glyphs(font, {code for data in strings for code in data}, tt)
+        except Exception as e:
+            logger.warning(f"Could not read embedded font {font.get('/BaseFont')}: {str(e)}")
+            glyphs = None
+        if glyphs is None:
+            program[3] = False
+        else:
+            program[1] |= glyphs
+
+    count = saved = 0
+    for idnum, (stream, glyphs, named, mappable) in programs.items():
+        if not mappable or idnum in unsafe_programs:
+            continue
+        try:
+            program = _subset_program(stream, glyphs)
+        except Exception as e:
+            logger.warning(f"Could not subset embedded font: {str(e)}")
+            continue
+        data = zlib.compress(program, 9)
+        if len(data) >= len(stream._data):
+            continue
+        saved += len(stream._data) - len(data)
+        count += 1
+        stream._data = data
+        stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+        stream[NameObject('/Length1')] = NumberObject(len(program))
+        if '/DecodeParms' in stream:
+            del stream['/DecodeParms']
+        _tag_names(named, _subset_tag(glyphs))
+    return count, saved
+
+
+def prune_resources(reader, subset_fonts: bool = True) -> dict:
+    """
+    Remove page resources nothing draws and subset embedded fonts, in place.
+
+    Args:
+        reader: An open PyPDF2.PdfReader
+        subset_fonts: Whether to subset embedded TrueType fonts to the
+            glyphs shown (needs fonttools; skipped without it)
+
+    Returns:
+        Dictionary with the number of resources removed, the number of
+        fonts subset, and bytes_saved: stream bytes no longer written, by
+        category (fonts, images, forms, other, font_subsetting)
+    """
+    scanner = _Scanner(reader, subset_fonts and HAVE_FONTTOOLS)
+    root = reader.trailer['/Root']
+    if '/AcroForm' in root:
+        # Form fields draw with the default resources when they are filled in
+        scanner.leave_whole(_resolve(root['/AcroForm']).get('/DR'))
+    for page in reader.pages:
+        scanner.scan(page.get_contents(), page.get('/Resources'))
+        scanner.scan_annotations(page)
+
+    removed = []
+    for key, (entries, category, names) in scanner.usage.items():
+        if key in scanner.opaque:
+            continue
+        for name in list(entries.keys()):
+            if name not in names:
+                removed.append((_label(category, entries.raw_get(name)), entries.raw_get(name)))
+                del entries[name]
+
+    bytes_saved = {'fonts': 0, 'images': 0, 'forms': 0, 'other': 0, 'font_subsetting': 0}
+    if removed:
+        # Only objects no longer reachable from any page are saved
+        counted = set()
+        for page in reader.pages:
+            for _ in _walk(page, counted):
+                pass
+        for label, value in removed:
+            for _, obj in _walk(value, counted):
+                if isinstance(obj, StreamObject):
+                    bytes_saved[label] += len(obj._data)
+
+    fonts_subset = 0
+    if scanner.fonts:
+        fonts_subset, bytes_saved['font_subsetting'] = _subset_fonts(scanner)
+
+    return {
+        'removed': len(removed),
+        'fonts_subset': fonts_subset,
+        'bytes_saved': bytes_saved,
+    }
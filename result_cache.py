@@ -0,0 +1,168 @@
+"""
+Content-addressed cache of compression results.
+
+Outputs are stored on disk under a key derived from the SHA-256 of the
+input file, the engine and every setting that changes the output. The
+store has a size cap and evicts the least recently used entries once it is
+exceeded. It is safe to share between threads, and between processes
+using the same directory (entries are written atomically).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Files are hashed in chunks of this size.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+
+def file_sha256(path: str) -> str:
+    """Return the hex SHA-256 of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(input_sha256: str, engine: str, **settings) -> str:
+    """
+    Build a cache key for compressing an input with an engine and settings.
+
+    Args:
+        input_sha256: Hex SHA-256 of the input file
+        engine: Name of the engine producing the output
+        **settings: Every setting that affects the output
+
+    Returns:
+        Hex digest identifying the result
+    """
+    description = json.dumps([input_sha256, engine, settings], sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    An on-disk, size-capped LRU store of compressed PDFs.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Open (or create) a cache directory.
+
+        Args:
+            directory: Directory holding the cached files
+            max_bytes: Total size the cache is trimmed to
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> size, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def _load(self) -> None:
+        """Index the existing entries, oldest access first."""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pdf'):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+
+    def get(self, key: str, output_path: str) -> bool:
+        """
+        Copy a cached result to output_path.
+
+        Returns:
+            True on a hit, False on a miss
+        """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output_path)
+            # The access time marks the entry as recently used for other processes
+            os.utime(path)
+            size = os.path.getsize(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)
+            return False
+
+        with self._lock:
+            self.hits += 1
+            if key not in self._entries:
+                # Stored by another process since this one started
+                self._bytes += size
+                self._entries[key] = size
+            self._entries.move_to_end(key)
+        return True
+
+    def put(self, key: str, result_path: str) -> None:
+        """Store a result, evicting least recently used entries if needed."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copyfile(result_path, temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not store cached result {key}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def open_cache(directory: Optional[str], max_bytes: int = DEFAULT_MAX_BYTES) -> Optional[ResultCache]:
+    """Return a ResultCache for directory, or None when caching is disabled."""
+    return ResultCache(directory, max_bytes) if directory else None
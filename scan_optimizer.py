@@ -0,0 +1,274 @@
+"""
+Grayscale and black-and-white re-encoding of scanned pages.
+
+Scanners and the software behind them often store paperwork as full-color
+images even when the page is black text on white. Each image drawn on the
+pages is analysed with NumPy histograms: one of how far its pixels'
+channels spread apart (color), one of their brightness. Images with next
+to no colored pixels are re-encoded as 8-bit gray; images that are also
+almost entirely near-black or near-white are thresholded to 1 bit and
+encoded with CCITT Group 4, the fax compression every PDF reader decodes.
+The re-encoded image replaces the original only when it is smaller.
+"""
+
+import importlib.util
+import io
+import logging
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Container, Iterable, List, Optional, Tuple
+
+from PIL import Image
+from PyPDF2.generic import DictionaryObject, EncodedStreamObject, NameObject, NumberObject
+
+from image_compressor import decode_image, image_jobs, scaled_size
+
+logger = logging.getLogger(__name__)
+
+# NumPy is only imported by the worker analysing an image
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
+
+# Images are analysed reduced to at most this many pixels on their longer side
+ANALYSIS_SIZE = 1024
+
+# Channels of a gray pixel stored as JPEG still differ by up to about this much
+CHROMA_TOLERANCE = 24
+# Largest share of colored pixels an image converted to gray may have, so
+# a colored stamp or signature keeps the page in color
+MAX_COLOR_SHARE = 0.002
+
+# Brightness band that is neither ink nor paper
+MIDTONES = (64, 192)
+# Largest share of midtone pixels an image thresholded to black and white
+# may have. The soft stroke edges of a dense text page scanned at 300dpi
+# come to about 5%; photos and shaded forms have far more.
+MAX_MIDTONE_SHARE = 0.06
+# Below this resolution thresholded text becomes hard to read
+MIN_BITONAL_DPI = 150
+
+# TIFF tag numbers used to pull the Group 4 data out of Pillow's TIFF file
+_ROWS_PER_STRIP = 278
+_STRIP_OFFSETS = 273
+_STRIP_BYTE_COUNTS = 279
+
+
+def _subsample(image: Image.Image):
+    """
+    Every n-th pixel of every n-th row, at most ANALYSIS_SIZE on a side.
+
+    Unlike scaling, which blurs stroke edges into midtones, picking pixels
+    keeps the distribution of the full-resolution values.
+    """
+    import numpy as np
+
+    step = -(-max(image.size) // ANALYSIS_SIZE)
+    return np.asarray(image)[::step, ::step]
+
+
+def color_share(image: Image.Image) -> float:
+    """Share of an RGB image's pixels whose channels differ by more than CHROMA_TOLERANCE."""
+    import numpy as np
+
+    pixels = _subsample(image)
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    spread = np.maximum(np.maximum(red, green), blue) - np.minimum(np.minimum(red, green), blue)
+    histogram = np.bincount(spread.ravel(), minlength=256)
+    return float(histogram[CHROMA_TOLERANCE + 1:].sum() / spread.size)
+
+
+def tone_analysis(gray: Image.Image) -> Tuple[float, int]:
+    """
+    Measure how close a gray image is to black and white.
+
+    Returns:
+        Tuple of the share of its pixels in the MIDTONES band and the
+        threshold brightness (Otsu's) separating ink from paper
+    """
+    import numpy as np
+
+    pixels = _subsample(gray)
+    histogram = np.bincount(pixels.ravel(), minlength=256)
+    return (float(histogram[MIDTONES[0]:MIDTONES[1]].sum() / pixels.size),
+            _otsu_threshold(histogram))
+
+
+def _otsu_threshold(histogram) -> int:
+    """Brightness at or below which pixels are ink, maximising the between-class variance."""
+    import numpy as np
+
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)[:-1].astype(np.float64)
+    mass = np.cumsum(histogram * levels)[:-1].astype(np.float64)
+    total_weight = float(histogram.sum())
+    total_mass = float((histogram * levels).sum())
+    rest = total_weight - weight
+    valid = (weight > 0) & (rest > 0)
+    if not valid.any():
+        return 127
+    between = np.zeros_like(weight)
+    between[valid] = ((total_mass * weight[valid] - mass[valid] * total_weight) ** 2
+                      / (weight[valid] * rest[valid]))
+    # Every level in an empty gap between ink and paper scores the same;
+    # take the middle of the gap rather than its dark edge
+    best = np.flatnonzero(between == between.max())
+    return int((best[0] + best[-1]) // 2)
+
+
+def encode_group4(gray: Image.Image, threshold: int) -> bytes:
+    """
+    Threshold a gray image and encode it with CCITT Group 4.
+
+    Ink is stored as 1 bits, which Pillow's encoder writes as black runs,
+    so the data decodes correctly with the default /BlackIs1 false.
+    """
+    ink = gray.point(lambda v: 255 if v <= threshold else 0).convert('1', dither=Image.NONE)
+    buffer = io.BytesIO()
+    # One strip, so the TIFF holds a single Group 4 stream for the whole image
+    ink.save(buffer, 'TIFF', compression='group4', tiffinfo={_ROWS_PER_STRIP: ink.height})
+    with Image.open(io.BytesIO(buffer.getvalue())) as tiff:
+        offset = tiff.tag_v2[_STRIP_OFFSETS][0]
+        length = tiff.tag_v2[_STRIP_BYTE_COUNTS][0]
+    return buffer.getvalue()[offset:offset + length]
+
+
+def _encode_gray(gray: Image.Image, job: dict) -> Tuple[bytes, str]:
+    """Encode a gray image the way the original was: JPEG stays JPEG, lossless stays lossless."""
+    if job['filter'] == '/DCTDecode':
+        buffer = io.BytesIO()
+        gray.save(buffer, 'JPEG', quality=job['quality'], optimize=True)
+        return buffer.getvalue(), '/DCTDecode'
+    return zlib.compress(gray.tobytes(), 9), '/FlateDecode'
+
+
+def reencode_scan(job: dict) -> dict:
+    """
+    Analyse one image and re-encode it as gray or black and white.
+
+    Runs inside a worker process.
+
+    Args:
+        job: Job description built by image_compressor.image_jobs
+
+    Returns:
+        Result dictionary with the original and new sizes, the
+        ``color_share``, ``midtone_share`` and ``threshold`` measured and,
+        when the image is replaced, ``kind`` ('gray' or 'bitonal'),
+        ``filter`` and the new stream ``data``
+    """
+    result = {
+        'object': job['object'],
+        'pages': job['pages'],
+        'original_size': job['original_size'],
+        'compressed_size': job['original_size'],
+        'saved': 0,
+        'data': None,
+    }
+    if 'skip' in job:
+        result.update({'status': 'skipped', 'reason': job['skip']})
+        return result
+
+    try:
+        # JPEG images are decoded at a reduced size for the color check, so
+        # color pages are turned down without a full decode
+        full_size = (job['width'], job['height'])
+        preview = decode_image(job, scaled_size(job, min(1.0, ANALYSIS_SIZE / max(full_size))))
+        result['color_share'] = color_share(preview) if preview.mode == 'RGB' else 0.0
+        if result['color_share'] > MAX_COLOR_SHARE:
+            result.update({'status': 'kept', 'reason': 'color content'})
+            return result
+
+        image = decode_image(job) if preview.size != full_size else preview
+        gray = image.convert('L') if image.mode != 'L' else image
+        result['midtone_share'], result['threshold'] = tone_analysis(gray)
+        candidates = []
+        if result['midtone_share'] <= MAX_MIDTONE_SHARE and \
+                (job.get('dpi') is None or job['dpi'] >= MIN_BITONAL_DPI):
+            candidates.append(('bitonal', encode_group4(gray, result['threshold']),
+                               '/CCITTFaxDecode'))
+        if image.mode != 'L':
+            candidates.append(('gray',) + _encode_gray(gray, job))
+    except Exception as e:
+        result.update({'status': 'failed', 'reason': str(e)})
+        return result
+
+    if not candidates:
+        result.update({'status': 'kept', 'reason': 'already gray, not black and white'})
+        return result
+    kind, data, filter_name = min(candidates, key=lambda candidate: len(candidate[1]))
+    if len(data) >= job['original_size']:
+        result.update({'status': 'kept', 'reason': f'{kind} image is not smaller'})
+        return result
+
+    result.update({
+        'status': 'replaced',
+        'kind': kind,
+        'filter': filter_name,
+        'compressed_size': len(data),
+        'saved': job['original_size'] - len(data),
+        'data': data,
+        'width': job['width'],
+        'height': job['height'],
+    })
+    return result
+
+
+def replace_scan(image, result: dict) -> None:
+    """Swap an image XObject's data for its gray or black-and-white encoding."""
+    # PyPDF2 has no public setter for encoded stream data
+    image._data = result['data']
+    if not isinstance(image, EncodedStreamObject):
+        # Stored unfiltered, so PyPDF2 would take the new data as decoded
+        image.__class__ = EncodedStreamObject
+    image.decoded_self = None
+    image[NameObject('/Filter')] = NameObject(result['filter'])
+    image[NameObject('/ColorSpace')] = NameObject('/DeviceGray')
+    if result['kind'] == 'bitonal':
+        image[NameObject('/BitsPerComponent')] = NumberObject(1)
+        image[NameObject('/DecodeParms')] = DictionaryObject({
+            NameObject('/K'): NumberObject(-1),
+            NameObject('/Columns'): NumberObject(result['width']),
+            NameObject('/Rows'): NumberObject(result['height']),
+        })
+    else:
+        image[NameObject('/BitsPerComponent')] = NumberObject(8)
+        if '/DecodeParms' in image:
+            del image['/DecodeParms']
+
+
+def optimize_scans(reader, quality: int = 85, workers: int = 1,
+                   pages: Optional[Iterable[Tuple[int, Any]]] = None,
+                   exclude: Container[int] = ()) -> List[dict]:
+    """
+    Re-encode scanned images that are effectively gray or black and white, in place.
+
+    Args:
+        reader: An open PyPDF2.PdfReader, or a PdfWriter holding pages
+        quality: JPEG quality for images that were JPEG and become gray
+        workers: Number of worker processes analysing and encoding images
+            (0 uses one per CPU core)
+        pages: Only look at the images on these (page index, page) pairs
+        exclude: Object numbers of images to leave alone
+
+    Returns:
+        List with one result dictionary per image (see reencode_scan),
+        without the image data; empty when NumPy is not installed
+    """
+    if not HAVE_NUMPY:
+        logger.warning("Scanned page optimization needs NumPy (pip install numpy); skipping it")
+        return []
+    images, jobs = image_jobs(reader, quality, pages=pages, exclude=exclude)
+
+    if workers == 1 or len(jobs) <= 1:
+        results = [reencode_scan(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            results = list(pool.map(reencode_scan, jobs, chunksize=4))
+
+    for result in results:
+        if result['status'] == 'replaced':
+            replace_scan(images[result['object']], result)
+        elif result['status'] == 'failed':
+            logger.warning(f"Could not analyse image {result['object']}: {result['reason']}")
+        result.pop('data')
+
+    return results
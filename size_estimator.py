@@ -0,0 +1,271 @@
+"""
+Output size and runtime estimates from a sample of pages.
+
+Compressing a long document once per setting just to compare them costs
+far more than the comparison is worth. Instead a few pages are picked so
+they cover the document's range of page weights (content streams and the
+images and forms they draw), each is copied into a one-page PDF, and every
+setting compresses those small files only. A blank page compressed the
+same way measures what every file costs regardless of its pages. The
+document's output size is then that cost plus the sample's output-to-input
+ratio times the rest of its size - a ratio estimate, whose spread between
+the sampled pages gives the confidence range - and its runtime is
+extrapolated the same way.
+
+The estimates assume pages compress independently: savings from merging
+streams repeated across pages, and resources shared by many pages (each
+sample carries its own copy), are not seen by a sample of single pages.
+"""
+
+import logging
+import math
+import os
+import tempfile
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import PyPDF2
+from PyPDF2.generic import IndirectObject, StreamObject
+
+from engine_selector import ghostscript_available
+from gs_pool import GS_QUALITY_MAP, PoolSaturated, run_ghostscript as _run_ghostscript
+from pdf_compressor import PDFCompressor
+from pdf_document import PDFDocument
+
+logger = logging.getLogger(__name__)
+
+# Pages compressed per setting; the document is sampled whole below this
+SAMPLE_PAGES = 8
+
+# PyPDF2 levels estimated by default
+LEVELS = ('low', 'medium', 'high')
+
+# Two-sided 95% Student t quantiles by degrees of freedom, for the small
+# samples taken here; larger samples use the normal quantile
+_T_95 = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36, 8: 2.31,
+         9: 2.26, 10: 2.23, 15: 2.13, 20: 2.09, 30: 2.04}
+_Z_95 = 1.96
+
+
+def _stream_size(value) -> int:
+    value = value.get_object() if isinstance(value, IndirectObject) else value
+    return len(value._data) if isinstance(value, StreamObject) else 0
+
+
+def page_weight(page) -> int:
+    """Stored bytes of a page's content streams and the XObjects its resources name."""
+    contents = page.get('/Contents')
+    contents = contents.get_object() if isinstance(contents, IndirectObject) else contents
+    weight = sum(_stream_size(c) for c in contents) if isinstance(contents, list) \
+        else _stream_size(contents)
+    resources = page.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources is not None else None
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        weight += sum(_stream_size(xobjects.raw_get(name)) for name in xobjects)
+    return weight
+
+
+def sample_pages(reader: PyPDF2.PdfReader, count: int = SAMPLE_PAGES) -> List[int]:
+    """
+    Pick pages that represent a document.
+
+    Pages are ordered by weight and split into ``count`` groups of equal
+    page count; the middle page of each group is taken, so light text
+    pages and heavy image pages are sampled in proportion to how many of
+    each the document has. The same document always gives the same sample.
+
+    Returns:
+        Indexes of the sampled pages, in page order
+    """
+    page_count = len(reader.pages)
+    if page_count <= count:
+        return list(range(page_count))
+    by_weight = sorted(range(page_count), key=lambda i: page_weight(reader.pages[i]))
+    return sorted(by_weight[int((group + 0.5) * page_count / count)] for group in range(count))
+
+
+def _t_quantile(degrees: int) -> float:
+    """Two-sided 95% t quantile, rounded towards the wider range between table entries."""
+    for known in sorted(_T_95):
+        if degrees <= known:
+            return _T_95[known]
+    return _Z_95
+
+
+def ratio_estimate(inputs: List[float], outputs: List[float], total: float,
+                   population: int) -> Tuple[float, float, float]:
+    """
+    Estimate a document total from per-page samples by their ratio.
+
+    Args:
+        inputs: Sampled pages' input sizes
+        outputs: The matching outputs (sizes or seconds)
+        total: The document's input size
+        population: The document's page count
+
+    Returns:
+        Tuple of the estimate and the low and high ends of its 95% range
+    """
+    n = len(inputs)
+    ratio = sum(outputs) / sum(inputs) if sum(inputs) else 1.0
+    estimate = ratio * total
+    if n < 2 or n >= population:
+        # Every page was compressed, or there is no spread to go by
+        return estimate, estimate, estimate
+    residual = sum((y - ratio * x) ** 2 for x, y in zip(inputs, outputs)) / (n - 1)
+    mean_input = sum(inputs) / n
+    # Standard error of the ratio, with the finite population correction
+    error = math.sqrt((1 - n / population) * residual / n) / mean_input
+    half_width = _t_quantile(n - 1) * error * total
+    return estimate, max(0.0, estimate - half_width), estimate + half_width
+
+
+def _extrapolate(inputs: List[float], outputs: List[float], base_input: float,
+                 base_output: float, total: float, population: int) -> Tuple[float, float, float]:
+    """
+    Ratio estimate after taking out what every one-page file pays once.
+
+    The header, catalog and cross-reference table of a file, a
+    Ghostscript process starting up, or a compressor opening the file cost
+    the same however many pages follow. They are measured on a blank page
+    (base_input in, base_output out) and taken off every sample first, so
+    only what grows with the pages is scaled up.
+    """
+    estimate, low, high = ratio_estimate([max(x - base_input, 1.0) for x in inputs],
+                                         [max(y - base_output, 0.0) for y in outputs],
+                                         max(total - base_input, 0.0), population)
+    return estimate + base_output, low + base_output, high + base_output
+
+
+def estimate_sizes(document: PDFDocument,
+                   levels: Iterable[str] = LEVELS,
+                   gs_qualities: Optional[Iterable[str]] = None,
+                   pages: int = SAMPLE_PAGES,
+                   image_quality: int = 85,
+                   run_ghostscript: Optional[Callable[[str, str, str], None]] = None,
+                   workdir: Optional[str] = None) -> dict:
+    """
+    Estimate the output size and runtime of a document under each setting.
+
+    Args:
+        document: The input PDF
+        levels: PyPDF2 compression levels to estimate, compressed as the
+            compress command does by default
+        gs_qualities: Ghostscript presets to estimate (defaults to all of
+            GS_QUALITY_MAP when Ghostscript is installed, none otherwise)
+        pages: Number of pages to sample
+        image_quality: JPEG quality passed to the PyPDF2 levels
+        run_ghostscript: Called with (input_path, output_path, gs_quality)
+            to run Ghostscript; defaults to a plain subprocess. Its time,
+            including any wait for a pool worker, counts as runtime.
+        workdir: Directory the sample files are written in, which whatever
+            runs run_ghostscript must be able to read (defaults to the
+            system's temporary directory)
+
+    Returns:
+        Dictionary with the document's ``pages`` and ``size``, the
+        ``sampled_pages`` (1-based), the ``sample_size`` in bytes of their
+        one-page files, ``seconds`` spent estimating, and ``estimates``:
+        one dictionary per setting with its ``engine`` and ``setting``,
+        and either the estimated ``size``, ``size_low`` and ``size_high``
+        in bytes, the ``ratio`` to the input size and ``seconds``,
+        ``seconds_low`` and ``seconds_high``, or an ``error``
+
+    Raises:
+        PoolSaturated: If run_ghostscript submits to a pool that is full
+    """
+    started = time.perf_counter()
+    reader = document.reader
+    if gs_qualities is None:
+        gs_qualities = list(GS_QUALITY_MAP) if ghostscript_available() else []
+    settings = [('pypdf', level) for level in levels]
+    settings += [('ghostscript', quality) for quality in gs_qualities]
+    sampled = sample_pages(reader, pages)
+    page_count = len(reader.pages)
+
+    with tempfile.TemporaryDirectory(prefix='pdf-estimate-', dir=workdir) as workdir:
+        samples = []
+        for page_num in sampled:
+            writer = PyPDF2.PdfWriter()
+            writer.add_page(reader.pages[page_num])
+            samples.append(_write(writer, os.path.join(workdir, f'page_{page_num + 1}.pdf')))
+        inputs = [os.path.getsize(path) for path in samples]
+        # What a one-page file costs with nothing on the page
+        box = reader.pages[sampled[0]].mediabox if sampled else None
+        writer = PyPDF2.PdfWriter()
+        writer.add_blank_page(box.width if box else 612, box.height if box else 792)
+        blank = _write(writer, os.path.join(workdir, 'blank.pdf'))
+        blank_input = os.path.getsize(blank)
+
+        estimates = []
+        for engine, setting in settings:
+            estimate = {'engine': engine, 'setting': setting}
+            try:
+                # The blank page goes last, once the compressor is warmed up
+                outputs, seconds = _compress_samples(samples + [blank], engine, setting,
+                                                     image_quality, run_ghostscript)
+            except PoolSaturated:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not estimate {engine} {setting}: {str(e)}")
+                estimate['error'] = str(e)
+                estimates.append(estimate)
+                continue
+            blank_output, blank_seconds = outputs.pop(), seconds.pop()
+            size, size_low, size_high = _extrapolate(inputs, outputs, blank_input, blank_output,
+                                                     document.size, page_count)
+            runtime, runtime_low, runtime_high = _extrapolate(inputs, seconds, blank_input,
+                                                              blank_seconds, document.size,
+                                                              page_count)
+            estimate.update({
+                'size': round(size), 'size_low': round(size_low), 'size_high': round(size_high),
+                'ratio': round(size / document.size, 4) if document.size else None,
+                'seconds': round(runtime, 3), 'seconds_low': round(runtime_low, 3),
+                'seconds_high': round(runtime_high, 3),
+            })
+            estimates.append(estimate)
+
+    return {
+        'pages': page_count,
+        'size': document.size,
+        'sampled_pages': [page_num + 1 for page_num in sampled],
+        'sample_size': sum(inputs),
+        'seconds': round(time.perf_counter() - started, 3),
+        'estimates': estimates,
+    }
+
+
+def _write(writer: PyPDF2.PdfWriter, path: str) -> str:
+    with open(path, 'wb') as file:
+        writer.write(file)
+    return path
+
+
+def _compress_samples(samples: List[str], engine: str, setting: str, image_quality: int,
+                      run_ghostscript: Optional[Callable[[str, str, str], None]]
+                      ) -> Tuple[List[int], List[float]]:
+    """
+    Compress sample files with one setting.
+
+    Returns:
+        Tuple of the output sizes and the seconds each took
+
+    Raises:
+        RuntimeError: If PyPDF2 compression of a sample fails
+    """
+    outputs, seconds = [], []
+    for path in samples:
+        output_path = f'{path[:-4]}_{engine}_{setting}.pdf'
+        started = time.perf_counter()
+        if engine == 'ghostscript':
+            (run_ghostscript or _run_ghostscript)(path, output_path, setting)
+        else:
+            success, message = PDFCompressor().compress_pdf(path, output_path, setting,
+                                                            image_quality)
+            if not success:
+                raise RuntimeError(message)
+        seconds.append(time.perf_counter() - started)
+        outputs.append(os.path.getsize(output_path))
+        os.remove(output_path)
+    return outputs, seconds
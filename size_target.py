@@ -0,0 +1,200 @@
+"""
+Target-size compression: the best image settings that fit a size budget.
+
+Images are the only part of a document whose size can be traded for
+quality, so the rest of the document is compressed and written once and
+only the image streams change between attempts. Every image is decoded
+once; each (resolution, quality) setting tried is encoded once per image
+and its estimated file size remembered, so the search never parses the
+document again and only writes it to verify the setting it settles on.
+
+Resolutions are tried from the highest down. At each one the search looks
+for the highest JPEG quality that fits, by bisection, and stops as soon as
+a setting lands within the tolerance below the target.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from image_compressor import (decode_image, downsample_scale, encode_jpeg, replace_image,
+                              scaled_size)
+
+logger = logging.getLogger(__name__)
+
+# Resolutions tried, after the images' own resolution, best first
+DPI_STEPS = (300, 200, 150, 120, 96, 72, 50)
+
+# Lowest JPEG quality the search goes down to
+MIN_QUALITY = 30
+
+# A setting whose output is at most this fraction below the target is
+# close enough; the search stops there
+DEFAULT_TOLERANCE = 0.05
+
+# Setting = (dpi or None for the images' own resolution, JPEG quality)
+Setting = Tuple[Optional[int], int]
+
+
+class ImageVariants:
+    """
+    Decoded images and their JPEG encodings, shared by every setting tried.
+    """
+
+    def __init__(self, jobs: List[dict]):
+        """
+        Args:
+            jobs: Image jobs from image_compressor.image_jobs; skipped
+                images are left out of the search
+        """
+        self.jobs = [job for job in jobs if 'skip' not in job]
+        self._decoded = {}
+        # (object, pixel size, quality) -> JPEG data, or None when the
+        # encoding is not smaller than the original
+        self._encoded = {}
+
+    def encode(self, job: dict, dpi: Optional[int], quality: int) -> Tuple[Optional[bytes], Tuple[int, int]]:
+        """
+        Encode one image at a setting.
+
+        Returns:
+            Tuple of the JPEG data (None when the original should be kept)
+            and the pixel size it was encoded at
+        """
+        scale = downsample_scale(job.get('dpi'), dpi) if dpi else 1.0
+        size = scaled_size(job, scale)
+        key = (job['object'], size, quality)
+        if key not in self._encoded:
+            data = None
+            try:
+                if job['object'] not in self._decoded:
+                    self._decoded[job['object']] = decode_image(job)
+                image = self._decoded[job['object']]
+                if image is not None:
+                    data = encode_jpeg(image, size, quality)
+            except Exception as e:
+                logger.warning(f"Could not recompress image {job['object']}: {str(e)}")
+                self._decoded[job['object']] = None
+            if data is not None and len(data) >= job['original_size']:
+                data = None
+            self._encoded[key] = data
+        return self._encoded[key], size
+
+    def dpi_steps(self) -> List[Optional[int]]:
+        """Resolutions worth trying: the images' own, then each step that downsamples something."""
+        return [None] + [dpi for dpi in DPI_STEPS
+                         if any(downsample_scale(job.get('dpi'), dpi) < 1.0 for job in self.jobs)]
+
+
+class TargetSizeSearch:
+    """
+    Search for the highest image quality whose output fits a size budget.
+    """
+
+    def __init__(self, variants: ImageVariants, base_size: int,
+                 max_quality: int = 85, tolerance: float = DEFAULT_TOLERANCE):
+        """
+        Args:
+            variants: The document's images
+            base_size: Size of the output with every image left as it is
+            max_quality: Highest JPEG quality considered
+            tolerance: Fraction below the budget that ends the search early
+        """
+        self.variants = variants
+        self.base_size = base_size
+        self.max_quality = max(max_quality, MIN_QUALITY)
+        self.tolerance = tolerance
+        # Estimated output size of every setting tried so far
+        self.estimates: Dict[Setting, int] = {}
+
+    def estimate(self, setting: Setting) -> int:
+        """Estimated output size with every image encoded at a setting."""
+        if setting not in self.estimates:
+            dpi, quality = setting
+            size = self.base_size
+            for job in self.variants.jobs:
+                data, _ = self.variants.encode(job, dpi, quality)
+                if data is not None:
+                    size += len(data) - job['original_size']
+            self.estimates[setting] = size
+        return self.estimates[setting]
+
+    def smallest(self) -> Setting:
+        """The setting with the smallest output the search can reach."""
+        return self.variants.dpi_steps()[-1], MIN_QUALITY
+
+    def search(self, budget: int) -> Optional[Setting]:
+        """
+        Find the best setting whose estimated output fits budget bytes.
+
+        Returns:
+            The setting, or None when not even the smallest one fits
+        """
+        for dpi in self.variants.dpi_steps():
+            if self.estimate((dpi, self.max_quality)) <= budget:
+                return dpi, self.max_quality
+            if self.estimate((dpi, MIN_QUALITY)) > budget:
+                continue
+            # MIN_QUALITY fits and max_quality does not
+            low, high = MIN_QUALITY, self.max_quality
+            while high - low > 1:
+                middle = (low + high) // 2
+                size = self.estimate((dpi, middle))
+                if size <= budget:
+                    low = middle
+                    if size >= budget * (1 - self.tolerance):
+                        break
+                else:
+                    high = middle
+            return dpi, low
+        return None
+
+
+def apply_setting(images: Dict[int, object], variants: ImageVariants,
+                  setting: Setting) -> List[dict]:
+    """
+    Swap the images of a document for their encodings at a setting.
+
+    The image XObjects are expected to be in their original state (see
+    snapshot_images and restore_images).
+
+    Returns:
+        List with one result dictionary per image, as recompress_images
+        reports them
+    """
+    dpi, quality = setting
+    results = []
+    for job in variants.jobs:
+        data, size = variants.encode(job, dpi, quality)
+        result = {
+            'object': job['object'],
+            'pages': job['pages'],
+            'dpi': job.get('dpi'),
+            'original_size': job['original_size'],
+            'compressed_size': job['original_size'],
+            'saved': 0,
+        }
+        if data is None:
+            result.update({'status': 'kept', 'reason': 'recompressed image is not smaller'})
+        else:
+            replace_image(images[job['object']], {'data': data, 'new_width': size[0],
+                                                  'new_height': size[1]})
+            result.update({'status': 'replaced', 'compressed_size': len(data),
+                           'saved': job['original_size'] - len(data)})
+        results.append(result)
+    return results
+
+
+def snapshot_images(images: Dict[int, object]) -> Dict[int, tuple]:
+    """Remember the stream data and dictionary of every image."""
+    return {idnum: (image._data, dict(image)) for idnum, image in images.items()}
+
+
+def restore_images(images: Dict[int, object], snapshot: Dict[int, tuple]) -> None:
+    """Put images back the way snapshot_images found them."""
+    for idnum, (data, entries) in snapshot.items():
+        image = images[idnum]
+        image._data = data
+        if hasattr(image, 'decoded_self'):
+            image.decoded_self = None
+        image.clear()
+        image.update(entries)
@@ -0,0 +1,282 @@
+"""
+Lossless recompression of the streams of a PDF.
+
+Fonts, ICC profiles, embedded files, form XObjects and lossless images are
+often stored uncompressed or deflated at a low level. This pass decodes
+every stream whose filters it can undo exactly, deflates the data again at
+the highest zlib level and, for images, also with a PNG predictor (the
+rows filtered as in a PNG file, which tells zlib how neighbouring pixels
+relate). Whichever is smallest - the original encoding included - is kept,
+so the decoded data, and with it the rendered page, never changes.
+"""
+
+import io
+import logging
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Container, Iterable, List, Optional, Tuple
+
+from PIL import Image
+from PyPDF2.generic import (ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject,
+                            NameObject, NullObject, NumberObject, StreamObject)
+
+logger = logging.getLogger(__name__)
+
+# Filters undone exactly by PyPDF2; streams with any other filter (JPEG,
+# JPEG 2000, CCITT, JBIG2, encryption) are left as they are
+LOSSLESS_FILTERS = ('/FlateDecode', '/Fl', '/LZWDecode', '/LZW',
+                    '/ASCIIHexDecode', '/AHx', '/ASCII85Decode', '/A85')
+
+# Streams smaller than this are not worth a worker's time
+MIN_STREAM_SIZE = 64
+
+# Pillow image modes whose raw bytes match PDF image samples of
+# (components, bits per component) and that Pillow can write as PNG
+_PNG_MODES = {(1, 1): '1', (1, 8): 'L', (2, 8): 'LA', (3, 8): 'RGB', (4, 8): 'RGBA'}
+
+_COLOR_COMPONENTS = {'/DeviceGray': 1, '/CalGray': 1, '/Indexed': 1, '/Separation': 1,
+                     '/DeviceRGB': 3, '/CalRGB': 3, '/Lab': 3, '/DeviceCMYK': 4}
+
+# Keys that point back up the document tree rather than at page resources
+_SKIPPED_KEYS = ('/Parent', '/P')
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _components(color_space) -> Optional[int]:
+    """Number of color components of an image color space, if known."""
+    color_space = color_space.get_object() if isinstance(color_space, IndirectObject) else color_space
+    if isinstance(color_space, ArrayObject) and color_space:
+        family = color_space[0]
+        if family == '/ICCBased':
+            return int(color_space[1].get_object().get('/N', 0)) or None
+        if family == '/DeviceN':
+            return len(color_space[1].get_object())
+        return _COLOR_COMPONENTS.get(family)
+    return _COLOR_COMPONENTS.get(color_space)
+
+
+def _decode(stream: StreamObject) -> Optional[Tuple[bytes, bool]]:
+    """
+    Undo a stream's filters for recompression.
+
+    Returns:
+        Tuple of the data and whether it still carries the stream's PNG or
+        TIFF predictor, which is then kept along with /DecodeParms; None
+        when the filters cannot all be undone exactly
+    """
+    filters = stream.get('/Filter')
+    filters = filters.get_object() if isinstance(filters, IndirectObject) else filters
+    if filters is None:
+        filters = []
+    elif not isinstance(filters, ArrayObject):
+        filters = [filters]
+    if any(name not in LOSSLESS_FILTERS for name in filters):
+        return None
+    parms = stream.get('/DecodeParms')
+    parms = parms.get_object() if isinstance(parms, IndirectObject) else parms
+    if parms is None or isinstance(parms, NullObject):
+        parms = {}
+    elif not isinstance(parms, DictionaryObject):
+        return None  # one set of parameters per filter
+    if int(parms.get('/Predictor', 1)) != 1:
+        # PyPDF2 ignores /Colors when it reverses predictors, so only the
+        # deflate layer is undone and the predicted rows are kept as they are
+        if list(filters) not in (['/FlateDecode'], ['/Fl']):
+            return None
+        return zlib.decompress(stream._data), True
+    if parms and any(name in ('/LZWDecode', '/LZW') for name in filters):
+        return None  # /EarlyChange, which PyPDF2 does not read
+    data = stream.get_data()
+    return (data.encode('latin-1') if isinstance(data, str) else data), False
+
+
+def _image_layout(stream: StreamObject) -> Optional[dict]:
+    """Sample layout of an image stream, when PNG predictors can be tried on it."""
+    if stream.get('/Subtype') != '/Image':
+        return None
+    try:
+        width = int(stream['/Width'])
+        height = int(stream['/Height'])
+        if stream.get('/ImageMask'):
+            components, bits = 1, 1
+        else:
+            components = _components(stream.get('/ColorSpace'))
+            bits = int(stream.get('/BitsPerComponent', 8))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if (components, bits) not in _PNG_MODES or width <= 0 or height <= 0:
+        return None
+    return {'width': width, 'height': height, 'components': components, 'bits': bits}
+
+
+def _collect_streams(pages: Iterable[Any], exclude: Container[int]) -> List[StreamObject]:
+    """Streams reachable from some pages, each once, without wandering into other pages."""
+    streams = {}
+    visited = set()
+    stack = list(pages)
+    roots = {id(page) for page in stack}
+    while stack:
+        container = stack.pop()
+        if isinstance(container, DictionaryObject):
+            items = [container.raw_get(key) for key in container.keys() if key not in _SKIPPED_KEYS]
+        else:
+            items = list(container)
+        for value in items:
+            if isinstance(value, IndirectObject):
+                if value.idnum in visited or value.idnum in exclude:
+                    continue
+                visited.add(value.idnum)
+                value = value.get_object()
+            if isinstance(value, StreamObject):
+                streams[id(value)] = value
+            if isinstance(value, DictionaryObject) and value.get('/Type') == '/Page' \
+                    and id(value) not in roots:
+                continue  # a link to another page
+            if isinstance(value, (DictionaryObject, ArrayObject)):
+                stack.append(value)
+    return list(streams.values())
+
+
+def _png_idat(raw: bytes, layout: dict) -> Optional[bytes]:
+    """
+    Deflate image samples with PNG row filters, as /Predictor 15 expects.
+
+    Pillow picks a filter for every row and deflates the result at level
+    9; the concatenated IDAT chunks of the PNG file are exactly that data.
+    The PNG is decoded again and None returned unless every sample comes
+    back unchanged.
+    """
+    mode = _PNG_MODES[(layout['components'], layout['bits'])]
+    size = (layout['width'], layout['height'])
+    row_bytes = (layout['width'] * layout['components'] * layout['bits'] + 7) // 8
+    if len(raw) != row_bytes * layout['height']:
+        return None
+    buffer = io.BytesIO()
+    Image.frombytes(mode, size, raw).save(buffer, 'PNG', optimize=True)
+    png = buffer.getvalue()
+    with Image.open(io.BytesIO(png)) as decoded:
+        if decoded.mode != mode or decoded.size != size or decoded.tobytes() != raw:
+            return None
+    idat = []
+    offset = len(_PNG_SIGNATURE)
+    while offset < len(png):
+        length, kind = struct.unpack('>I4s', png[offset:offset + 8])
+        if kind == b'IDAT':
+            idat.append(png[offset + 8:offset + 8 + length])
+        offset += 12 + length
+    return b''.join(idat)
+
+
+def _predictor_parms(layout: dict) -> DictionaryObject:
+    return DictionaryObject({
+        NameObject('/Predictor'): NumberObject(15),
+        NameObject('/Colors'): NumberObject(layout['components']),
+        NameObject('/BitsPerComponent'): NumberObject(layout['bits']),
+        NameObject('/Columns'): NumberObject(layout['width']),
+    })
+
+
+def optimize_stream(job: dict) -> dict:
+    """
+    Find the smallest lossless encoding of one stream's decoded data.
+
+    Runs inside a worker process.
+
+    Args:
+        job: Dictionary with the decoded ``raw`` data, the
+            ``original_size`` of the encoded stream and, for images whose
+            samples suit PNG predictors, their ``layout`` (see optimize_streams)
+
+    Returns:
+        Result dictionary with the original and new sizes; ``data`` holds
+        the new Flate data (and ``predictor`` whether it uses PNG
+        predictors) when it is smaller than the original
+    """
+    result = {'original_size': job['original_size'], 'compressed_size': job['original_size'],
+              'data': None, 'predictor': False}
+    raw = job['raw']
+    best = zlib.compress(raw, 9)
+    predictor = False
+    if job.get('layout'):
+        try:
+            candidate = _png_idat(raw, job['layout'])
+            if candidate is not None and len(candidate) < len(best):
+                best, predictor = candidate, True
+        except Exception as e:
+            logger.debug(f"PNG predictor not usable: {str(e)}")
+    if len(best) < job['original_size']:
+        result.update({'compressed_size': len(best), 'data': best, 'predictor': predictor})
+    return result
+
+
+def _replace_data(stream: StreamObject, result: dict, job: dict) -> None:
+    """Swap a stream's data for its Flate recompression."""
+    # PyPDF2 has no public setter for encoded stream data
+    stream._data = result['data']
+    if not isinstance(stream, EncodedStreamObject):
+        # Stored unfiltered, so PyPDF2 would take the new data as decoded
+        stream.__class__ = EncodedStreamObject
+    stream.decoded_self = None
+    stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+    if result['predictor']:
+        stream[NameObject('/DecodeParms')] = _predictor_parms(job['layout'])
+    elif '/DecodeParms' in stream and not job['predicted']:
+        del stream['/DecodeParms']
+
+
+def optimize_streams(reader, workers: int = 1, pages: Optional[Iterable[Any]] = None,
+                     exclude: Container[int] = ()) -> dict:
+    """
+    Recompress the streams of an open PDF losslessly, in place.
+
+    Every stream reachable from the pages whose filters can be undone
+    exactly is decoded and deflated again at zlib level 9, and images with
+    8-bit or 1-bit samples are also tried with PNG predictors. The smallest
+    encoding is kept; a stream only changes when it gets smaller. XMP
+    metadata streams are left uncompressed so other tools can read them.
+
+    Args:
+        reader: An open PyPDF2.PdfReader, or a PdfWriter holding pages
+        workers: Number of worker processes (0 uses one per CPU core)
+        pages: Only recompress the streams used by these pages
+        exclude: Object numbers of streams to leave alone
+
+    Returns:
+        Dictionary with the number of streams scanned and recompressed,
+        how many of those use PNG predictors, and the bytes saved
+    """
+    stats = {'streams': 0, 'optimized': 0, 'predictor': 0, 'bytes_saved': 0}
+    streams, jobs = [], []
+    for stream in _collect_streams(reader.pages if pages is None else pages, exclude):
+        stats['streams'] += 1
+        original_size = len(stream._data)
+        if original_size < MIN_STREAM_SIZE or stream.get('/Type') == '/Metadata':
+            continue
+        try:
+            decoded = _decode(stream)
+        except Exception as e:
+            logger.warning(f"Could not decode stream for recompression: {str(e)}")
+            continue
+        if decoded is None:
+            continue
+        raw, predicted = decoded
+        streams.append(stream)
+        jobs.append({'raw': raw, 'original_size': original_size, 'predicted': predicted,
+                     'layout': None if predicted else _image_layout(stream)})
+
+    if workers == 1 or len(jobs) <= 1:
+        results = [optimize_stream(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            results = list(pool.map(optimize_stream, jobs, chunksize=16))
+
+    for stream, job, result in zip(streams, jobs, results):
+        if result['data'] is None:
+            continue
+        _replace_data(stream, result, job)
+        stats['optimized'] += 1
+        stats['predictor'] += result['predictor']
+        stats['bytes_saved'] += result['original_size'] - result['compressed_size']
+    return stats
@@ -0,0 +1,315 @@
+"""
+Streaming PDF output with bounded memory for very large documents.
+
+PdfWriter copies every page it is given, with everything the page refers
+to, and keeps it all until ``write`` is called at the end, so memory grows
+with the document. ``StreamingWriter`` writes each page and the objects it
+needs to the output as soon as the page is added instead, renumbering them
+on the way. An object shared by several pages is written once and only its
+new number is remembered. Objects that refer to something not yet written
+(the page tree, pages further on) are given a number up front and the
+cross-reference table, written last, points at wherever they ended up.
+
+Pages are read by walking the page tree (``iter_pages``) rather than
+through ``PdfReader.pages``, which keeps every page dictionary, and after
+every page the reader's cache of parsed objects is emptied, so only one
+page's objects are held at a time. Identical streams are detected by hash
+as they are written and written once.
+"""
+
+import gc
+import hashlib
+import io
+import logging
+import os
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import PyPDF2
+from PyPDF2.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject,
+                            NumberObject, PdfObject, StreamObject, TextStringObject)
+
+logger = logging.getLogger(__name__)
+
+# Page attributes a page inherits from the page tree nodes above it
+_INHERITABLE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+# Page keys that tie a page to the source document's structure
+_DROPPED_PAGE_KEYS = ('/Parent', '/StructParents')
+
+_CATALOG, _PAGES = 1, 2
+
+
+class MemoryLimitExceeded(Exception):
+    """Raised when the process stays above its memory ceiling while writing."""
+
+
+def current_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, or None where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def iter_pages(reader: PyPDF2.PdfReader) -> Iterator[PyPDF2.PageObject]:
+    """
+    Yield the pages of a document in order, walking the page tree as it goes.
+
+    Unlike ``reader.pages`` nothing is kept once a page has been yielded.
+    Inherited attributes are copied into each page, as PyPDF2 does.
+    """
+    root = reader.trailer['/Root'].get_object()
+    stack = [(root.raw_get('/Pages'), {})]
+    seen = set()
+    while stack:
+        reference, inherited = stack.pop()
+        if isinstance(reference, IndirectObject):
+            if reference.idnum in seen:
+                continue  # a broken tree that loops back on itself
+            seen.add(reference.idnum)
+        node = reference.get_object()
+        if node is None:
+            continue
+        if '/Kids' in node:
+            attributes = dict(inherited)
+            for key in _INHERITABLE_KEYS:
+                if key in node:
+                    attributes[key] = node.raw_get(key)
+            for kid in reversed(node['/Kids']):
+                stack.append((kid, attributes))
+            continue
+        page = PyPDF2.PageObject(reader, reference if isinstance(reference, IndirectObject) else None)
+        page.update(node)
+        for key, value in inherited.items():
+            if key not in page:
+                page[NameObject(key)] = value
+        yield page
+
+
+def _serialize(obj: PdfObject) -> bytes:
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+class StreamingWriter:
+    """
+    Writes a PDF page by page, holding on to one page's objects at a time.
+
+    Use it as a context manager, or call close(), to write the page tree,
+    cross-reference table and trailer once every page has been added.
+    """
+
+    def __init__(self, stream: BinaryIO, reader: PyPDF2.PdfReader,
+                 deduplicate: bool = True, memory_limit: Optional[int] = None):
+        """
+        Args:
+            stream: Binary file object the PDF is written to
+            reader: The document the pages come from
+            deduplicate: Whether to write identical streams only once
+            memory_limit: Resident memory in bytes the process should stay
+                under; checked after every page
+        """
+        self.stream = stream
+        self.reader = reader
+        self.deduplicate = deduplicate
+        self.memory_limit = memory_limit
+        self.position = 0
+        # Offset of every object written, by object number - 1 (0 = not written)
+        self._offsets = array('Q')
+        # Source object number -> output object number
+        self._numbers: Dict[int, int] = {}
+        # SHA-256 of a serialized stream -> output object number
+        self._hashes: Dict[bytes, int] = {}
+        # Objects numbered but not yet written: (output number, object)
+        self._pending: List[Tuple[int, PdfObject]] = []
+        # Output object numbers of the pages written, in order
+        self._kids = array('Q')
+        self.stats = {'streams': 0, 'duplicates': 0, 'bytes_saved': 0}
+
+        self._reserve()  # catalog
+        self._reserve()  # page tree
+        # Pages can be referred to (links, annotations) before they are written
+        for page in iter_pages(reader):
+            if page.indirect_reference is not None:
+                self._numbers[page.indirect_reference.idnum] = self._reserve()
+            reader.resolved_objects.clear()
+
+        version = max(reader.pdf_header[5:], '1.4')
+        self._write(f"%PDF-{version}\n".encode())
+        self._write(b"%\xE2\xE3\xCF\xD3\n")
+
+    def __enter__(self) -> 'StreamingWriter':
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+
+    def __contains__(self, idnum: int) -> bool:
+        """Whether a source object has been given an output number."""
+        return idnum in self._numbers
+
+    def add_page(self, page: PyPDF2.PageObject, updates: Optional[dict] = None) -> None:
+        """
+        Write a page of the reader and everything it refers to.
+
+        Args:
+            page: A page of the reader, as iter_pages yields them
+            updates: Page keys to replace, e.g. recompressed /Contents
+        """
+        if page.indirect_reference is not None:
+            number = self._numbers[page.indirect_reference.idnum]
+        else:
+            number = self._reserve()
+        entries = DictionaryObject({key: value for key, value in page.items()
+                                    if key not in _DROPPED_PAGE_KEYS})
+        for key, value in (updates or {}).items():
+            entries[NameObject(key)] = value
+        translated = self._translate(entries)
+        translated[NameObject('/Parent')] = IndirectObject(_PAGES, 0, None)
+        self._write_object(number, _serialize(translated))
+        self._flush_pending()
+        self._kids.append(number)
+        self._release()
+
+    def close(self) -> None:
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        self._write_object(_PAGES, _serialize(DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(kid, 0, None) for kid in self._kids),
+            NameObject('/Count'): NumberObject(len(self._kids)),
+        })))
+        self._write_object(_CATALOG, _serialize(DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(_PAGES, 0, None),
+        })))
+        info = self._reserve()
+        self._write_object(info, _serialize(DictionaryObject({
+            NameObject('/Producer'): TextStringObject('PyPDF2'),
+        })))
+
+        xref_offset = self.position
+        self._write(f"xref\n0 {len(self._offsets) + 1}\n".encode())
+        self._write(b"0000000000 65535 f \n")
+        for offset in self._offsets:
+            if offset:
+                self._write(f"{offset:010d} 00000 n \n".encode())
+            else:
+                self._write(b"0000000000 00000 f \n")
+        self._write(b"trailer\n")
+        self._write(_serialize(DictionaryObject({
+            NameObject('/Size'): NumberObject(len(self._offsets) + 1),
+            NameObject('/Root'): IndirectObject(_CATALOG, 0, None),
+            NameObject('/Info'): IndirectObject(info, 0, None),
+        })))
+        self._write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+    def _write(self, data: bytes) -> None:
+        self.stream.write(data)
+        self.position += len(data)
+
+    def _reserve(self) -> int:
+        """Take the next output object number."""
+        self._offsets.append(0)
+        return len(self._offsets)
+
+    def _write_object(self, number: int, data: bytes) -> None:
+        self._offsets[number - 1] = self.position
+        self._write(f"{number} 0 obj\n".encode())
+        self._write(data)
+        self._write(b"\nendobj\n")
+
+    def _translate(self, obj: PdfObject) -> PdfObject:
+        """Copy a direct object, renumbering the references in it."""
+        if isinstance(obj, IndirectObject):
+            return self._reference(obj)
+        if isinstance(obj, StreamObject):
+            # A stream built in memory (e.g. recompressed page content)
+            return IndirectObject(self._write_stream(obj), 0, None)
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({NameObject(key): self._translate(value)
+                                     for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._translate(value) for value in obj)
+        return obj
+
+    def _reference(self, reference: IndirectObject) -> IndirectObject:
+        """Output reference for a source reference, numbering the object if it is new."""
+        number = self._numbers.get(reference.idnum)
+        if number == 0:
+            # A stream reached again through its own dictionary
+            number = self._numbers[reference.idnum] = self._reserve()
+        elif number is None:
+            obj = reference.get_object()
+            if isinstance(obj, StreamObject):
+                # Streams are written straight away, so duplicates can be
+                # recognised before they get a number of their own
+                number = self._write_stream(obj, reference.idnum)
+            else:
+                number = self._reserve()
+                self._numbers[reference.idnum] = number
+                self._pending.append((number, NullObject() if obj is None else obj))
+        return IndirectObject(number, 0, None)
+
+    def _write_stream(self, obj: StreamObject, idnum: Optional[int] = None) -> int:
+        """Write a stream object, or find an identical one already written."""
+        if idnum is not None:
+            # Marks the stream as being written (see _reference)
+            self._numbers[idnum] = 0
+        copy = StreamObject()
+        copy._data = obj._data
+        copy.update({NameObject(key): self._translate(value) for key, value in obj.items()
+                     if key != '/Length'})
+        data = _serialize(copy)
+        self.stats['streams'] += 1
+
+        number = self._numbers.get(idnum) if idnum is not None else None
+        digest = None
+        if self.deduplicate and not number:
+            digest = hashlib.sha256(data).digest()
+            if digest in self._hashes:
+                self.stats['duplicates'] += 1
+                self.stats['bytes_saved'] += len(data)
+                if idnum is not None:
+                    self._numbers[idnum] = self._hashes[digest]
+                return self._hashes[digest]
+        if not number:
+            number = self._reserve()
+        if idnum is not None:
+            self._numbers[idnum] = number
+        if digest is not None:
+            self._hashes[digest] = number
+        self._write_object(number, data)
+        return number
+
+    def _flush_pending(self) -> None:
+        """Write the objects the page pulled in, and whatever they pull in."""
+        while self._pending:
+            number, obj = self._pending.pop()
+            self._write_object(number, _serialize(self._translate(obj)))
+
+    def _release(self) -> None:
+        """Forget the reader's parsed objects and enforce the memory ceiling."""
+        self.reader.resolved_objects.clear()
+        if self.memory_limit is None:
+            return
+        rss = current_rss()
+        if rss is None:
+            return
+        if rss > self.memory_limit:
+            # The duplicate index is the one thing here that grows with the
+            # document; later duplicates are then written again
+            if self._hashes:
+                logger.warning("Memory ceiling reached; no longer deduplicating streams")
+                self._hashes.clear()
+                self.deduplicate = False
+            gc.collect()
+            rss = current_rss() or 0
+            if rss > self.memory_limit:
+                raise MemoryLimitExceeded(
+                    f"Memory use {rss // (1024 * 1024)}MB is above the "
+                    f"{self.memory_limit // (1024 * 1024)}MB limit"
+                )
@@ -0,0 +1,37 @@
+"""
+Shared fixtures: the repository's modules and generated PDFs.
+
+Test documents come from the benchmark corpus generators, seeded, so every
+run works on the same files.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+_GENERATORS = {
+    'text': benchmark.make_text_pdf,
+    'images': benchmark.make_image_pdf,
+    'duplicates': benchmark.make_duplicate_pdf,
+    'extracted': benchmark.make_extracted_pdf,
+}
+
+
+@pytest.fixture(scope='session')
+def make_pdf(tmp_path_factory):
+    """Return a function generating (once per session) a kind of PDF with a number of pages."""
+    directory = tmp_path_factory.mktemp('pdfs')
+
+    def make(kind: str, pages: int) -> str:
+        path = str(directory / f'{kind}_{pages}p.pdf')
+        if not os.path.exists(path):
+            _GENERATORS[kind](path, pages, random.Random(pages))
+        return path
+
+    return make
@@ -0,0 +1,30 @@
+"""Tests for batch runs (batch.run_batch)."""
+
+import pytest
+
+from batch import queued_task_id, run_batch
+
+SETTINGS = {'level': 'medium', 'quality': 85, 'remove_metadata': True, 'dedupe': True}
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_missing_input_is_recorded_and_the_run_goes_on(tmp_path, make_pdf, jobs):
+    tasks = [
+        {'input': str(tmp_path / 'gone.pdf'), 'output': str(tmp_path / 'out' / 'gone.pdf'),
+         'settings': SETTINGS},
+        {'input': make_pdf('text', 2), 'output': str(tmp_path / 'out' / 'text.pdf'),
+         'settings': SETTINGS},
+    ]
+    results = {result['input']: result for result in run_batch(tasks, jobs=jobs)}
+    assert len(results) == 2
+    missing = results[tasks[0]['input']]
+    assert missing['status'] == 'failed'
+    assert missing['input_size'] is None
+    assert 'finished_at' in missing
+    assert results[tasks[1]['input']]['status'] == 'ok'
+
+
+def test_missing_input_still_gets_a_task_id(tmp_path):
+    task = {'input': str(tmp_path / 'gone.pdf'), 'output': str(tmp_path / 'out.pdf'),
+            'settings': SETTINGS}
+    assert len(queued_task_id(task)) == 32
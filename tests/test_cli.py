@@ -0,0 +1,23 @@
+"""Tests for the CLI's startup imports."""
+
+import os
+import subprocess
+import sys
+
+import cli
+from gs_pool import GS_QUALITY_MAP
+from result_cache import DEFAULT_MAX_BYTES
+
+
+def test_repeated_defaults_match_their_modules():
+    assert cli.GS_QUALITIES == tuple(GS_QUALITY_MAP)
+    assert cli.DEFAULT_CACHE_MB * 1024 * 1024 == DEFAULT_MAX_BYTES
+
+
+def test_startup_leaves_heavy_modules_unimported():
+    script = ("import sys, cli; print(' '.join(sorted(m for m in "
+              "('PyPDF2', 'PIL', 'tqdm', 'gs_pool', 'result_cache', 'work_queue', 'sqlite3') "
+              "if m in sys.modules)))")
+    completed = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(cli.__file__),
+                               check=True, capture_output=True, text=True)
+    assert completed.stdout.strip() == ''
@@ -0,0 +1,49 @@
+"""Tests for looking up stored outputs."""
+
+import os
+import uuid
+
+import pytest
+
+from output_store import OutputStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutputStore(str(tmp_path))
+
+
+def _write(folder, name, data=b'%PDF-1.4\n'):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_find_returns_indexed_outputs(store, tmp_path):
+    name = f'{uuid.uuid4().hex}_report_compressed.pdf'
+    path = _write(str(tmp_path), name)
+    file_id = store.add(path, 'report_compressed.pdf', owner='10.0.0.1')
+    assert store.find(name)['path'] == path
+    # Outputs are not tied to the address that uploaded them
+    assert store.get_many([file_id])[0]['download_name'] == 'report_compressed.pdf'
+
+
+def test_find_indexes_outputs_written_before_the_index(store, tmp_path):
+    name = f'{uuid.uuid4().hex}_old_compressed.pdf'
+    path = _write(str(tmp_path), name, b'%PDF-1.4\n' * 10)
+    assert store.get(OutputStore.file_id(name)) is None
+    record = store.find(name)
+    assert record['path'] == path
+    assert record['download_name'] == 'old_compressed.pdf'
+    assert record['size'] == 90
+    assert record['created'] == pytest.approx(os.path.getmtime(path))
+    assert store.usage()['files'] == 1
+
+
+def test_find_rejects_names_outside_the_store(store, tmp_path):
+    _write(str(tmp_path), 'notes.pdf')
+    assert store.find('notes.pdf') is None
+    assert store.find('index.sqlite3') is None
+    assert store.find(f'{uuid.uuid4().hex}_missing.pdf') is None
+    assert store.find(f'{uuid.uuid4().hex}_../notes.pdf') is None
@@ -0,0 +1,59 @@
+"""Tests for page counting and validation (pdf_document.PDFDocument)."""
+
+import io
+import re
+
+import PyPDF2
+import pytest
+
+from pdf_compressor import PDFCompressor
+from pdf_document import PDFDocument
+
+
+def _three_pages() -> bytes:
+    writer = PyPDF2.PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(100, 100)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+@pytest.fixture
+def pdf_file(tmp_path):
+    def write(data: bytes) -> str:
+        path = tmp_path / 'document.pdf'
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_page_count_reads_the_root_count(pdf_file):
+    with PDFDocument(pdf_file(_three_pages())) as document:
+        assert document.page_count == 3
+        assert document.reader.flattened_pages is None
+
+
+def test_validate_corrects_a_wrong_count(pdf_file):
+    with PDFDocument(pdf_file(_three_pages().replace(b'/Count 3', b'/Count 9'))) as document:
+        assert document.page_count == 9
+        assert document.validate()[0]
+        assert document.page_count == 3
+
+
+@pytest.mark.parametrize('kids', [b'/Kids [ 7 ]', b'/Kids [ 99 0 R ]'], ids=['number', 'missing'])
+def test_validate_rejects_a_broken_page_tree(pdf_file, kids):
+    data = re.sub(rb'/Kids \[[^\]]*\]', kids, _three_pages())
+    with PDFDocument(pdf_file(data)) as document:
+        assert document.page_count == 3
+        is_valid, message = document.validate()
+    assert not is_valid
+    assert message.startswith('Error validating PDF')
+
+
+def test_compression_keeps_every_page_despite_a_wrong_count(pdf_file, tmp_path):
+    source = pdf_file(_three_pages().replace(b'/Count 3', b'/Count 1'))
+    output = str(tmp_path / 'out.pdf')
+    success, message = PDFCompressor().compress_pdf(source, output, 'high')
+    assert success, message
+    assert len(PyPDF2.PdfReader(output).pages) == 3
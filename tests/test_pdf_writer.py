@@ -0,0 +1,68 @@
+"""Tests for object-stream output (pdf_writer.write_object_streams)."""
+
+import io
+
+import PyPDF2
+import pytest
+from PyPDF2.generic import StreamObject
+
+from pdf_writer import write_object_streams
+
+
+def _copy(path: str) -> PyPDF2.PdfWriter:
+    writer = PyPDF2.PdfWriter()
+    for page in PyPDF2.PdfReader(path).pages:
+        writer.add_page(page)
+    return writer
+
+
+def _write(path: str, object_streams: bool) -> bytes:
+    output = io.BytesIO()
+    if object_streams:
+        write_object_streams(_copy(path), output)
+    else:
+        _copy(path).write(output)
+    return output.getvalue()
+
+
+@pytest.fixture(params=[('text', 30), ('duplicates', 6), ('extracted', 4)],
+                ids=lambda param: param[0])
+def source(request, make_pdf):
+    return make_pdf(*request.param)
+
+
+def test_output_parses_strictly(source):
+    reader = PyPDF2.PdfReader(io.BytesIO(_write(source, True)), strict=True)
+    assert reader.pdf_header == '%PDF-1.5'
+    assert reader.xref_objStm, 'no object was packed into an object stream'
+    for page in reader.pages:
+        page.extract_text()
+
+
+def test_pages_and_content_are_preserved(source):
+    original = PyPDF2.PdfReader(source)
+    written = PyPDF2.PdfReader(io.BytesIO(_write(source, True)), strict=True)
+    assert len(written.pages) == len(original.pages)
+    for before, after in zip(original.pages, written.pages):
+        assert after.get_contents().get_data() == before.get_contents().get_data()
+        assert after.extract_text() == before.extract_text()
+        assert sorted(after['/Resources']['/Font']) == sorted(before['/Resources']['/Font'])
+        assert after.mediabox == before.mediabox
+
+
+def test_output_is_smaller_than_classic_xref(source):
+    assert len(_write(source, True)) < len(_write(source, False))
+
+
+def test_streams_are_never_packed(source):
+    reader = PyPDF2.PdfReader(io.BytesIO(_write(source, True)), strict=True)
+    for idnum in reader.xref_objStm:
+        assert not isinstance(reader.get_object(idnum), StreamObject), idnum
+    # Every stream the pages use is stored in the file itself
+    in_file = {idnum for numbers in reader.xref.values() for idnum in numbers}
+    for page in reader.pages:
+        contents = page.raw_get('/Contents')
+        assert contents.idnum in in_file
+        xobjects = page['/Resources'].get('/XObject', {})
+        for name in xobjects:
+            assert xobjects.raw_get(name).idnum in in_file
@@ -0,0 +1,223 @@
+"""Tests for unused resource removal and font subsetting (resource_pruner)."""
+
+import io
+
+import PyPDF2
+import pytest
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject,
+                            NameObject, NumberObject)
+
+from pdf_compressor import PDFCompressor
+from resource_pruner import prune_resources
+
+
+def _dict(**entries) -> DictionaryObject:
+    return DictionaryObject({NameObject('/' + key): value for key, value in entries.items()})
+
+
+def _stream(writer, data: bytes, **entries):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    stream.update(_dict(**entries))
+    return writer._add_object(stream)
+
+
+def _box(*values) -> ArrayObject:
+    return ArrayObject(FloatObject(value) for value in values)
+
+
+def _font(writer, base_font: str):
+    return writer._add_object(_dict(Type=NameObject('/Font'), Subtype=NameObject('/Type1'),
+                                     BaseFont=NameObject(base_font)))
+
+
+def _image(writer):
+    return _stream(writer, b'\x00', Type=NameObject('/XObject'), Subtype=NameObject('/Image'),
+                   Width=NumberObject(1), Height=NumberObject(1),
+                   ColorSpace=NameObject('/DeviceGray'), BitsPerComponent=NumberObject(8))
+
+
+def _form(writer, content: bytes, resources=None):
+    entries = {}
+    if resources is not None:
+        entries['Resources'] = resources
+    return _stream(writer, content, Type=NameObject('/XObject'), Subtype=NameObject('/Form'),
+                   BBox=_box(0, 0, 100, 100), **entries)
+
+
+def _page(writer, content: bytes, resources: DictionaryObject, annotations=()):
+    writer.add_blank_page(612, 792)
+    page = writer.pages[-1]
+    page[NameObject('/Resources')] = resources
+    page[NameObject('/Contents')] = _stream(writer, content)
+    if annotations:
+        page[NameObject('/Annots')] = ArrayObject(annotations)
+    return page
+
+
+def _reopen(writer) -> PyPDF2.PdfReader:
+    output = io.BytesIO()
+    writer.write(output)
+    return PyPDF2.PdfReader(io.BytesIO(output.getvalue()))
+
+
+def _names(page, category: str) -> set:
+    return set(page['/Resources'][category].keys())
+
+
+@pytest.fixture
+def pruned():
+    """A document with resources reached in every way the pruner follows, after pruning."""
+    writer = PyPDF2.PdfWriter()
+
+    # Page 1: fonts and XObjects drawn directly, through forms and through
+    # an annotation appearance, next to ones nothing draws
+    own_resources = _dict(Font=_dict(F5=_font(writer, '/Times-Roman'),
+                                     F6=_font(writer, '/Times-Bold')))
+    appearance = _form(writer, b'BT /F4 9 Tf (note) Tj ET')
+    annotation = writer._add_object(_dict(Type=NameObject('/Annot'), Subtype=NameObject('/Text'),
+                                          Rect=_box(10, 10, 30, 30), AP=_dict(N=appearance)))
+    _page(writer, b'BT /F1 12 Tf (Hi) Tj ET q /Im1 Do Q /Fm1 Do /Fm2 Do',
+          _dict(Font=_dict(F1=_font(writer, '/Helvetica'), F2=_font(writer, '/Courier'),
+                           F3=_font(writer, '/Helvetica-Bold'), F4=_font(writer, '/Symbol')),
+                XObject=_dict(Im1=_image(writer), Im2=_image(writer),
+                              Fm1=_form(writer, b'BT /F3 10 Tf (inherited) Tj ET'),
+                              Fm2=_form(writer, b'BT /F5 10 Tf (own) Tj ET', own_resources))),
+          [annotation])
+
+    # Page 2: a Type 3 font without resources of its own draws with the page's
+    type3 = writer._add_object(_dict(
+        Type=NameObject('/Font'), Subtype=NameObject('/Type3'), FontBBox=_box(0, 0, 1, 1),
+        FontMatrix=_box(0.001, 0, 0, 0.001, 0, 0),
+        CharProcs=_dict(a=_stream(writer, b'0 0 d0 /Im3 Do')),
+        Encoding=_dict(Differences=ArrayObject([NumberObject(97), NameObject('/a')])),
+        FirstChar=NumberObject(97), LastChar=NumberObject(97), Widths=ArrayObject([NumberObject(1)])))
+    _page(writer, b'BT /T3 12 Tf (a) Tj ET',
+          _dict(Font=_dict(T3=type3, U1=_font(writer, '/Courier')),
+                XObject=_dict(Im3=_image(writer))))
+
+    # Page 3: shares its font dictionary with the AcroForm default resources
+    shared_fonts = writer._add_object(_dict(F1=_font(writer, '/Helvetica'),
+                                            Helv=_font(writer, '/Helvetica-Oblique')))
+    _page(writer, b'BT /F1 12 Tf (form) Tj ET', _dict(Font=shared_fonts))
+    writer._root_object[NameObject('/AcroForm')] = _dict(Fields=ArrayObject(),
+                                                         DR=_dict(Font=shared_fonts))
+
+    reader = _reopen(writer)
+    stats = prune_resources(reader, subset_fonts=False)
+    return reader, stats
+
+
+def test_unused_fonts_and_xobjects_are_dropped(pruned):
+    reader, stats = pruned
+    page = reader.pages[0]
+    assert '/F2' not in _names(page, '/Font')
+    assert '/Im2' not in _names(page, '/XObject')
+    assert '/F6' not in set(page['/Resources']['/XObject']['/Fm2']['/Resources']['/Font'].keys())
+    assert stats['removed'] == 3
+    assert stats['bytes_saved']['images'] == 1
+
+
+def test_resources_drawn_indirectly_survive(pruned):
+    reader, _ = pruned
+    page = reader.pages[0]
+    assert _names(page, '/Font') == {'/F1', '/F3', '/F4'}
+    assert _names(page, '/XObject') == {'/Im1', '/Fm1', '/Fm2'}
+    assert '/F5' in page['/Resources']['/XObject']['/Fm2']['/Resources']['/Font']
+
+
+def test_type3_font_keeps_the_resources_it_draws_with(pruned):
+    reader, _ = pruned
+    page = reader.pages[1]
+    assert _names(page, '/Font') == {'/T3', '/U1'}
+    assert _names(page, '/XObject') == {'/Im3'}
+
+
+def test_acroform_default_resources_survive(pruned):
+    reader, _ = pruned
+    assert _names(reader.pages[2], '/Font') == {'/F1', '/Helv'}
+    assert '/Helv' in reader.trailer['/Root']['/AcroForm']['/DR']['/Font']
+
+
+def _truetype_program() -> bytes:
+    """A small TrueType font with a space and a box glyph for each capital letter."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    names = ['.notdef'] + [chr(code) for code in range(ord('A'), ord('Z') + 1)]
+    glyphs = {'space': TTGlyphPen(None).glyph()}
+    for index, name in enumerate(names):
+        pen = TTGlyphPen(None)
+        for offset in range(0, 400, 100):
+            pen.moveTo((offset, 0))
+            pen.lineTo((offset, 700 - index))
+            pen.lineTo((offset + 50 + index, 700))
+            pen.lineTo((offset + 50, index))
+            pen.closePath()
+        glyphs[name] = pen.glyph()
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names + ['space'])
+    builder.setupCharacterMap({32: 'space', **{ord(name): name for name in names[1:]}})
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (600, 0) for name in glyphs})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': 'Boxes', 'styleName': 'Regular'})
+    builder.setupOS2()
+    builder.setupPost()
+    output = io.BytesIO()
+    builder.save(output)
+    return output.getvalue()
+
+
+def test_subset_truetype_font_extracts_the_same_text(tmp_path):
+    pytest.importorskip('fontTools')
+    from fontTools.ttLib import TTFont
+
+    program = _truetype_program()
+    writer = PyPDF2.PdfWriter()
+    font_file = _stream(writer, program, Length1=NumberObject(len(program)))
+    descriptor = writer._add_object(_dict(
+        Type=NameObject('/FontDescriptor'), FontName=NameObject('/Boxes'), Flags=NumberObject(32),
+        FontBBox=_box(0, 0, 1000, 1000), ItalicAngle=NumberObject(0), Ascent=NumberObject(800),
+        Descent=NumberObject(-200), CapHeight=NumberObject(700), StemV=NumberObject(80),
+        FontFile2=font_file))
+    font = writer._add_object(_dict(
+        Type=NameObject('/Font'), Subtype=NameObject('/TrueType'), BaseFont=NameObject('/Boxes'),
+        FirstChar=NumberObject(65), LastChar=NumberObject(90),
+        Widths=ArrayObject([NumberObject(600)] * 26), Encoding=NameObject('/WinAnsiEncoding'),
+        FontDescriptor=descriptor))
+    _page(writer, b'BT /TT 24 Tf 72 700 Td (HELLO WORLD) Tj ET', _dict(Font=_dict(TT=font)))
+    source = tmp_path / 'truetype.pdf'
+    output = tmp_path / 'truetype_pruned.pdf'
+    with open(source, 'wb') as f:
+        writer.write(f)
+
+    compressor = PDFCompressor()
+    success, message = compressor.compress_pdf(str(source), str(output), prune_resources=True)
+    assert success, message
+    assert compressor.prune_stats['fonts_subset'] == 1
+
+    before = PyPDF2.PdfReader(str(source)).pages[0]
+    after = PyPDF2.PdfReader(str(output)).pages[0]
+    assert after.extract_text() == before.extract_text()
+    assert 'HELLO WORLD' in after.extract_text()
+
+    subset_font = after['/Resources']['/Font']['/TT']
+    assert subset_font['/BaseFont'][7:] == '+Boxes'
+    subset = TTFont(io.BytesIO(subset_font['/FontDescriptor']['/FontFile2'].get_data()))
+    assert len(subset.getGlyphOrder()) == 28
+    glyf = subset['glyf']
+    order = subset.getGlyphOrder()
+    for letter in 'HELOWRD':
+        assert glyf[order[ord(letter) - 64]].numberOfContours == 4, letter
+    for letter in 'ABZ':
+        assert glyf[order[ord(letter) - 64]].numberOfContours == 0, letter
+    assert len(subset_font['/FontDescriptor']['/FontFile2'].get_data()) < len(program)
+
+
+def test_pruning_is_off_by_default(tmp_path, make_pdf):
+    output = tmp_path / 'default.pdf'
+    compressor = PDFCompressor()
+    success, message = compressor.compress_pdf(make_pdf('extracted', 4), str(output))
+    assert success, message
+    assert compressor.prune_stats == {}
@@ -0,0 +1,60 @@
+"""Tests for running size estimates through a Ghostscript pool."""
+
+import os
+import stat
+
+import pytest
+
+from gs_pool import GhostscriptPool, PoolSaturated
+from pdf_document import PDFDocument
+from size_estimator import estimate_sizes
+
+
+@pytest.fixture
+def fake_gs(tmp_path, monkeypatch):
+    """A gs that copies its input to its output."""
+    directory = tmp_path / 'bin'
+    directory.mkdir()
+    gs = directory / 'gs'
+    gs.write_text('#!/bin/sh\n'
+                  'for a in "$@"; do case "$a" in -sOutputFile=*) out="${a#-sOutputFile=}";; '
+                  'esac; last="$a"; done\n'
+                  'cp "$last" "$out"\n')
+    gs.chmod(gs.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f"{directory}{os.pathsep}{os.environ['PATH']}")
+
+
+@pytest.fixture
+def pool():
+    pool = GhostscriptPool(size=1, queue_size=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_ghostscript_samples_run_in_the_pool(fake_gs, pool, tmp_path, make_pdf):
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    seen = []
+
+    def run(input_path, output_path, gs_quality):
+        seen.append(os.path.dirname(input_path))
+        pool.submit(input_path, output_path, gs_quality).result()
+
+    with PDFDocument(make_pdf('text', 4)) as document:
+        estimate = estimate_sizes(document, levels=(), gs_qualities=('screen', 'ebook'), pages=2,
+                                  run_ghostscript=run, workdir=str(workdir))
+    assert [e['setting'] for e in estimate['estimates'] if 'size' in e] == ['screen', 'ebook']
+    # Two sampled pages and the blank page, per preset
+    assert pool.stats()['completed'] == 6
+    assert {os.path.dirname(path) for path in seen} == {str(workdir)}
+    assert os.listdir(workdir) == []
+
+
+def test_a_full_pool_stops_the_estimate(make_pdf):
+    def full(input_path, output_path, gs_quality):
+        raise PoolSaturated('Ghostscript queue is full, try again shortly')
+
+    with PDFDocument(make_pdf('text', 4)) as document:
+        with pytest.raises(PoolSaturated):
+            estimate_sizes(document, levels=(), gs_qualities=('screen',), pages=2,
+                           run_ghostscript=full)
@@ -0,0 +1,80 @@
+"""Tests for streaming output under a memory ceiling (streaming_writer)."""
+
+import io
+import json
+import os
+import subprocess
+import sys
+
+import PyPDF2
+import pytest
+
+from pdf_compressor import PDFCompressor
+from streaming_writer import MemoryLimitExceeded, StreamingWriter, current_rss, iter_pages
+
+MB = 1024 * 1024
+
+pytestmark = pytest.mark.skipif(current_rss() is None,
+                                reason='resident memory cannot be read on this system')
+
+# Compresses a file with streaming output in a fresh process and prints its peak RSS
+_PEAK_RSS_SCRIPT = """
+import json, resource, sys
+sys.path.insert(0, sys.argv[1])
+from pdf_compressor import PDFCompressor
+success, message = PDFCompressor().compress_pdf(sys.argv[2], sys.argv[3], 'low', streaming=True,
+                                                memory_limit=int(sys.argv[4]))
+print(json.dumps({'success': success, 'message': message,
+                  'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+"""
+
+
+def _stream(path: str, memory_limit: int) -> bytes:
+    reader = PyPDF2.PdfReader(path)
+    output = io.BytesIO()
+    with StreamingWriter(output, reader, memory_limit=memory_limit) as writer:
+        for page in iter_pages(reader):
+            writer.add_page(page)
+    return output.getvalue()
+
+
+def _peak_rss(source: str, output: str, memory_limit: int) -> int:
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(
+        [sys.executable, '-c', _PEAK_RSS_SCRIPT, repository, source, output, str(memory_limit)],
+        check=True, capture_output=True, text=True
+    )
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert report['success'], report['message']
+    assert len(PyPDF2.PdfReader(output).pages) == len(PyPDF2.PdfReader(source).pages)
+    return report['peak_rss']
+
+
+def test_writes_many_pages_under_the_limit(make_pdf):
+    source = make_pdf('text', 500)
+    data = _stream(source, current_rss() + 256 * MB)
+    reader = PyPDF2.PdfReader(io.BytesIO(data), strict=True)
+    assert len(reader.pages) == 500
+    assert reader.pages[-1].extract_text() == PyPDF2.PdfReader(source).pages[-1].extract_text()
+
+
+def test_limit_below_current_use_raises(make_pdf):
+    with pytest.raises(MemoryLimitExceeded):
+        _stream(make_pdf('text', 50), current_rss() // 2)
+
+
+def test_compress_pdf_reports_the_exceeded_limit(make_pdf, tmp_path):
+    success, message = PDFCompressor().compress_pdf(
+        make_pdf('text', 50), str(tmp_path / 'out.pdf'), 'low', streaming=True,
+        memory_limit=current_rss() // 2
+    )
+    assert not success
+    assert 'limit' in message
+
+
+def test_peak_rss_stays_flat_as_pages_grow(make_pdf, tmp_path):
+    limit = 512 * MB
+    small = _peak_rss(make_pdf('text', 200), str(tmp_path / 'small.pdf'), limit)
+    large = _peak_rss(make_pdf('text', 2000), str(tmp_path / 'large.pdf'), limit)
+    # Ten times the pages: the classic writer grows by tens of MB here
+    assert large - small < 8 * MB, (small // MB, large // MB)
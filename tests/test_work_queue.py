@@ -0,0 +1,110 @@
+"""Tests for how queued compression tasks fail, retry and are collected."""
+
+import errno
+import os
+import stat
+
+import pytest
+
+from batch import run_queued
+from pdf_compressor import PDFCompressor
+from queue_pool import compress_task
+from work_queue import WorkQueue, run_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / 'queue.db'), max_attempts=3)
+
+
+def _fake_gs(tmp_path, monkeypatch, script):
+    directory = tmp_path / 'bin'
+    directory.mkdir()
+    gs = directory / 'gs'
+    gs.write_text('#!/bin/sh\n' + script + '\n')
+    gs.chmod(gs.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f"{directory}{os.pathsep}{os.environ['PATH']}")
+
+
+def _run_upload(queue, input_path, output_path, engine='ghostscript'):
+    task_id = queue.enqueue([{'kind': 'upload', 'input': str(input_path), 'output': str(output_path),
+                              'gs_quality': 'ebook', 'engine': engine, 'object_streams': False,
+                              'linearize': False, 'timeout': None}])[0]
+    run_worker(queue, compress_task, poll_interval=0.01, max_tasks=1)
+    return queue.get(task_id)
+
+
+def test_missing_input_fails_for_good(queue, tmp_path):
+    task = _run_upload(queue, tmp_path / 'missing.pdf', tmp_path / 'out.pdf', engine='auto')
+    assert task['status'] == 'failed'
+    assert task['error_kind'] == 'input'
+    assert task['attempts'] == 1
+
+
+def test_unparsable_input_fails_for_good(queue, tmp_path):
+    corrupt = tmp_path / 'corrupt.pdf'
+    corrupt.write_bytes(b'%PDF-1.4\nnot really a pdf\n')
+    task = _run_upload(queue, corrupt, tmp_path / 'out.pdf', engine='auto')
+    assert task['status'] == 'failed'
+    assert task['error_kind'] == 'input'
+    assert task['attempts'] == 1
+
+
+def test_ghostscript_error_exit_fails_for_good(queue, tmp_path, monkeypatch, make_pdf):
+    _fake_gs(tmp_path, monkeypatch, 'echo "Error: /syntaxerror" >&2; exit 1')
+    task = _run_upload(queue, make_pdf('text', 2), tmp_path / 'out.pdf')
+    assert task['status'] == 'failed'
+    assert task['error_kind'] == 'ghostscript'
+
+
+def test_ghostscript_crash_is_retried(queue, tmp_path, monkeypatch, make_pdf):
+    _fake_gs(tmp_path, monkeypatch, 'kill -9 $$')
+    task = _run_upload(queue, make_pdf('text', 2), tmp_path / 'out.pdf')
+    assert task['status'] == 'queued'
+    assert task['error_kind'] == 'ghostscript'
+
+
+def test_auto_engine_ghostscript_crash_is_retried(queue, tmp_path, monkeypatch, make_pdf):
+    _fake_gs(tmp_path, monkeypatch, 'kill -9 $$')
+    task = _run_upload(queue, make_pdf('images', 2), tmp_path / 'out.pdf', engine='auto')
+    assert task['status'] == 'queued'
+    assert task['error_kind'] == 'ghostscript'
+
+
+def test_auto_engine_ghostscript_timeout_is_retried(queue, tmp_path, monkeypatch, make_pdf):
+    _fake_gs(tmp_path, monkeypatch, 'exec sleep 5')
+    task_id = queue.enqueue([{'kind': 'upload', 'input': make_pdf('images', 2),
+                              'output': str(tmp_path / 'out.pdf'), 'gs_quality': 'ebook',
+                              'engine': 'auto', 'object_streams': False, 'linearize': False,
+                              'timeout': 0.2}])[0]
+    run_worker(queue, compress_task, poll_interval=0.01, max_tasks=1)
+    task = queue.get(task_id)
+    assert task['status'] == 'queued'
+    assert task['error_kind'] == 'timeout'
+
+
+def test_auto_engine_transient_error_is_retried(queue, tmp_path, monkeypatch, make_pdf):
+    def out_of_space(*args, **kwargs):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(PDFCompressor, '_build_writer', out_of_space)
+    task = _run_upload(queue, make_pdf('text', 2), tmp_path / 'out.pdf', engine='auto')
+    assert task['status'] == 'queued'
+    assert task['error_kind'] == 'error'
+    assert 'No space left' in task['error']
+
+
+def test_run_queued_reports_removed_tasks(queue, make_pdf, tmp_path):
+    task = {'input': make_pdf('text', 2), 'output': str(tmp_path / 'out.pdf'), 'settings': {}}
+    # Remove the task the moment it is queued, before any worker sees it
+    enqueue = queue.enqueue
+
+    def enqueue_and_remove(payloads, ids=None):
+        task_ids = enqueue(payloads, ids)
+        queue.remove(task_ids)
+        return task_ids
+
+    queue.enqueue = enqueue_and_remove
+    results = run_queued(queue, [task], poll_interval=0.01)
+    assert [result['status'] for result in results] == ['failed']
+    assert 'removed from the work queue' in results[0]['message']
@@ -0,0 +1,139 @@
+"""
+Streaming ingestion of uploaded PDF files.
+
+Werkzeug hands every file part of a multipart body to a stream created by
+``Request._get_file_stream`` as the body is parsed. ``StreamingRequest``
+returns an ``UploadFile`` there, which writes the bytes straight into the
+upload folder, hashes them as they arrive and checks the PDF header as soon
+as the first bytes are in, so a bad file stops the parse before the rest of
+the body is read.
+"""
+
+import hashlib
+import os
+import uuid
+from typing import Optional
+
+from flask import Request, current_app
+from werkzeug.exceptions import UnsupportedMediaType
+from werkzeug.utils import secure_filename
+
+PDF_SIGNATURE = b'%PDF'
+
+
+class InvalidUpload(UnsupportedMediaType):
+    """Raised while parsing when an uploaded file is not a PDF."""
+
+
+class UploadFile:
+    """
+    A writable upload target on disk that hashes and validates its content.
+    """
+
+    def __init__(self, folder: str, filename: Optional[str], check_signature: bool = True):
+        """
+        Args:
+            folder: Directory the file is written to
+            filename: Client-supplied file name, used to name the file
+            check_signature: Whether the content must start with %PDF
+        """
+        self.filename = filename
+        self.path = os.path.join(folder, f"{uuid.uuid4().hex}_{secure_filename(filename or '') or 'upload.pdf'}")
+        self.check_signature = check_signature
+        self.size = 0
+        # Set once the file has been handed over, so it survives the request
+        self.claimed = False
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data: bytes) -> int:
+        """Write a chunk of the upload to disk, hashing and validating it."""
+        if self.check_signature and len(self._head) < len(PDF_SIGNATURE):
+            self._head += data[:len(PDF_SIGNATURE) - len(self._head)]
+            if not PDF_SIGNATURE.startswith(self._head):
+                self.discard()
+                raise InvalidUpload(f"{self.filename} is not a valid PDF (missing PDF signature)")
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    # Werkzeug reads file parts back through these
+    def read(self, *args) -> bytes:
+        return self._file.read(*args)
+
+    def readline(self, *args) -> bytes:
+        return self._file.readline(*args)
+
+    def seek(self, *args) -> int:
+        return self._file.seek(*args)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self) -> None:
+        self._file.close()
+
+    @property
+    def sha256(self) -> str:
+        """Hex SHA-256 of everything written so far."""
+        return self._hash.hexdigest()
+
+    def claim(self) -> str:
+        """
+        Finish the upload and take ownership of the file on disk.
+
+        Returns:
+            Path of the uploaded file
+
+        Raises:
+            InvalidUpload: If the file ended before a full PDF signature
+        """
+        self.close()
+        if self.check_signature and self._head != PDF_SIGNATURE:
+            self.discard()
+            raise InvalidUpload(f"{self.filename} is not a valid PDF (missing PDF signature)")
+        self.claimed = True
+        return self.path
+
+    def discard(self) -> None:
+        """Close and delete the file."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingRequest(Request):
+    """
+    Flask request that streams uploaded PDF files straight to disk.
+
+    Files with a .pdf extension are written to UPLOAD_FOLDER as the body is
+    parsed; anything else gets a regular temporary file. Uploads that are
+    never claimed are deleted when the request ends.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_files = []
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        if not filename or not filename.lower().endswith('.pdf'):
+            return super()._get_file_stream(total_content_length, content_type,
+                                            filename, content_length)
+        upload = UploadFile(current_app.config['UPLOAD_FOLDER'], filename)
+        self.upload_files.append(upload)
+        return upload
+
+    def discard_unclaimed_uploads(self) -> None:
+        """Delete the files of this request that were never claimed."""
+        for upload in self.upload_files:
+            if not upload.claimed:
+                upload.discard()
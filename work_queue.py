@@ -0,0 +1,419 @@
+"""
+Durable task queue shared by compression workers on one or more hosts.
+
+Tasks are rows in a SQLite database, which can sit on storage every host
+mounts. A worker claims the oldest ready task with a lease; while it runs
+the task it renews the lease with heartbeats, which also carry the task's
+progress. A task whose lease runs out - because its worker crashed, was
+killed or lost its host - is claimed again by another worker, and a task
+whose handler raised is retried after a delay, both up to a number of
+attempts. Submitters poll the rows of their tasks for progress and results.
+
+The database is used with SQLite's rollback journal rather than WAL, which
+needs shared memory and does not work across hosts, so it only needs
+storage with working POSIX file locks (local disk, or NFS with locking).
+Leases are compared against each host's clock, so hosts should keep their
+clocks in sync.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed task is leased for; heartbeats renew it three times as often
+DEFAULT_LEASE = 60.0
+# Shortest interval between heartbeats sent because the task's progress changed
+PROGRESS_INTERVAL = 1.0
+# Runs a task gets, counting the first, before it is marked failed
+DEFAULT_ATTEMPTS = 3
+# Seconds before a failed attempt is retried, doubled with every attempt
+RETRY_DELAY = 5.0
+# Finished tasks nobody removed are deleted after this many seconds
+FINISHED_TTL = 24 * 3600
+# Seconds SQLite waits for another process's lock before giving up
+LOCK_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    error_kind TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, available_at);
+CREATE INDEX IF NOT EXISTS tasks_finished ON tasks (finished);
+"""
+
+_COLUMNS = ('id', 'payload', 'status', 'attempts', 'max_attempts', 'worker', 'progress',
+            'result', 'error', 'error_kind', 'created', 'started', 'finished')
+
+
+class TaskFailed(Exception):
+    """Raised by a task handler to fail a task with a kind of error.
+
+    The task fails for good unless retry is set, for failures that another
+    attempt may not repeat.
+    """
+
+    def __init__(self, message: str, kind: str = 'error', retry: bool = False):
+        super().__init__(message)
+        # Stored with the error so submitters can tell failures apart
+        self.kind = kind
+        self.retry = retry
+
+
+def default_worker_id() -> str:
+    """Identify this process among the workers of every host."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+    """
+    A SQLite-backed queue of JSON tasks with leases and retries.
+
+    One instance may be shared by the threads of a process; every process
+    opens its own.
+    """
+
+    def __init__(self, path: str, lease: float = DEFAULT_LEASE,
+                 max_attempts: int = DEFAULT_ATTEMPTS):
+        """
+        Open (or create) a queue database.
+
+        Args:
+            path: SQLite database file, on storage every worker can reach
+            lease: Seconds a claimed task is leased for
+            max_attempts: Runs a task gets before it is marked failed
+        """
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=DELETE')
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _transaction(self, statements: Callable[[sqlite3.Connection], object]):
+        """Run statements in a write transaction, taking the database lock up front."""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                value = statements(self._db)
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+            return value
+
+    def enqueue(self, payloads: Iterable[dict], ids: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Add tasks to the queue.
+
+        Args:
+            payloads: JSON-serializable task descriptions, given to the
+                worker's handler as they are
+            ids: Task ids, one per payload (random by default). A task
+                already queued or running under the same id is left as it
+                is, so a submitter can pick up tasks it queued before it
+                was interrupted; a finished one is queued again.
+
+        Returns:
+            The task ids, in payload order
+        """
+        payloads = list(payloads)
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in payloads]
+        now = time.time()
+        rows = [(task_id, json.dumps(payload), self.max_attempts, now, now)
+                for task_id, payload in zip(ids, payloads)]
+
+        def insert(db):
+            db.executemany(
+                "INSERT INTO tasks (id, payload, status, max_attempts, available_at, created) "
+                "VALUES (?, ?, 'queued', ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET payload = excluded.payload, status = 'queued', "
+                "attempts = 0, max_attempts = excluded.max_attempts, "
+                "available_at = excluded.available_at, worker = NULL, lease_expires = NULL, "
+                "progress = NULL, result = NULL, error = NULL, error_kind = NULL, "
+                "created = excluded.created, started = NULL, finished = NULL "
+                "WHERE tasks.status IN ('done', 'failed')",
+                rows
+            )
+
+        self._transaction(insert)
+        return ids
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """
+        Lease the oldest task that is ready to run.
+
+        Queued tasks whose retry delay has passed are ready, and so are
+        running tasks whose lease ran out. A task whose lease ran out on
+        its last attempt is marked failed instead.
+
+        Returns:
+            The task (see get), or None when no task is ready
+        """
+        def claim_next(db):
+            now = time.time()
+            db.execute(
+                "UPDATE tasks SET status = 'failed', finished = ?, error_kind = 'lease', "
+                "error = 'Worker ' || worker || ' stopped renewing its lease' "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = db.execute(
+                "SELECT id, status, worker FROM tasks WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY available_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] == 'running':
+                logger.warning(f"Lease of task {row[0]} held by {row[2]} expired; reclaiming it")
+            db.execute(
+                "UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "lease_expires = ?, started = ?, error = NULL, error_kind = NULL WHERE id = ?",
+                (worker, now + self.lease, now, row[0])
+            )
+            return row[0]
+
+        task_id = self._transaction(claim_next)
+        return self.get(task_id) if task_id is not None else None
+
+    def heartbeat(self, task_id: str, worker: str, progress: Optional[dict] = None) -> bool:
+        """
+        Renew a task's lease, and record its progress.
+
+        Returns:
+            False if the worker no longer holds the task (its lease ran out
+            and another worker claimed it)
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE tasks SET lease_expires = ?, progress = COALESCE(?, progress) "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease, json.dumps(progress) if progress is not None else None,
+                 task_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: str, worker: str, result: dict) -> bool:
+        """
+        Record a task's result.
+
+        Returns:
+            False if the worker no longer holds the task; the result is
+            dropped, as another worker is running the task again
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE tasks SET status = 'done', result = ?, finished = ?, lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result), time.time(), task_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: str, worker: str, error: str, kind: str = 'error',
+             retry: bool = True) -> bool:
+        """
+        Record a failed attempt at a task.
+
+        The task is queued again after RETRY_DELAY (doubled for every
+        attempt already made) while it has attempts left and retry is
+        True; otherwise it is marked failed.
+
+        Returns:
+            False if the worker no longer holds the task
+        """
+        def record(db):
+            row = db.execute(
+                "SELECT attempts, max_attempts FROM tasks "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (task_id, worker)
+            ).fetchone()
+            if row is None:
+                return False
+            now = time.time()
+            if retry and row[0] < row[1]:
+                db.execute(
+                    "UPDATE tasks SET status = 'queued', available_at = ?, lease_expires = NULL, "
+                    "error = ?, error_kind = ? WHERE id = ?",
+                    (now + RETRY_DELAY * 2 ** (row[0] - 1), error, kind, task_id)
+                )
+            else:
+                db.execute(
+                    "UPDATE tasks SET status = 'failed', finished = ?, lease_expires = NULL, "
+                    "error = ?, error_kind = ? WHERE id = ?",
+                    (now, error, kind, task_id)
+                )
+            return True
+
+        return self._transaction(record)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        """Return a task by id, or None if it is unknown."""
+        tasks = self.get_many([task_id])
+        return tasks[0] if tasks else None
+
+    def get_many(self, task_ids: List[str]) -> List[dict]:
+        """
+        Return the known tasks among task_ids.
+
+        Each task is a dictionary with its ``id``, ``payload``, ``status``
+        ('queued', 'running', 'done' or 'failed'), ``attempts`` and
+        ``max_attempts``, the ``worker`` that last claimed it, its latest
+        ``progress``, its ``result`` once done, the ``error`` and
+        ``error_kind`` of its last failed attempt, and the times it was
+        ``created``, last ``started`` and ``finished``.
+        """
+        tasks = []
+        # SQLite limits the number of parameters of one statement
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT {', '.join(_COLUMNS)} FROM tasks "
+                    f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+            for row in rows:
+                task = dict(zip(_COLUMNS, row))
+                for key in ('payload', 'progress', 'result'):
+                    if task[key] is not None:
+                        task[key] = json.loads(task[key])
+                tasks.append(task)
+        return tasks
+
+    def remove(self, task_ids: List[str]) -> None:
+        """Delete tasks whose results have been collected."""
+        def delete(db):
+            db.executemany('DELETE FROM tasks WHERE id = ?', [(task_id,) for task_id in task_ids])
+
+        self._transaction(delete)
+
+    def purge(self, age: float = FINISHED_TTL) -> int:
+        """Delete finished tasks older than age seconds; return how many were deleted."""
+        with self._lock:
+            cursor = self._db.execute('DELETE FROM tasks WHERE finished < ?', (time.time() - age,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        """Return the number of tasks in each status."""
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        stats = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        stats.update(dict(rows))
+        return stats
+
+
+def run_worker(queue: WorkQueue, handler: Callable[[dict, Callable[[dict], None]], dict],
+               worker: Optional[str] = None, poll_interval: float = 1.0,
+               stop: Optional[threading.Event] = None, exit_when_empty: bool = False,
+               max_tasks: Optional[int] = None,
+               on_task: Optional[Callable[[dict, Optional[dict], Optional[str]], None]] = None) -> int:
+    """
+    Claim and run tasks until stopped.
+
+    Args:
+        queue: The queue to take tasks from
+        handler: Called with a task's payload and a progress callback; its
+            return value is the task's result. A TaskFailed it raises fails
+            the task for good unless its retry is set, any other exception
+            is retried.
+        worker: This worker's id (defaults to host name and process id)
+        poll_interval: Seconds to wait before looking again when no task
+            is ready
+        stop: Set to stop after the task being run
+        exit_when_empty: Return once no task is queued or running
+        max_tasks: Return after running this many tasks
+        on_task: Called after every task with the task, its result (None
+            if it failed) and the error (None if it succeeded)
+
+    Returns:
+        The number of tasks run
+    """
+    worker = worker or default_worker_id()
+    stop = stop or threading.Event()
+    count = 0
+    while not stop.is_set() and (max_tasks is None or count < max_tasks):
+        task = queue.claim(worker)
+        if task is None:
+            if exit_when_empty:
+                stats = queue.stats()
+                if not stats['queued'] and not stats['running']:
+                    break
+            queue.purge()
+            stop.wait(poll_interval)
+            continue
+
+        result, error = _run_task(queue, task, handler, worker)
+        count += 1
+        if on_task is not None:
+            on_task(task, result, error)
+    return count
+
+
+def _run_task(queue: WorkQueue, task: dict, handler: Callable, worker: str) -> tuple:
+    """Run one claimed task, renewing its lease until the handler returns."""
+    latest = {'progress': None, 'version': 0}
+    done = threading.Event()
+
+    def renew():
+        sent, renewed = 0, time.monotonic()
+        while not done.wait(min(PROGRESS_INTERVAL, queue.lease / 3)):
+            # Progress goes out as it changes, the lease at least every third of it
+            if latest['version'] == sent and time.monotonic() - renewed < queue.lease / 3:
+                continue
+            sent, renewed = latest['version'], time.monotonic()
+            if not queue.heartbeat(task['id'], worker, latest['progress']):
+                logger.warning(f"Lost the lease of task {task['id']}; its result will be dropped")
+                return
+
+    def progress(update: dict):
+        latest['progress'] = dict(latest['progress'] or {}, **update)
+        latest['version'] += 1
+
+    heartbeats = threading.Thread(target=renew, name=f"lease-{task['id'][:8]}", daemon=True)
+    heartbeats.start()
+    try:
+        result = handler(task['payload'], progress)
+    except TaskFailed as e:
+        if e.retry:
+            logger.error(f"Task {task['id']} failed on attempt {task['attempts']}: {str(e)}")
+        queue.fail(task['id'], worker, str(e), e.kind, retry=e.retry)
+        return None, str(e)
+    except Exception as e:
+        logger.error(f"Task {task['id']} failed on attempt {task['attempts']}: {str(e)}")
+        queue.fail(task['id'], worker, str(e))
+        return None, str(e)
+    finally:
+        done.set()
+        heartbeats.join()
+    queue.complete(task['id'], worker, result)
+    return result, None
@@ -0,0 +1,87 @@
+"""
+ZIP archives generated on the fly.
+
+``stream_zip`` yields an archive in chunks as it reads the member files, so
+a response can send it while it is being built and memory use does not
+depend on the size of the archive. PDFs are already compressed, so members
+are STORED by default rather than deflated again.
+"""
+
+import os
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+# Bytes read from a member file at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkSink:
+    """
+    Write-only stream that collects what zipfile writes until it is taken.
+
+    It has no seek(), so zipfile writes in streaming mode: sizes and CRCs
+    follow each member in a data descriptor instead of being patched into
+    its header afterwards.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> Iterator[bytes]:
+        """Yield what has been written since the last call, if anything."""
+        if self._chunks:
+            data = b''.join(self._chunks)
+            self._chunks = []
+            yield data
+
+
+def _unique_name(name: str, used: set) -> str:
+    """Return name, or 'name (2)', 'name (3)'... if it is already in the archive."""
+    stem, ext = os.path.splitext(name)
+    candidate = name
+    counter = 2
+    while candidate in used:
+        candidate = f"{stem} ({counter}){ext}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def stream_zip(members: Iterable[Tuple[str, str]],
+               compression: int = zipfile.ZIP_STORED,
+               chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of files in chunks.
+
+    Args:
+        members: (path on disk, name in the archive) pairs; repeated names
+            get a numbered suffix
+        compression: zipfile compression method for every member
+        chunk_size: Bytes read from disk at a time
+
+    Yields:
+        Consecutive pieces of the archive
+    """
+    sink = _ChunkSink()
+    used = set()
+    with zipfile.ZipFile(sink, 'w', compression) as archive:
+        for path, name in members:
+            info = zipfile.ZipInfo.from_file(path, _unique_name(name, used))
+            info.compress_type = compression
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield from sink.take()
+            yield from sink.take()
+    # The central directory
+    yield from sink.take()